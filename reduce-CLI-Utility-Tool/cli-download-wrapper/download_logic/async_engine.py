@@ -0,0 +1,452 @@
+# download_logic/async_engine.py
+
+"""
+asyncio download engine for the CLI wrapper, built on aiohttp.
+
+It mirrors the synchronous helpers (probe_download, request_server_action,
+download_file) with the same inputs, outputs and hashes, but runs the steps
+that do not depend on each other at the same time:
+
+  - the device fingerprint is loaded while the URL is probed;
+  - sparse samples are fetched while the first sample is read from the probe;
+  - prefix segments are fetched while the first segment is hashed;
+  - in batch mode, probes, server calls and downloads for different URLs
+    overlap, bounded by one concurrency limit.
+
+aiohttp is optional: without it is_available() is False and the callers
+use the synchronous code paths.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import os
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from utils.device_identity import get_system_info
+from utils.decision_cache import get_cached_action, cache_actions
+from utils.helpers import (
+    parse_response_headers,
+    parse_content_range_total,
+    get_total_bytes,
+    get_decoded_size,
+    determine_partial_download_size,
+    uses_sparse_fingerprint,
+    sparse_sample_ranges,
+    sparse_fingerprint_digest,
+    get_multipart_boundary,
+    parse_byteranges,
+    extract_range_samples,
+    build_server_payload,
+    store_partial_hash,
+    HASH_CHUNK_SIZE,
+    HTTP_POOL_SIZE,
+    PARALLEL_HASH_MIN_SIZE,
+    PARALLEL_HASH_SEGMENTS,
+    SPARSE_SAMPLE_COUNT,
+    SPARSE_SAMPLE_SIZE,
+    SERVER_BATCH_SIZE
+)
+from download_logic import download_handler
+from download_logic.download_handler import build_download_metadata
+
+SERVER_URL = "http://127.0.0.1:5050"  # local Host
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 20  # Per socket read, so long downloads are not cut off
+SERVER_TIMEOUT = 60
+MAX_CONNECTIONS = 64
+
+
+def is_available():
+    return aiohttp is not None
+
+
+def create_client_session(max_connections=MAX_CONNECTIONS):
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=HTTP_POOL_SIZE)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def update_hash_from_response(resp, sha256, download_size, chunk_size=HASH_CHUNK_SIZE):
+    """Feeds up to download_size bytes of resp's body into sha256. Returns the bytes fed."""
+    received = 0
+    async for chunk in resp.content.iter_chunked(chunk_size):
+        bytes_needed = download_size - received
+        if len(chunk) > bytes_needed:
+            chunk = memoryview(chunk)[:bytes_needed]
+        sha256.update(chunk)
+        received += len(chunk)
+        if received >= download_size:
+            break
+    return received
+
+
+async def read_body(resp, limit, chunk_size=HASH_CHUNK_SIZE):
+    """Returns up to limit bytes of resp's body."""
+    data = bytearray()
+    async for chunk in resp.content.iter_chunked(chunk_size):
+        data += chunk
+        if len(data) >= limit:
+            break
+    del data[limit:]
+    return data
+
+
+async def fetch_range(session, url, start, end, chunk_size=HASH_CHUNK_SIZE):
+    """Returns bytes start..end (inclusive) of url, or None if the server did not send exactly that range."""
+    expected = end - start + 1
+    async with session.get(url, headers={'Range': f'bytes={start}-{end}'}) as resp:
+        if resp.status != 206:
+            return None
+        data = await read_body(resp, expected, chunk_size)
+    return data if len(data) == expected else None
+
+
+async def fetch_ranges(session, url, ranges):
+    """
+    Async fetch_ranges: one multi-range request, with the ranges it did not
+    cover fetched concurrently. Returns one bytes object per range, or None.
+    """
+    header = "bytes=" + ",".join(f"{start}-{end}" for start, end in ranges)
+    expected_size = sum(end - start + 1 for start, end in ranges)
+    parts = None
+    async with session.get(url, headers={'Range': header}) as resp:
+        boundary = get_multipart_boundary(resp.status, resp.headers)
+        if boundary:
+            body = await read_body(resp, expected_size * 2 + 64 * 1024)
+            parts = parse_byteranges(bytes(body), boundary)
+        elif resp.status == 206:
+            total = resp.headers.get('Content-Range', '')
+            declared_size = get_total_bytes(resp.headers)
+            if total.startswith("bytes ") and (declared_size is None or declared_size <= expected_size * 2):
+                body = await read_body(resp, expected_size * 2 + 1)
+                if len(body) <= expected_size * 2:
+                    parts = [(int(total[6:].split('-')[0]), bytes(body))]
+
+    samples = extract_range_samples(parts, ranges)
+    missing = [i for i, sample in enumerate(samples) if sample is None]
+    fetched = await asyncio.gather(*(fetch_range(session, url, *ranges[i]) for i in missing))
+    for i, data in zip(missing, fetched):
+        if data is None:
+            print(f"Server did not return bytes {ranges[i][0]}-{ranges[i][1]}.")
+            return None
+        samples[i] = data
+    return samples
+
+
+async def compute_sparse_fingerprint(session, url, total_bytes, first_resp):
+    """
+    Async compute_sparse_fingerprint. The first sample is read from the probe
+    response while the other samples are being fetched. If the probe body
+    ends early, the first sample is fetched with a Range request like the
+    others.
+    """
+    ranges = sparse_sample_ranges(total_bytes)
+    try:
+        first_sample, samples = await asyncio.gather(
+            read_body(first_resp, SPARSE_SAMPLE_SIZE, SPARSE_SAMPLE_SIZE),
+            fetch_ranges(session, url, ranges[1:]))
+        if samples is None:
+            return None
+        if len(first_sample) < SPARSE_SAMPLE_SIZE:
+            first_sample = await fetch_range(session, url, *ranges[0])
+            if first_sample is None:
+                print(f"Server did not return bytes {ranges[0][0]}-{ranges[0][1]}.")
+                return None
+        return sparse_fingerprint_digest(total_bytes, [first_sample] + samples)
+    except Exception as e:
+        print(f"Error computing sparse fingerprint: {e}")
+        return None
+
+
+async def hash_prefix(session, url, first_resp, download_size, parallel):
+    """
+    Hashes the first download_size bytes of url, streaming from first_resp.
+    With parallel set, the prefix is split like hash_prefix_in_parallel and
+    the later segments are fetched while the first one is hashed.
+    """
+    sha256 = hashlib.sha256()
+    if not parallel:
+        received = await update_hash_from_response(first_resp, sha256, download_size)
+        if received < download_size:
+            print(f"Downloaded {received} instead of {download_size} bytes.")
+            return None
+        return sha256.hexdigest()
+
+    segment_size = -(-download_size // PARALLEL_HASH_SEGMENTS)
+    ranges = [(start, min(start + segment_size, download_size) - 1)
+              for start in range(segment_size, download_size, segment_size)]
+    segments = asyncio.gather(*(fetch_range(session, url, start, end) for start, end in ranges))
+    received = await update_hash_from_response(first_resp, sha256, segment_size)
+    data_list = await segments
+    if received < segment_size:
+        print(f"Downloaded {received} instead of {segment_size} bytes for the first range.")
+        return None
+    for (start, end), data in zip(ranges, data_list):
+        if data is None:
+            print(f"Server did not return bytes {start}-{end}.")
+            return None
+        sha256.update(data)
+    return sha256.hexdigest()
+
+
+async def probe_download(session, url):
+    """Async probe_download. Returns (headers, capabilities, partial_hash, cached_action)."""
+    headers = {}
+    capabilities = {
+        'range_supported': False,
+        'streaming_supported': False
+    }
+    partial_hash = None
+    try:
+        async with session.get(url, headers={'Range': 'bytes=0-'}, allow_redirects=True) as resp:
+            if resp.status == 416:
+                # Range not satisfiable: an empty file
+                headers = dict((k.lower(), v) for k, v in resp.headers.items())
+                total = parse_content_range_total(headers.pop('content-range', None))
+                headers['content-length'] = str(total if total is not None else 0)
+                return headers, capabilities, None, None
+            if resp.status >= 400:
+                return {}, capabilities, None, None
+
+            headers, capabilities = parse_response_headers(resp.status, resp.headers)
+            cached_action = await asyncio.to_thread(get_cached_action, url, headers)
+            if cached_action is not None:
+                return headers, capabilities, None, cached_action
+
+            total_bytes = get_total_bytes(headers)
+            if total_bytes is None:
+                print("Unknown total size. Skipping file_hash_check_parts.")
+                return headers, capabilities, None, None
+
+            if uses_sparse_fingerprint(capabilities, total_bytes):
+                print(f"Sparse fingerprint: {SPARSE_SAMPLE_COUNT} samples of {SPARSE_SAMPLE_SIZE} bytes.")
+                return headers, capabilities, await compute_sparse_fingerprint(session, url, total_bytes, resp), None
+
+            partial_size = determine_partial_download_size(total_bytes)
+            if partial_size and partial_size > 0:
+                print(f"Partial download size determined: {partial_size} bytes.")
+                capabilities['streaming_supported'] = True
+                parallel = capabilities['range_supported'] and partial_size >= PARALLEL_HASH_MIN_SIZE
+                partial_hash = await hash_prefix(session, url, resp, partial_size, parallel)
+            else:
+                print("No file_hash_check_parts computation required.")
+    except Exception as e:
+        print(f"Failed to probe {url}: {e}")
+    return headers, capabilities, partial_hash, None
+
+
+async def post_to_server(session, path, payload):
+    """Posts payload to the ReDUCE server. Returns the decoded JSON reply, or None."""
+    try:
+        async with session.post(f"{SERVER_URL}{path}", json=payload,
+                                timeout=aiohttp.ClientTimeout(total=SERVER_TIMEOUT)) as resp:
+            if resp.status < 400:
+                return await resp.json()
+            print(f"Server responded with an error: {resp.status} {await resp.text()}")
+            return None
+    except Exception as e:
+        print(f"Failed to communicate with the server: {e}")
+        return None
+
+
+def build_payload(url, headers, partial_hash, device_info):
+    download_id, download_meta_data, fetched_meta_data, download_details = build_download_metadata(url, headers)
+    return build_server_payload(
+        download_id, download_meta_data, fetched_meta_data, download_details, partial_hash, device_info)
+
+
+async def request_server_actions(session, probes, device_info):
+    """
+    Async request_server_actions for up to SERVER_BATCH_SIZE
+    (url, headers, partial_hash) probes.
+    """
+    payloads = [build_payload(*probe, device_info) for probe in probes]
+    result = await post_to_server(session, "/process_downloads", payloads)
+    if result is None or result.get("actions") is None:
+        print("No valid actions received from server. Defaulting to cancel.")
+        server_actions = [None] * len(probes)
+    else:
+        for index, error in result.get("errors", {}).items():
+            print(f"Server rejected download {index} of the batch: {error}")
+        server_actions = result["actions"]
+
+    actions = [-1 if action is None else action for action in server_actions]
+    await asyncio.to_thread(cache_actions, [(url, headers, action) for (url, headers, _), action in zip(probes, actions)])
+    return actions
+
+
+async def handle_download_logic_async(session, url):
+    """Probes url and loads the device fingerprint concurrently, then asks the server."""
+    (headers, _, partial_hash, cached_action), device_info = await asyncio.gather(
+        probe_download(session, url), asyncio.to_thread(get_system_info))
+    if cached_action is not None:
+        print("Using cached server decision.")
+        return cached_action, None
+
+    if partial_hash:
+        print(
+            f"SHA-256 Hash of the downloaded portion: {partial_hash}")
+    elif get_total_bytes(headers):
+        print("Failed to compute file_hash_check_parts.")
+
+    result = await post_to_server(session, "/process_download", build_payload(url, headers, partial_hash, device_info))
+    action = result.get("action") if result else None
+    if action is None:
+        print("No valid action received from server. Defaulting to cancel.")
+        action = -1
+    else:
+        await asyncio.to_thread(cache_actions, [(url, headers, action)])
+    return action, partial_hash
+
+
+def handle_download_logic(url):
+    """
+    Drop-in replacement for download_handler.handle_download_logic, which it
+    falls back to when aiohttp is not installed.
+    """
+    if not is_available():
+        return download_handler.handle_download_logic(url)
+
+    async def run():
+        async with create_client_session() as session:
+            return await handle_download_logic_async(session, url)
+    return asyncio.run(run())
+
+
+async def download_file(session, url, output_path, chunk_size=HASH_CHUNK_SIZE):
+    """Async native_download.download_file. Returns True on success."""
+    part_path = f"{output_path}.part"
+    completed = False
+
+    try:
+        async with session.get(url, allow_redirects=True) as resp:
+            if resp.status >= 400:
+                print(f"Server responded with an error for {url}: {resp.status}")
+                return False
+
+            expected_bytes = get_decoded_size(parse_response_headers(resp.status, resp.headers)[0])
+            received = 0
+            with open(part_path, "wb") as output:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    # Disk writes go to a thread so other transfers keep flowing
+                    await asyncio.to_thread(output.write, chunk)
+                    received += len(chunk)
+
+            if expected_bytes is not None and received != expected_bytes:
+                print(f"Downloaded {received} instead of {expected_bytes} bytes from {url}.")
+            else:
+                os.replace(part_path, output_path)
+                completed = True
+    except Exception as e:
+        print(f"Error downloading {url}: {e}")
+    finally:
+        if not completed and os.path.exists(part_path):
+            os.remove(part_path)
+
+    return completed
+
+
+async def run_batch(entries, workers, totals):
+    """
+    Downloads (url, output_path) entries with at most `workers` probes and
+    downloads in flight. Finished probes are sent to the server in groups of
+    whatever has completed (up to SERVER_BATCH_SIZE) while the next probes
+    run, and each approved download starts as soon as its answer arrives.
+
+    Entries are pulled from `entries` in a worker thread, a few at a time,
+    and at most `workers` + SERVER_BATCH_SIZE of them are between being read
+    and being answered, so memory does not grow with the manifest.
+    """
+    device_info = await asyncio.to_thread(get_system_info)
+    slots = asyncio.Semaphore(workers)
+    unanswered = asyncio.Semaphore(workers + SERVER_BATCH_SIZE)
+    probed = asyncio.Queue()
+    probes = set()      # Running tasks only; finished ones remove themselves
+    downloads = set()
+
+    def start_task(tasks, coro):
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async with create_client_session(max(workers, HTTP_POOL_SIZE)) as session:
+        async def probe(url, output_path):
+            try:
+                headers, _, partial_hash, cached_action = await probe_download(session, url)
+            finally:
+                slots.release()
+            await probed.put((url, output_path, headers, partial_hash, cached_action))
+
+        async def download(url, output_path, partial_hash):
+            try:
+                completed = await download_file(session, url, output_path)
+            finally:
+                slots.release()
+            if completed:
+                print(f"Downloaded '{output_path}'.")
+                if partial_hash:
+                    await asyncio.to_thread(store_partial_hash, output_path, partial_hash)
+            totals["completed" if completed else "failed"] += 1
+
+        async def check_with_server():
+            finished = False
+            while not finished:
+                group = [await probed.get()]
+                while not probed.empty() and len(group) < SERVER_BATCH_SIZE:
+                    group.append(probed.get_nowait())
+                if group[-1] is None:
+                    group.pop()
+                    finished = True
+
+                reachable = []
+                answered = []
+                for url, output_path, headers, partial_hash, cached_action in group:
+                    if not headers:
+                        print(f"Could not fetch headers for {url}.")
+                        totals["failed"] += 1
+                        unanswered.release()
+                    elif cached_action is not None:
+                        answered.append((url, output_path, partial_hash, cached_action))
+                    else:
+                        reachable.append((url, output_path, headers, partial_hash))
+                if answered:
+                    print(f"Using {len(answered)} cached server decisions.")
+
+                if reachable:
+                    actions = await request_server_actions(
+                        session, [(url, headers, partial_hash) for url, _, headers, partial_hash in reachable],
+                        device_info)
+                    answered += [(url, output_path, partial_hash, action)
+                                 for (url, output_path, _, partial_hash), action in zip(reachable, actions)]
+                for url, output_path, partial_hash, action in answered:
+                    unanswered.release()
+                    if action == 0:
+                        # Only started once it has a slot, so at most `workers` downloads exist
+                        await slots.acquire()
+                        start_task(downloads, download(url, output_path, partial_hash))
+                    else:
+                        print(f"Skipping {url}: server returned action {action}.")
+                        totals["skipped"] += 1
+
+        checker = asyncio.create_task(check_with_server())
+        entries = iter(entries)
+        while True:
+            # The manifest may be a slow pipe or a large file: read it off the loop
+            chunk = await asyncio.to_thread(list, itertools.islice(entries, workers))
+            if not chunk:
+                break
+            for url, output_path in chunk:
+                await unanswered.acquire()
+                await slots.acquire()
+                start_task(probes, probe(url, output_path))
+        if probes:
+            await asyncio.wait(set(probes))
+        await probed.put(None)
+        await checker
+        if downloads:
+            await asyncio.wait(set(downloads))
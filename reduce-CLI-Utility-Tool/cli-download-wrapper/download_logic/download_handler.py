@@ -3,101 +3,27 @@
 import random
 import time
 
-import platform
-import os
-import subprocess
-import uuid
-import socket
-
+from utils.device_identity import get_system_info
+from utils.decision_cache import cache_action, cache_actions
 from utils.helpers import (
-    fetch_head,
-    check_server_capabilities,
-    determine_partial_download_size,
-    partial_download_and_hash,
+    probe_download,
+    get_total_bytes,
     get_domain_from_url,
     send_data_to_server,
-    determine_proposed_filename
+    build_server_payload,
+    send_batch_to_server,
+    determine_proposed_filename,
+    SERVER_BATCH_SIZE
 )
 
-def get_system_info():
-    """Gets system information and returns it as a dictionary."""
-    system_info = {}
-
-    def get_device_id():
-        try:
-            if platform.system() == "Linux":
-                with open("/etc/machine-id", "r") as f:
-                    return f.read().strip()
-            elif platform.system() == "Windows":
-                return str(uuid.uuid1())
-            elif platform.system() == "Darwin":
-                return subprocess.check_output("system_profiler SPHardwareDataType | grep 'UUID:'", shell=True).decode().split(":")[1].strip()
-            else:
-                return "Platform not supported for device ID"
-        except FileNotFoundError:
-            return get_mac_address()  # Fallback
-        except Exception as e:
-            print(f"Error getting device ID: {e}")
-            return "Unknown"
-
-    def get_device_name():
-        try:
-            return socket.gethostname()
-        except Exception as e:
-            print(f"Error getting device name: {e}")
-            return "Unknown"
-
-    def get_current_user():
-        try:
-            if platform.system() == "Windows":
-                return os.environ.get("USERNAME")
-            else:
-                return os.environ.get("USER")
-        except Exception as e:
-            print(f"Error getting current user: {e}")
-            return "Unknown"
-
-    def get_mac_address():
-        try:
-            if platform.system() == "Windows":
-                result = subprocess.check_output(["getmac", "/fo", "csv", "/nh"]).decode().strip().split(",")[0].replace('"', '')
-                if result == "":
-                    result = subprocess.check_output(["ipconfig", "/all"]).decode()
-                    mac_address_lines = [line for line in result.splitlines() if "Physical Address" in line]
-                    if mac_address_lines:
-                        mac_address = mac_address_lines[0].split(":")[1].strip().replace("-", ":")
-                        return mac_address
-                    else:
-                        return "MAC not found"
-                return result
-            elif platform.system() == "Linux":
-                result = subprocess.check_output(["ip", "link"]).decode()
-                for line in result.splitlines():
-                    if "link/ether" in line:
-                        return line.split()[2]
-                return "MAC not found"
-            elif platform.system() == "Darwin":
-                result = subprocess.check_output("ifconfig en0 | grep ether", shell=True).decode().split()[1]
-                return result
-            else:
-                return "Platform not supported for MAC address"
-        except Exception as e:
-            print(f"Error getting MAC address: {e}")
-            return "Unknown"
-
-    system_info["device_id"] = get_device_id()
-    system_info["device_name"] = get_device_name()
-    system_info["current_user"] = get_current_user()
-    system_info["mac_address"] = get_mac_address()
-
-    return system_info
-# print(get_system_info())
-
-def handle_download_logic(url):
+def build_download_metadata(url, headers):
+    """
+    Builds the metadata sent to the server for `url` from its response headers.
+    Returns (download_id, download_meta_data, fetched_meta_data, download_details).
+    """
     download_id = random.randint(100000, 999999)
     domain = get_domain_from_url(url)
 
-    headers = fetch_head(url)
     content_length = headers.get('content-length')
     if content_length:
         try:
@@ -137,30 +63,70 @@ def handle_download_logic(url):
         "domain": domain
     }
 
-    capabilities = check_server_capabilities(url)
-
-    if total_bytes is not None:
-        partial_size = determine_partial_download_size(total_bytes)
-        if partial_size and partial_size > 0:
-            print(f"Partial download size determined: {partial_size} bytes.")
-            partial_hash = partial_download_and_hash(
-                url, partial_size, capabilities)
-            if partial_hash:
-                print(
-                    f"SHA-256 Hash of the downloaded portion: {partial_hash}")
-            else:
-                print("Failed to compute file_hash_check_parts.")
-        else:
-            print("No file_hash_check_parts computation required.")
-            partial_hash = None
-    else:
-        print("Unknown total size. Skipping file_hash_check_parts.")
-        partial_hash = None
+    return download_id, download_meta_data, fetched_meta_data, download_details
+
+
+def request_server_action(url, headers, partial_hash):
+    """
+    Asks the server what to do with the download and caches the answer.
+    Returns the action, or -1.
+    """
+    download_id, download_meta_data, fetched_meta_data, download_details = build_download_metadata(url, headers)
     aaa = get_system_info()
     action = send_data_to_server(
         download_id, download_meta_data, fetched_meta_data, download_details, partial_hash, aaa)
     if action is None:
         print("No valid action received from server. Defaulting to cancel.")
         action = -1
+    else:
+        cache_action(url, headers, action)
+
+    return action
 
+
+def handle_download_logic(url):
+    # One ranged GET yields the headers, range support and the partial hash,
+    # or a cached decision, in which case nothing is hashed
+    headers, capabilities, partial_hash, cached_action = probe_download(url)
+    if cached_action is not None:
+        print("Using cached server decision.")
+        return cached_action, None
+
+    if partial_hash:
+        print(
+            f"SHA-256 Hash of the downloaded portion: {partial_hash}")
+    elif get_total_bytes(headers):
+        print("Failed to compute file_hash_check_parts.")
+
+    action = request_server_action(url, headers, partial_hash)
     return action, partial_hash
+
+
+def request_server_actions(probes):
+    """
+    Batch form of request_server_action. `probes` is a list of
+    (url, headers, partial_hash) tuples; the server is asked about them
+    SERVER_BATCH_SIZE at a time. Returns one action per probe, -1 on failure.
+    """
+    actions = [None] * len(probes)
+    if not probes:
+        return actions
+
+    device_info = get_system_info()
+    for start in range(0, len(probes), SERVER_BATCH_SIZE):
+        indexes = range(start, min(start + SERVER_BATCH_SIZE, len(probes)))
+        payloads = []
+        for url, headers, partial_hash in (probes[i] for i in indexes):
+            download_id, download_meta_data, fetched_meta_data, download_details = build_download_metadata(url, headers)
+            payloads.append(build_server_payload(
+                download_id, download_meta_data, fetched_meta_data, download_details, partial_hash, device_info))
+
+        batch_actions = send_batch_to_server(payloads)
+        if batch_actions is None:
+            print("No valid actions received from server. Defaulting to cancel.")
+            batch_actions = [None] * len(payloads)
+        for i, action in zip(indexes, batch_actions):
+            actions[i] = -1 if action is None else action
+        cache_actions([(probes[i][0], probes[i][1], actions[i]) for i in indexes])
+
+    return actions
@@ -0,0 +1,149 @@
+# download_logic/native_download.py
+
+import hashlib
+import os
+
+from download_logic.download_handler import request_server_action
+from utils.decision_cache import get_cached_action
+from utils.helpers import (
+    get_http_session,
+    read_response_headers,
+    get_total_bytes,
+    get_decoded_size,
+    determine_partial_download_size,
+    uses_sparse_fingerprint,
+    compute_sparse_fingerprint,
+    HASH_CHUNK_SIZE
+)
+
+
+def native_download(url, output_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Downloads `url` to `output_path` in a single pass, hashing the partial
+    prefix from the same bytes that are written to disk.
+
+    Once the prefix has been received, the download pauses while the server
+    decides, then either carries on writing (action 0) or aborts and
+    removes the partial file. With the sparse fingerprint the samples are
+    fetched by Range requests and the server is asked before any byte of the
+    body is written, and a cached decision is used as soon as the headers
+    arrive. Data goes to `<output_path>.part` and is renamed into place only
+    when the transfer completes.
+
+    Returns (action, partial_hash, completed).
+    """
+    part_path = f"{output_path}.part"
+    action = None
+    partial_hash = None
+    completed = False
+
+    try:
+        with get_http_session().get(url, stream=True, allow_redirects=True, timeout=(10, 20)) as resp:
+            if resp.status_code >= 400:
+                print(f"Server responded with an error: {resp.status_code}")
+                return -1, None, False
+
+            headers, capabilities = read_response_headers(resp)
+            cached_action = get_cached_action(url, headers)
+            if cached_action is not None:
+                print("Using cached server decision.")
+                return cached_action, None, False
+
+            total_bytes = get_total_bytes(headers)
+            partial_size = determine_partial_download_size(total_bytes) if total_bytes else 0
+            if headers.get('accept-ranges', '').lower() == 'bytes':
+                capabilities['range_supported'] = True
+            if uses_sparse_fingerprint(capabilities, total_bytes):
+                partial_hash = compute_sparse_fingerprint(url, total_bytes)
+                print(f"Sparse fingerprint: {partial_hash}")
+                partial_size = 0
+            elif total_bytes is None:
+                print("Unknown total size. Skipping file_hash_check_parts.")
+            elif partial_size > 0:
+                print(f"Partial download size determined: {partial_size} bytes.")
+            else:
+                print("No file_hash_check_parts computation required.")
+
+            if partial_size <= 0:
+                # Nothing to hash from the body: decide before writing a single byte
+                action = request_server_action(url, headers, partial_hash)
+                if action != 0:
+                    return action, partial_hash, False
+
+            sha256 = hashlib.sha256()
+            received = 0
+            with open(part_path, "wb") as output:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    if action is None:
+                        bytes_needed = partial_size - received
+                        sha256.update(memoryview(chunk)[:bytes_needed] if len(chunk) > bytes_needed else chunk)
+                    output.write(chunk)
+                    received += len(chunk)
+
+                    if action is None and received >= partial_size:
+                        partial_hash = sha256.hexdigest()
+                        print(f"SHA-256 Hash of the downloaded portion: {partial_hash}")
+                        action = request_server_action(url, headers, partial_hash)
+                        if action != 0:
+                            break
+
+            if action is None:
+                # Body ended before the partial hash boundary
+                print("Failed to compute file_hash_check_parts.")
+                action = request_server_action(url, headers, None)
+
+            if action == 0:
+                expected_bytes = get_decoded_size(headers)
+                if expected_bytes is not None and received != expected_bytes:
+                    print(f"Downloaded {received} instead of {expected_bytes} bytes.")
+                else:
+                    os.replace(part_path, output_path)
+                    completed = True
+                    print(f"Downloaded {received} bytes to '{output_path}'.")
+    except Exception as e:
+        print(f"Error during native download of {url}: {e}")
+        if action is None:
+            action = -1
+    finally:
+        if not completed and os.path.exists(part_path):
+            os.remove(part_path)
+
+    return action, partial_hash, completed
+
+
+def download_file(url, output_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Downloads `url` to `output_path` once the server has already approved it.
+    Data goes to `<output_path>.part` and is renamed into place only when the
+    transfer completes. Returns True on success.
+    """
+    part_path = f"{output_path}.part"
+    completed = False
+
+    try:
+        with get_http_session().get(url, stream=True, allow_redirects=True, timeout=(10, 20)) as resp:
+            if resp.status_code >= 400:
+                print(f"Server responded with an error for {url}: {resp.status_code}")
+                return False
+
+            expected_bytes = get_decoded_size(read_response_headers(resp)[0])
+            received = 0
+            with open(part_path, "wb") as output:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    output.write(chunk)
+                    received += len(chunk)
+
+            if expected_bytes is not None and received != expected_bytes:
+                print(f"Downloaded {received} instead of {expected_bytes} bytes from {url}.")
+            else:
+                os.replace(part_path, output_path)
+                completed = True
+    except Exception as e:
+        print(f"Error downloading {url}: {e}")
+    finally:
+        if not completed and os.path.exists(part_path):
+            os.remove(part_path)
+
+    return completed
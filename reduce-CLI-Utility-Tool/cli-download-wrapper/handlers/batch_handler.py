@@ -0,0 +1,181 @@
+# handlers/batch_handler.py
+
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.helpers import (
+    probe_download,
+    determine_proposed_filename,
+    store_partial_hash,
+    SERVER_BATCH_SIZE
+)
+from download_logic.download_handler import request_server_actions
+from download_logic.native_download import download_file
+from download_logic import async_engine
+
+DEFAULT_WORKERS = 8
+
+
+def parse_batch_args(command_args):
+    """Returns (manifest, workers, output_dir), or None if the arguments are invalid."""
+    manifest = None
+    workers = DEFAULT_WORKERS
+    output_dir = "."
+    args = iter(command_args)
+    try:
+        for arg in args:
+            if arg == "--workers":
+                workers = int(next(args))
+            elif arg.startswith("--workers="):
+                workers = int(arg.split("=", 1)[1])
+            elif arg == "--output-dir":
+                output_dir = next(args)
+            elif arg.startswith("--output-dir="):
+                output_dir = arg.split("=", 1)[1]
+            elif manifest is None:
+                manifest = arg
+            else:
+                return None
+    except (StopIteration, ValueError):
+        return None
+
+    if manifest is None or workers < 1:
+        return None
+    return manifest, workers, output_dir
+
+
+def read_manifest(lines):
+    """
+    Yields (url, output_path or None) for each manifest line. A line holds a
+    URL, optionally followed by the output path; blank lines and lines
+    starting with '#' are skipped.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(None, 1)
+        yield parts[0], parts[1] if len(parts) > 1 else None
+
+
+def assign_output_path(url, output_path, output_dir, used_paths):
+    """
+    Picks the output path, adding a '.N' suffix like wget when the name is
+    taken in this batch. A name derived from the URL is also suffixed when
+    the file already exists; a path given in the manifest is overwritten,
+    like wget -O.
+    """
+    if output_path:
+        path, keep_existing = output_path, False
+    else:
+        path, keep_existing = os.path.join(output_dir, determine_proposed_filename(url)), True
+    candidate = path
+    suffix = 1
+    while candidate in used_paths or (keep_existing and os.path.exists(candidate)):
+        candidate = f"{path}.{suffix}"
+        suffix += 1
+    used_paths.add(candidate)
+    return candidate
+
+
+def probe_entry(url):
+    """Returns (url, headers, partial_hash, cached_action) for one manifest URL."""
+    try:
+        headers, _, partial_hash, cached_action = probe_download(url)
+    except Exception as e:
+        print(f"Error probing {url}: {e}")
+        headers, partial_hash, cached_action = {}, None, None
+    return url, headers, partial_hash, cached_action
+
+
+def download_entry(url, output_path, partial_hash):
+    if not download_file(url, output_path):
+        return False
+    print(f"Downloaded '{output_path}'.")
+    if partial_hash:
+        store_partial_hash(output_path, partial_hash)
+    return True
+
+
+def process_group(pool, group, totals):
+    """
+    Probes a group of manifest entries in parallel, asks the server about all
+    of them in one call, then downloads the approved ones in parallel. Used
+    when the asyncio engine (aiohttp) is not available.
+    """
+    probes = list(pool.map(probe_entry, [url for url, _ in group]))
+
+    # URLs that could not be reached are not worth a server round trip, and
+    # neither are the ones with a cached decision
+    reachable = []
+    decided = []
+    for entry, probe in zip(group, probes):
+        if not probe[1]:
+            print(f"Could not fetch headers for {entry[0]}.")
+            totals["failed"] += 1
+        elif probe[3] is not None:
+            decided.append((entry, probe))
+        else:
+            reachable.append((entry, probe))
+    if decided:
+        print(f"Using {len(decided)} cached server decisions.")
+    actions = request_server_actions([probe[:3] for _, probe in reachable])
+
+    approved = []
+    answered = [(entry, probe[2], probe[3]) for entry, probe in decided]
+    answered += [(entry, probe[2], action) for (entry, probe), action in zip(reachable, actions)]
+    for (url, output_path), partial_hash, action in answered:
+        if action == 0:
+            approved.append((url, output_path, partial_hash))
+        else:
+            print(f"Skipping {url}: server returned action {action}.")
+            totals["skipped"] += 1
+
+    results = pool.map(lambda entry: download_entry(*entry), approved)
+    for completed in results:
+        totals["completed" if completed else "failed"] += 1
+
+
+def handle_batch(command_args):
+    parsed = parse_batch_args(command_args)
+    if parsed is None:
+        print("Usage: ddas batch [--workers N] [--output-dir DIR] <manifest | ->")
+        return
+    manifest, workers, output_dir = parsed
+
+    if manifest == "-":
+        manifest_file = sys.stdin
+    else:
+        try:
+            manifest_file = open(manifest, "r")
+        except OSError as e:
+            print(f"Error: cannot read manifest '{manifest}': {e}")
+            return
+
+    os.makedirs(output_dir, exist_ok=True)
+    totals = {"completed": 0, "skipped": 0, "failed": 0}
+    used_paths = set()
+    group = []
+
+    try:
+        if async_engine.is_available():
+            entries = ((url, assign_output_path(url, output_path, output_dir, used_paths))
+                       for url, output_path in read_manifest(manifest_file))
+            asyncio.run(async_engine.run_batch(entries, workers, totals))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for url, output_path in read_manifest(manifest_file):
+                    group.append((url, assign_output_path(url, output_path, output_dir, used_paths)))
+                    if len(group) >= SERVER_BATCH_SIZE:
+                        process_group(pool, group, totals)
+                        group = []
+                if group:
+                    process_group(pool, group, totals)
+    finally:
+        if manifest_file is not sys.stdin:
+            manifest_file.close()
+
+    print(f"Batch finished: {totals['completed']} downloaded, "
+          f"{totals['skipped']} skipped by the server, {totals['failed']} failed.")
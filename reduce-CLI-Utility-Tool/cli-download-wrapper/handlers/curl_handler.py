@@ -7,9 +7,11 @@ from utils.helpers import (
     is_linux,
     extract_url_and_flags,
     determine_proposed_filename,
+    get_native_output_path,
     store_partial_hash
 )
-from download_logic.download_handler import handle_download_logic
+from download_logic.async_engine import handle_download_logic
+from download_logic.native_download import native_download
 
 
 def handle_curl(command_args):
@@ -20,6 +22,19 @@ def handle_curl(command_args):
 
     proposed_filename = determine_proposed_filename(url)
 
+    # Without extra curl flags, download natively: the partial hash comes from
+    # the same bytes written to disk instead of a separate prefix download.
+    native_output = get_native_output_path(flags, ['-o', '--output'], proposed_filename)
+    if native_output:
+        action, partial_hash, completed = native_download(url, native_output)
+        if completed:
+            print("Download completed successfully!")
+            if partial_hash:
+                store_partial_hash(native_output, partial_hash)
+        elif action != 0:
+            report_action(action)
+        return
+
     # Ensure output file is specified
     if not any(flag in flags for flag in ['-O', '--output']):
         flags += ['-o', proposed_filename]
@@ -46,7 +61,12 @@ def handle_curl(command_args):
                     store_partial_hash(proposed_filename, partial_hash)
         except subprocess.CalledProcessError as error:
             print(f"Error during curl execution: {error}")
-    elif action == 1:
+    else:
+        report_action(action)
+
+
+def report_action(action):
+    if action == 1:
         print("Download canceled by server instruction.")
     elif action == -1:
         print("Download remains paused as per server instruction.")
@@ -4,6 +4,7 @@ import sys
 import os
 from handlers.wget_handler import handle_wget
 from handlers.curl_handler import handle_curl
+from handlers.batch_handler import handle_batch
 from handlers.python_handler import handle_python_script
 from handlers.bash_handler import handle_bash_script
 from utils.helpers import print_usage
@@ -27,6 +28,8 @@ def main():
         handle_wget(subcommand_args)
     elif subcommand.lower() == "curl":
         handle_curl(subcommand_args)
+    elif subcommand.lower() == "batch":
+        handle_batch(subcommand_args)
     else:
         script_path = subcommand
         script_args = subcommand_args
@@ -0,0 +1,23 @@
+from handlers.batch_handler import assign_output_path
+
+URL = "https://example.com/files/report.pdf"
+
+
+def test_names_taken_in_the_batch_get_a_suffix(tmp_path):
+    used = set()
+    paths = [assign_output_path(URL, None, str(tmp_path), used) for _ in range(3)]
+    assert paths == [str(tmp_path / name) for name in ('report.pdf', 'report.pdf.1', 'report.pdf.2')]
+
+
+def test_existing_files_are_not_overwritten(tmp_path):
+    (tmp_path / 'report.pdf').write_bytes(b'old')
+    (tmp_path / 'report.pdf.1').write_bytes(b'old')
+    assert assign_output_path(URL, None, str(tmp_path), set()) == str(tmp_path / 'report.pdf.2')
+
+
+def test_manifest_paths_are_used_as_given(tmp_path):
+    target = tmp_path / 'kept.pdf'
+    target.write_bytes(b'old')
+    used = set()
+    assert assign_output_path(URL, str(target), str(tmp_path), used) == str(target)
+    assert assign_output_path(URL, str(target), str(tmp_path), used) == f"{target}.1"
@@ -0,0 +1,111 @@
+import asyncio
+
+import aiohttp
+
+from download_logic import async_engine
+from utils.helpers import extract_range_samples, fetch_ranges, get_multipart_boundary, parse_byteranges
+
+DATA = bytes(range(256)) * 64  # 16 KiB
+RANGES = [(0, 99), (4000, 4099), (8000, 8099)]
+
+
+def multipart_body(boundary, ranges):
+    body = b""
+    for start, end in ranges:
+        body += (f"\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+                 f"Content-Range: bytes {start}-{end}/{len(DATA)}\r\n\r\n").encode()
+        body += DATA[start:end + 1]
+    return body + f"\r\n--{boundary}--\r\n".encode()
+
+
+def parse_range_header(value):
+    return [tuple(int(n) for n in part.split('-')) for part in value[len('bytes='):].split(',')]
+
+
+def merged_span(request):
+    """Answers a multi-range request with one 206 covering every range, without a Content-Length."""
+    ranges = parse_range_header(request.headers['Range'])
+    start, end = ranges[0][0], ranges[-1][1]
+    request.send_response(206)
+    request.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+    request.end_headers()
+    request.wfile.write(DATA[start:end + 1])
+
+
+def single_ranges(request):
+    """Answers one range at a time, like fetch_range expects."""
+    ranges = parse_range_header(request.headers['Range'])
+    if len(ranges) > 1:
+        merged_span(request)
+        return
+    start, end = ranges[0]
+    request.send_response(206)
+    request.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+    request.send_header('Content-Length', str(end - start + 1))
+    request.end_headers()
+    request.wfile.write(DATA[start:end + 1])
+
+
+def test_parse_byteranges_splits_every_part():
+    body = multipart_body('sep', RANGES)
+    assert parse_byteranges(body, 'sep') == [(start, DATA[start:end + 1]) for start, end in RANGES]
+
+
+def test_parse_byteranges_keeps_parts_before_a_malformed_one():
+    body = multipart_body('sep', RANGES[:1]) + b"\r\n--sep\r\nContent-Type: text/plain\r\n\r\nnot a range"
+    assert parse_byteranges(body, 'sep') == [(0, DATA[:100])]
+
+
+def test_get_multipart_boundary():
+    headers = {'Content-Type': 'multipart/byteranges; boundary="3d6b6a416f9b5"; charset=x'}
+    assert get_multipart_boundary(206, headers) == '3d6b6a416f9b5'
+    assert get_multipart_boundary(200, headers) is None
+    assert get_multipart_boundary(206, {'Content-Type': 'application/octet-stream'}) is None
+
+
+def test_extract_range_samples_marks_uncovered_ranges():
+    parts = [(0, DATA[:100]), (4000, DATA[4000:4050])]
+    assert extract_range_samples(parts, RANGES) == [DATA[:100], None, None]
+    assert extract_range_samples(None, RANGES) == [None, None, None]
+
+
+def test_fetch_ranges_reads_the_multipart_answer(http_server):
+    def multipart(request):
+        body = multipart_body('sep', parse_range_header(request.headers['Range']))
+        request.send_response(206)
+        request.send_header('Content-Type', 'multipart/byteranges; boundary=sep')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    http_server.routes['/file'] = multipart
+    samples = fetch_ranges(f"{http_server.url}/file", RANGES)
+    assert samples == [DATA[start:end + 1] for start, end in RANGES]
+    assert len(http_server.requests) == 1
+
+
+def test_fetch_ranges_uses_a_small_unsized_span(http_server):
+    ranges = [(0, 99), (150, 199)]
+    http_server.routes['/file'] = single_ranges
+    samples = fetch_ranges(f"{http_server.url}/file", ranges)
+    assert samples == [DATA[0:100], DATA[150:200]]
+    assert len(http_server.requests) == 1
+
+
+def test_fetch_ranges_does_not_read_a_large_unsized_span(http_server):
+    http_server.routes['/file'] = single_ranges
+    samples = fetch_ranges(f"{http_server.url}/file", RANGES)
+    assert samples == [DATA[start:end + 1] for start, end in RANGES]
+    # The merged span is far larger than the ranges: each range is refetched
+    assert len(http_server.requests) == 1 + len(RANGES)
+
+
+def test_async_fetch_ranges_does_not_read_a_large_unsized_span(http_server):
+    http_server.routes['/file'] = single_ranges
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await async_engine.fetch_ranges(session, f"{http_server.url}/file", RANGES)
+
+    assert asyncio.run(run()) == [DATA[start:end + 1] for start, end in RANGES]
+    assert len(http_server.requests) == 1 + len(RANGES)
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import os
+
+from download_logic import native_download as native
+
+DATA = os.urandom(3 * 1024 * 1024)
+PARTIAL_SIZE = 1024 * 1024  # determine_partial_download_size for a 3 MB file
+CHUNK_SIZE = 64 * 1024
+
+
+def serve(body, headers):
+    def route(request):
+        request.send_response(200)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+    return route
+
+
+def ask_server(monkeypatch, output_path, action=0):
+    """Stands in for the metadata server; records the partial hash and how much was on disk."""
+    calls = []
+
+    def request_server_action(url, headers, partial_hash):
+        calls.append((partial_hash, os.path.getsize(f"{output_path}.part")))
+        return action
+
+    monkeypatch.setattr(native, 'get_cached_action', lambda url, headers: None)
+    monkeypatch.setattr(native, 'request_server_action', request_server_action)
+    return calls
+
+
+def test_download_pauses_at_the_hash_boundary_and_resumes(http_server, tmp_path, monkeypatch):
+    output_path = str(tmp_path / 'file.bin')
+    calls = ask_server(monkeypatch, output_path)
+    http_server.routes['/file'] = serve(DATA, {'Content-Length': str(len(DATA))})
+
+    result = native.native_download(f"{http_server.url}/file", output_path, CHUNK_SIZE)
+
+    partial_hash = hashlib.sha256(DATA[:PARTIAL_SIZE]).hexdigest()
+    assert result == (0, partial_hash, True)
+    # Asked once, with no more than the prefix written
+    assert calls == [(partial_hash, PARTIAL_SIZE)]
+    with open(output_path, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_refused_download_leaves_no_file(http_server, tmp_path, monkeypatch):
+    output_path = str(tmp_path / 'file.bin')
+    ask_server(monkeypatch, output_path, action=1)
+    http_server.routes['/file'] = serve(DATA, {'Content-Length': str(len(DATA))})
+
+    action, _, completed = native.native_download(f"{http_server.url}/file", output_path, CHUNK_SIZE)
+
+    assert (action, completed) == (1, False)
+    assert os.listdir(tmp_path) == []
+
+
+def test_gzip_body_is_not_reported_as_truncated(http_server, tmp_path, monkeypatch):
+    output_path = str(tmp_path / 'file.bin')
+    ask_server(monkeypatch, output_path)
+    body = gzip.compress(DATA)
+    http_server.routes['/file'] = serve(body, {'Content-Length': str(len(body)), 'Content-Encoding': 'gzip'})
+
+    action, _, completed = native.native_download(f"{http_server.url}/file", output_path, CHUNK_SIZE)
+
+    assert (action, completed) == (0, True)
+    with open(output_path, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_short_body_is_not_kept(http_server, tmp_path, monkeypatch):
+    output_path = str(tmp_path / 'file.bin')
+    ask_server(monkeypatch, output_path)
+    # Claims the full size, then closes the connection early
+    http_server.routes['/file'] = serve(DATA[:-1024], {'Content-Length': str(len(DATA))})
+
+    action, _, completed = native.native_download(f"{http_server.url}/file", output_path, CHUNK_SIZE)
+
+    assert (action, completed) == (0, False)
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_file_accepts_a_gzip_body(http_server, tmp_path):
+    output_path = str(tmp_path / 'file.bin')
+    body = gzip.compress(DATA)
+    http_server.routes['/file'] = serve(body, {'Content-Length': str(len(body)), 'Content-Encoding': 'gzip'})
+
+    assert native.download_file(f"{http_server.url}/file", output_path)
+    with open(output_path, 'rb') as f:
+        assert f.read() == DATA
@@ -0,0 +1,133 @@
+# utils/decision_cache.py
+
+"""
+Local cache of the server's duplicate decisions, so re-running the same
+download list does not post every URL to /process_download again.
+
+Entries are keyed by URL and store the validators the decision was made
+for: ETag, Content-Length and Last-Modified. They are looked up as soon as
+the probe's response headers arrive, before any of the body is hashed. A
+cached decision is reused only while all three still match the fresh
+response headers and the entry is younger than DECISION_TTL_SECONDS.
+Otherwise the server is asked again and the entry is replaced.
+
+Only "do not download" answers are cached. After a "proceed" answer the
+server records the download, so the next answer for the same file will be
+different and has to come from the server. A "do not download" answer stops
+being true once the server record is deleted (the file monitor does this
+when the last local copy is removed), which the cache cannot see, so the
+TTL is kept short.
+
+A download skipped on a cached answer never reaches the server, so it is
+not recorded as a cancelled download: /cancelled_download_stats counts
+only the skips the server decided itself.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from utils.device_identity import get_cache_path
+
+DECISION_TTL_SECONDS = 5 * 60
+CACHE_FILENAME = "decisions.db"
+
+_connection = None
+_lock = threading.Lock()
+
+
+def get_decision_cache_path():
+    return os.path.join(os.path.dirname(get_cache_path()), CACHE_FILENAME)
+
+
+def get_connection():
+    """Opens the cache database once per process. Returns None if it cannot be opened."""
+    global _connection
+    if _connection is None:
+        try:
+            path = get_decision_cache_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS decisions (
+                    final_url TEXT PRIMARY KEY,
+                    etag TEXT NOT NULL,
+                    content_length TEXT NOT NULL,
+                    last_modified TEXT NOT NULL,
+                    action INTEGER NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('DELETE FROM decisions WHERE stored_at < ?', (time.time() - DECISION_TTL_SECONDS,))
+            conn.commit()
+            _connection = conn
+        except sqlite3.Error as e:
+            print(f"Decision cache unavailable: {e}")
+            return None
+    return _connection
+
+
+def get_validators(headers):
+    """Returns (etag, content_length, last_modified), or None if the response has no validator."""
+    validators = (headers.get('etag', ''), headers.get('content-length', ''), headers.get('last-modified', ''))
+    # Content-Length alone says too little about whether the file changed
+    if not validators[0] and not validators[2]:
+        return None
+    return validators
+
+
+def get_cached_actions(entries):
+    """
+    Looks up (url, headers) entries. Returns one cached action per entry,
+    None where the server has to be asked.
+    """
+    actions = [None] * len(entries)
+    with _lock:
+        conn = get_connection()
+        if conn is None:
+            return actions
+        oldest = time.time() - DECISION_TTL_SECONDS
+        try:
+            for index, (url, headers) in enumerate(entries):
+                validators = get_validators(headers)
+                if validators is None:
+                    continue
+                row = conn.execute(
+                    'SELECT action FROM decisions WHERE final_url = ? AND etag = ? AND content_length = ? '
+                    'AND last_modified = ? AND stored_at >= ?', (url, *validators, oldest)).fetchone()
+                if row:
+                    actions[index] = row[0]
+        except sqlite3.Error as e:
+            print(f"Error reading decision cache: {e}")
+    return actions
+
+
+def cache_actions(entries):
+    """Stores the server's answers for (url, headers, action) entries."""
+    now = time.time()
+    rows = []
+    for url, headers, action in entries:
+        validators = get_validators(headers)
+        if validators is not None and action not in (0, -1, None):
+            rows.append((url, *validators, action, now))
+    if not rows:
+        return
+    with _lock:
+        conn = get_connection()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?, ?)', rows)
+        except sqlite3.Error as e:
+            print(f"Error writing decision cache: {e}")
+
+
+def get_cached_action(url, headers):
+    return get_cached_actions([(url, headers)])[0]
+
+
+def cache_action(url, headers, action):
+    cache_actions([(url, headers, action)])
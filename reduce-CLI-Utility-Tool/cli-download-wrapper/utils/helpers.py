@@ -11,12 +11,39 @@ import hashlib
 import requests
 import os
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from utils.decision_cache import get_cached_action
 
 try:
     import xattr  # For Linux/macOS if installed
 except ImportError:
     xattr = None
 
+HTTP_POOL_SIZE = 16  # Keep-alive connections kept per host
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read per chunk while hashing a download prefix
+PARALLEL_HASH_MIN_SIZE = 20 * 1024 * 1024  # Prefixes this large are fetched as parallel ranges
+PARALLEL_HASH_SEGMENTS = 4  # Concurrent Range requests per prefix
+
+# Fingerprint scheme: 'prefix' hashes a contiguous prefix of up to 20 MB
+# (large prefixes are fetched as parallel ranges), 'sparse' hashes a few small
+# samples spread across the file (fetched with one multi-range request).
+# Sparse is opt-in: its hashes do not match the prefix hashes already stored
+# by the server and on disk. It falls back to prefix when the server has no
+# range support or the file is small enough to hash whole.
+FINGERPRINT_MODE = 'prefix'
+SPARSE_FINGERPRINT_VERSION = 'v2'
+SPARSE_SAMPLE_COUNT = 9  # Start, end, middle and evenly spaced points between
+SPARSE_SAMPLE_SIZE = 4096
+SPARSE_MIN_FILE_SIZE = 1024 * 1024  # Smaller files are hashed whole
+
+SERVER_BATCH_SIZE = 500  # Downloads checked per /process_downloads call
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
 
 def is_windows():
     return platform.system().lower() == "windows"
@@ -50,9 +77,26 @@ def extract_url_and_flags(args):
     return url, flags
 
 
+def get_http_session():
+    """
+    Returns the process-wide requests.Session, so every request to the same
+    host reuses a pooled keep-alive connection instead of a new TCP/TLS
+    handshake.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+    return _http_session
+
+
 def fetch_head(url):
     try:
-        resp = requests.head(url, allow_redirects=True, timeout=10)
+        resp = get_http_session().head(url, allow_redirects=True, timeout=10)
         if resp.status_code < 400:
             headers = dict((k.lower(), v) for k, v in resp.headers.items())
             return headers
@@ -69,13 +113,13 @@ def check_server_capabilities(url):
         'streaming_supported': False
     }
     try:
-        head_resp = requests.head(url, allow_redirects=True, timeout=10)
+        head_resp = get_http_session().head(url, allow_redirects=True, timeout=10)
         if head_resp.ok:
             accept_ranges = head_resp.headers.get('Accept-Ranges')
             if accept_ranges and accept_ranges.lower() == 'bytes':
                 capabilities['range_supported'] = True
 
-        get_resp = requests.get(url, stream=True, timeout=10)
+        get_resp = get_http_session().get(url, stream=True, timeout=10)
         if get_resp.ok:
             transfer_encoding = get_resp.headers.get('Transfer-Encoding')
             if transfer_encoding and transfer_encoding.lower() == 'chunked':
@@ -109,55 +153,385 @@ def determine_partial_download_size(total_bytes):
             return int(20 * MB)
 
 
-def partial_download_and_hash(url, download_size, capabilities):
-    downloaded_data = bytearray()
+def hash_response_prefix(resp, download_size, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Feeds the first download_size bytes of a streamed response body into an
+    incremental SHA-256 as they arrive and returns the hex digest, or None if
+    the body is shorter. Only one chunk is held in memory at a time; the
+    final chunk is truncated through a memoryview instead of a copy.
+    """
+    sha256 = hashlib.sha256()
+    received = update_hash_from_response(resp, sha256, download_size, chunk_size)
+
+    if received < download_size:
+        print(f"Downloaded {received} instead of {download_size} bytes.")
+        return None
+
+    return sha256.hexdigest()
+
+
+def update_hash_from_response(resp, sha256, download_size, chunk_size=HASH_CHUNK_SIZE):
+    """Feeds up to download_size bytes of resp's body into sha256. Returns the bytes fed."""
+    received = 0
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        if chunk:
+            bytes_needed = download_size - received
+            if len(chunk) > bytes_needed:
+                chunk = memoryview(chunk)[:bytes_needed]
+            sha256.update(chunk)
+            received += len(chunk)
+            if received >= download_size:
+                break
+    return received
+
+
+def read_body(resp, limit, chunk_size=HASH_CHUNK_SIZE):
+    """Returns up to limit bytes of resp's body."""
+    data = bytearray()
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        data += chunk
+        if len(data) >= limit:
+            break
+    del data[limit:]
+    return data
+
+
+def fetch_range(url, start, end, chunk_size=HASH_CHUNK_SIZE):
+    """Returns bytes start..end (inclusive) of url, or None if the server did not send exactly that range."""
+    expected = end - start + 1
+    with get_http_session().get(url, headers={'Range': f'bytes={start}-{end}'},
+                                stream=True, timeout=(10, 20)) as resp:
+        if resp.status_code != 206:
+            return None
+        data = read_body(resp, expected, chunk_size)
+    return data if len(data) == expected else None
+
+
+def hash_prefix_in_parallel(url, first_resp, download_size,
+                            segments=PARALLEL_HASH_SEGMENTS, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Hashes the first download_size bytes of url by splitting them into
+    `segments` ranges. The first range is streamed from first_resp, an open
+    response that starts at byte 0, and the others are fetched concurrently
+    over the shared session's connection pool. The segments are fed into one
+    SHA-256 in order, so the digest is identical to hash_response_prefix's
+    and still matches hashes computed by other ReDUCE clients.
+    """
+    segment_size = -(-download_size // segments)
+    ranges = [(start, min(start + segment_size, download_size) - 1)
+              for start in range(segment_size, download_size, segment_size)]
+
+    sha256 = hashlib.sha256()
+    with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as pool:
+        futures = [pool.submit(fetch_range, url, start, end, chunk_size) for start, end in ranges]
+        received = update_hash_from_response(first_resp, sha256, segment_size, chunk_size)
+        if received < min(segment_size, download_size):
+            print(f"Downloaded {received} instead of {segment_size} bytes for the first range.")
+            return None
+        for (start, end), future in zip(ranges, futures):
+            data = future.result()
+            if data is None:
+                print(f"Server did not return bytes {start}-{end}.")
+                return None
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def partial_download_and_hash(url, download_size, capabilities, chunk_size=HASH_CHUNK_SIZE):
     try:
         if capabilities['range_supported']:
-            headers = {'Range': f'bytes=0-{download_size-1}'}
-            resp = requests.get(url, headers=headers, stream=True, timeout=20)
+            parallel = download_size >= PARALLEL_HASH_MIN_SIZE
+            first_size = -(-download_size // PARALLEL_HASH_SEGMENTS) if parallel else download_size
+            headers = {'Range': f'bytes=0-{first_size-1}'}
+            resp = get_http_session().get(url, headers=headers, stream=True, timeout=20)
             if resp.status_code == 206:
-                for chunk in resp.iter_content(chunk_size=4096):
-                    if chunk:
-                        bytes_needed = download_size - len(downloaded_data)
-                        if bytes_needed <= 0:
-                            break
-                        piece = chunk[:bytes_needed]
-                        downloaded_data.extend(piece)
-                        if len(downloaded_data) >= download_size:
-                            break
+                with resp:
+                    if parallel:
+                        return hash_prefix_in_parallel(url, resp, download_size, chunk_size=chunk_size)
+                    return hash_response_prefix(resp, download_size, chunk_size)
             else:
+                resp.close()
                 print("Server did not honor Range header.")
                 return None
         elif capabilities['streaming_supported']:
-            resp = requests.get(url, stream=True, timeout=20)
+            resp = get_http_session().get(url, stream=True, timeout=20)
             if resp.ok:
-                for chunk in resp.iter_content(chunk_size=4096):
-                    if chunk:
-                        bytes_needed = download_size - len(downloaded_data)
-                        if bytes_needed <= 0:
-                            break
-                        piece = chunk[:bytes_needed]
-                        downloaded_data.extend(piece)
-                        if len(downloaded_data) >= download_size:
-                            break
+                with resp:
+                    return hash_response_prefix(resp, download_size, chunk_size)
             else:
+                resp.close()
                 print("Failed to GET the URL for streaming.")
                 return None
         else:
             print("No range or streaming support for partial download.")
             return None
+    except Exception as e:
+        print(f"Error during partial download and hashing: {e}")
+        return None
+
+
+def parse_content_range_total(content_range):
+    """Returns the full size from a 'bytes 0-99/1234' or 'bytes */1234' header, or None."""
+    if not content_range or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1].strip()
+    return int(total) if total.isdigit() else None
 
-        if len(downloaded_data) < download_size:
-            print(f"Downloaded {len(downloaded_data)} instead of {download_size} bytes.")
+
+def read_response_headers(resp):
+    """
+    Lowercases a GET response's headers into the same shape fetch_head
+    returns. For a 206 reply, content-length is replaced by the full size
+    from Content-Range. Returns (headers, capabilities).
+    """
+    return parse_response_headers(resp.status_code, resp.headers)
+
+
+def parse_response_headers(status_code, response_headers):
+    """read_response_headers for any HTTP client: takes the status and header mapping."""
+    capabilities = {
+        'range_supported': False,
+        'streaming_supported': False
+    }
+    headers = dict((k.lower(), v) for k, v in response_headers.items())
+    if status_code == 206:
+        capabilities['range_supported'] = True
+        total = parse_content_range_total(headers.pop('content-range', None))
+        if total is not None:
+            headers['content-length'] = str(total)
+        else:
+            headers.pop('content-length', None)
+    transfer_encoding = headers.get('transfer-encoding')
+    if transfer_encoding and transfer_encoding.lower() == 'chunked':
+        capabilities['streaming_supported'] = True
+    return headers, capabilities
+
+
+def get_total_bytes(headers):
+    content_length = headers.get('content-length')
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+
+def get_decoded_size(headers):
+    """
+    Returns how many bytes the decoded body should have, or None if unknown.
+    Content-Length counts the bytes on the wire, so for a gzip or br encoded
+    body, which HTTP clients decode as they read, the size is unknown.
+    """
+    if headers.get('content-encoding', 'identity').lower() != 'identity':
+        return None
+    return get_total_bytes(headers)
+
+
+def probe_download(url):
+    """
+    Replaces fetch_head + check_server_capabilities + partial_download_and_hash
+    with a single request on the shared session: a GET with 'Range: bytes=0-'.
+    Its response headers give the metadata and range support, and the first
+    bytes of its body give the partial hash, after which the connection is
+    closed. If the decision cache already holds an answer for the URL and the
+    response's validators, nothing is hashed.
+
+    Returns (headers, capabilities, partial_hash, cached_action). headers is
+    lowercased like fetch_head's, with content-length set to the full size of
+    the file. cached_action is None unless a cached answer was found.
+    """
+    headers = {}
+    capabilities = {
+        'range_supported': False,
+        'streaming_supported': False
+    }
+    partial_hash = None
+    try:
+        with get_http_session().get(url, headers={'Range': 'bytes=0-'}, stream=True,
+                                    allow_redirects=True, timeout=(10, 20)) as resp:
+            if resp.status_code == 416:
+                # Range not satisfiable: an empty file
+                headers = dict((k.lower(), v) for k, v in resp.headers.items())
+                total = parse_content_range_total(headers.pop('content-range', None))
+                headers['content-length'] = str(total if total is not None else 0)
+                return headers, capabilities, None, None
+            if resp.status_code >= 400:
+                return {}, capabilities, None, None
+
+            headers, capabilities = read_response_headers(resp)
+            cached_action = get_cached_action(url, headers)
+            if cached_action is not None:
+                return headers, capabilities, None, cached_action
+
+            total_bytes = get_total_bytes(headers)
+            if total_bytes is None:
+                print("Unknown total size. Skipping file_hash_check_parts.")
+                return headers, capabilities, None, None
+
+            if uses_sparse_fingerprint(capabilities, total_bytes):
+                print(f"Sparse fingerprint: {SPARSE_SAMPLE_COUNT} samples of {SPARSE_SAMPLE_SIZE} bytes.")
+                return headers, capabilities, compute_sparse_fingerprint(url, total_bytes, resp), None
+
+            partial_size = determine_partial_download_size(total_bytes)
+            if partial_size and partial_size > 0:
+                print(f"Partial download size determined: {partial_size} bytes.")
+                capabilities['streaming_supported'] = True
+                if capabilities['range_supported'] and partial_size >= PARALLEL_HASH_MIN_SIZE:
+                    partial_hash = hash_prefix_in_parallel(url, resp, partial_size)
+                else:
+                    partial_hash = hash_response_prefix(resp, partial_size)
+            else:
+                print("No file_hash_check_parts computation required.")
+    except Exception as e:
+        print(f"Failed to probe {url}: {e}")
+    return headers, capabilities, partial_hash, None
+
+
+def uses_sparse_fingerprint(capabilities, total_bytes):
+    return (FINGERPRINT_MODE == 'sparse' and capabilities['range_supported']
+            and total_bytes is not None and total_bytes > SPARSE_MIN_FILE_SIZE)
+
+
+def sparse_sample_ranges(total_bytes):
+    """Returns the inclusive (start, end) byte ranges sampled by the sparse fingerprint."""
+    last_start = total_bytes - SPARSE_SAMPLE_SIZE
+    starts = [i * last_start // (SPARSE_SAMPLE_COUNT - 1) for i in range(SPARSE_SAMPLE_COUNT)]
+    return [(start, start + SPARSE_SAMPLE_SIZE - 1) for start in starts]
+
+
+def parse_byteranges(body, boundary):
+    """
+    Splits a multipart/byteranges body into a list of (start, data) parts,
+    using each part's Content-Range to find where its data ends.
+    """
+    parts = []
+    delimiter = b"--" + boundary.encode('latin-1')
+    pos = body.find(delimiter)
+    while pos != -1:
+        pos += len(delimiter)
+        if body[pos:pos + 2] == b"--":
+            break
+        header_end = body.find(b"\r\n\r\n", pos)
+        if header_end == -1:
+            break
+        content_range = None
+        for line in body[pos:header_end].decode('latin-1').split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-range":
+                content_range = value.strip()
+        if not content_range or not content_range.startswith("bytes "):
+            break
+        start, _, end = content_range[6:].split("/")[0].partition("-")
+        data_start = header_end + 4
+        data_end = data_start + int(end) - int(start) + 1
+        parts.append((int(start), body[data_start:data_end]))
+        pos = body.find(delimiter, data_end)
+    return parts
+
+
+def get_multipart_boundary(status_code, response_headers):
+    """Returns the boundary of a multipart/byteranges 206 response, or None."""
+    content_type = response_headers.get('Content-Type', '')
+    if status_code == 206 and content_type.startswith('multipart/byteranges') and 'boundary=' in content_type:
+        return content_type.split('boundary=', 1)[1].split(';')[0].strip().strip('"')
+    return None
+
+
+def extract_range_samples(parts, ranges):
+    """Cuts each (start, end) range out of the received (start, data) parts; None where not covered."""
+    samples = []
+    for start, end in ranges:
+        sample = None
+        for part_start, data in parts or []:
+            if part_start <= start and end < part_start + len(data):
+                sample = data[start - part_start:end - part_start + 1]
+                break
+        samples.append(sample)
+    return samples
+
+
+def fetch_ranges(url, ranges):
+    """
+    Fetches several byte ranges of url with one multi-range request, falling
+    back to concurrent single-range requests if the server does not answer
+    with multipart/byteranges. Returns one bytes object per range, or None.
+    """
+    header = "bytes=" + ",".join(f"{start}-{end}" for start, end in ranges)
+    expected_size = sum(end - start + 1 for start, end in ranges)
+    parts = None
+    with get_http_session().get(url, headers={'Range': header}, stream=True, timeout=(10, 20)) as resp:
+        boundary = get_multipart_boundary(resp.status_code, resp.headers)
+        if boundary:
+            # Multipart overhead is small; a much larger body means the server
+            # merged the ranges into a big span, so fetch them one by one instead.
+            body = resp.raw.read(expected_size * 2 + 64 * 1024, decode_content=True)
+            parts = parse_byteranges(body, boundary)
+        elif resp.status_code == 206:
+            total = resp.headers.get('Content-Range', '')
+            declared_size = get_total_bytes(resp.headers)
+            if total.startswith("bytes ") and (declared_size is None or declared_size <= expected_size * 2):
+                # Chunked or unsized bodies are read one byte past the limit
+                # to tell a span that fits from one that does not
+                body = read_body(resp, expected_size * 2 + 1)
+                if len(body) <= expected_size * 2:
+                    parts = [(int(total[6:].split('-')[0]), bytes(body))]
+
+    samples = extract_range_samples(parts, ranges)
+    missing = [i for i, sample in enumerate(samples) if sample is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(len(missing), HTTP_POOL_SIZE)) as pool:
+            fetched = pool.map(lambda i: fetch_range(url, *ranges[i]), missing)
+            for i, data in zip(missing, fetched):
+                if data is None:
+                    print(f"Server did not return bytes {ranges[i][0]}-{ranges[i][1]}.")
+                    return None
+                samples[i] = data
+    return samples
+
+
+def compute_sparse_fingerprint(url, total_bytes, first_resp=None):
+    """
+    Hashes SPARSE_SAMPLE_COUNT samples of SPARSE_SAMPLE_SIZE bytes at fixed
+    offsets spread across the file (start, end, middle and evenly spaced
+    points), together with the file size. Only a few KB are fetched, whatever
+    the file size. If first_resp is an open response starting at byte 0, the
+    first sample is read from it.
+
+    Returns '<SPARSE_FINGERPRINT_VERSION>:<sha256 hex>', or None on failure.
+    The version prefix keeps it apart from plain prefix hashes in
+    partial_hash_verify.
+    """
+    ranges = sparse_sample_ranges(total_bytes)
+    try:
+        first_sample = None
+        if first_resp is not None:
+            first_sample = bytearray()
+            for chunk in first_resp.iter_content(chunk_size=SPARSE_SAMPLE_SIZE):
+                first_sample += chunk
+                if len(first_sample) >= SPARSE_SAMPLE_SIZE:
+                    break
+            del first_sample[SPARSE_SAMPLE_SIZE:]
+            if len(first_sample) < SPARSE_SAMPLE_SIZE:
+                first_sample = None
+
+        samples = fetch_ranges(url, ranges[1:] if first_sample is not None else ranges)
+        if samples is None:
             return None
+        if first_sample is not None:
+            samples.insert(0, first_sample)
 
-        sha256_hash = hashlib.sha256(downloaded_data).hexdigest()
-        return sha256_hash
+        return sparse_fingerprint_digest(total_bytes, samples)
     except Exception as e:
-        print(f"Error during partial download and hashing: {e}")
+        print(f"Error computing sparse fingerprint: {e}")
         return None
 
 
+def sparse_fingerprint_digest(total_bytes, samples):
+    """Hashes the file size and the samples, in order, into a versioned fingerprint."""
+    sha256 = hashlib.sha256()
+    sha256.update(SPARSE_FINGERPRINT_VERSION.encode())
+    sha256.update(total_bytes.to_bytes(8, 'big'))
+    for sample in samples:
+        sha256.update(sample)
+    return f"{SPARSE_FINGERPRINT_VERSION}:{sha256.hexdigest()}"
+
+
 def get_domain_from_url(url):
     try:
         parsed = urllib.parse.urlparse(url)
@@ -166,8 +540,8 @@ def get_domain_from_url(url):
         return "unknown-domain"
 
 
-def send_data_to_server(id_value, download_meta_data, fetched_meta_data, download_details, partial_hash, deviceInfo):
-    payload = {
+def build_server_payload(id_value, download_meta_data, fetched_meta_data, download_details, partial_hash, deviceInfo):
+    return {
         "id": id_value,
         "data": {
             "download_meta_data": download_meta_data,
@@ -178,8 +552,13 @@ def send_data_to_server(id_value, download_meta_data, fetched_meta_data, downloa
         }
     }
 
+
+def send_data_to_server(id_value, download_meta_data, fetched_meta_data, download_details, partial_hash, deviceInfo):
+    payload = build_server_payload(
+        id_value, download_meta_data, fetched_meta_data, download_details, partial_hash, deviceInfo)
+
     try:
-        resp = requests.post("http://127.0.0.1:5050/process_download", json=payload, timeout=10) #local Host
+        resp = get_http_session().post("http://127.0.0.1:5050/process_download", json=payload, timeout=10) #local Host
         # resp = requests.post("https://f614-103-102-86-3.ngrok-free.app", json=payload, timeout=10)
         if resp.ok:
             result = resp.json()
@@ -192,6 +571,45 @@ def send_data_to_server(id_value, download_meta_data, fetched_meta_data, downloa
         return None
 
 
+def send_batch_to_server(payloads):
+    """
+    Sends up to SERVER_BATCH_SIZE payloads to /process_downloads in one call.
+    Returns their actions in order (None for payloads the server rejected),
+    or None if the request failed.
+    """
+    try:
+        resp = get_http_session().post("http://127.0.0.1:5050/process_downloads", json=payloads, timeout=60) #local Host
+        if resp.ok:
+            result = resp.json()
+            for index, error in result.get("errors", {}).items():
+                print(f"Server rejected download {index} of the batch: {error}")
+            return result.get("actions")
+        else:
+            print(f"Server responded with an error: {resp.status_code} {resp.text}")
+            return None
+    except Exception as e:
+        print(f"Failed to communicate with the server: {e}")
+        return None
+
+
+def get_native_output_path(flags, output_flags, default_filename):
+    """
+    Returns the file to write when a wget/curl command can be served by the
+    built-in downloader: it has no flags, or only an output-file flag.
+    Returns None when other flags are present, since only the real tool can
+    honour them.
+    """
+    if not flags:
+        return default_filename
+    if len(flags) == 2 and flags[0] in output_flags and flags[1] != '-':
+        return flags[1]
+    if len(flags) == 1:
+        for flag in output_flags:
+            if flag.startswith('--') and flags[0].startswith(flag + '=') and flags[0] != flag + '=-':
+                return flags[0][len(flag) + 1:]
+    return None
+
+
 def determine_proposed_filename(url):
     return os.path.basename(urllib.parse.urlparse(url).path) or "downloaded_file"
 
@@ -204,6 +622,9 @@ Available commands:
   hello                         Print 'Hello, World!'
   wget [wget_options] <URL>     Run native wget with the specified arguments
   curl [curl_options] <URL>     Run native curl with the specified arguments
+  batch [options] <manifest>    Download every URL in a manifest file ('-' for stdin)
+      --workers N               Concurrent downloads (default 8)
+      --output-dir DIR          Directory for downloaded files (default: current)
 
 Help:
   -h, --help                    Show this help message and exit
@@ -224,6 +645,16 @@ Help:
     print(usage_text.strip())
 
 
+def get_hash_attribute_name(hash_value):
+    """
+    Versioned fingerprints ('v2:...') are stored under a versioned attribute
+    next to the original 'file_hash_check_parts'.
+    """
+    if hash_value.startswith(f"{SPARSE_FINGERPRINT_VERSION}:"):
+        return f"file_hash_check_parts.{SPARSE_FINGERPRINT_VERSION}"
+    return "file_hash_check_parts"
+
+
 def store_partial_hash(file_path, hash_value):
     # Replacing 'partial_hash' with 'file_hash_check_parts'
     if is_windows():
@@ -235,7 +666,7 @@ def store_partial_hash(file_path, hash_value):
 
 
 def store_partial_hash_ads(filename, hash_value):
-    ads_name = f"{filename}:file_hash_check_parts"
+    ads_name = f"{filename}:{get_hash_attribute_name(hash_value)}"
     try:
         with open(ads_name, "w") as ads:
             ads.write(hash_value)
@@ -252,8 +683,8 @@ def store_partial_hash_xattr(filename, hash_value):
     try:
         # Using pyxattr's functional interface
         # Attribute keys must be bytes, and conventionally start with 'user.'
-        xattr.setxattr(filename, b"user.file_hash_check_parts",
-                       hash_value.encode('utf-8'))
+        attribute = f"user.{get_hash_attribute_name(hash_value)}".encode('utf-8')
+        xattr.setxattr(filename, attribute, hash_value.encode('utf-8'))
         print(f"file_hash_check_parts stored as extended attribute in '{filename}'.")
     except Exception as e:
         print(
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Compares the monitor's Linux event backends on a generated tree: watchdog's
+Observer, InotifyObserver and FanotifyObserver (linux_monitor.py).
+
+For each backend it measures:
+
+    ready     time from start() until every directory is watched
+    attrib    time until ATTRIB_CHANGES xattr changes have reached the handler
+    writes    CPU time this process spends while another process writes and
+              deletes WRITE_FILES files of WRITE_SIZE bytes, and the number of
+              handler calls those writes caused
+
+The handler only counts events, so the numbers are the cost of the backend
+itself. The fanotify backend needs root (CAP_SYS_ADMIN); without it that
+row is skipped.
+
+Usage:
+    python benchmarks/bench_backends.py [--root DIR] [--width 100] [--files 100]
+
+The default tree has 1 + 100 + 100 * 100 = 10,101 directories and 100 files
+in each leaf directory, 1,000,000 files in all. It is created once under
+--root and reused by later runs.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from linux_monitor import FanotifyObserver, InotifyObserver
+
+ATTRIB_CHANGES = 1000
+WRITE_FILES = 200
+WRITE_SIZE = 512 * 1024
+TIMEOUT_SECONDS = 120
+
+WRITER = '''
+import os, sys
+directory, count, size = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+data = b"x" * 65536
+for i in range(count):
+    path = os.path.join(directory, f"write-{i}.bin")
+    with open(path, "wb") as f:
+        for _ in range(size // len(data)):
+            f.write(data)
+    os.remove(path)
+'''
+
+
+class CountingHandler(FileSystemEventHandler):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.modified = 0
+
+    def dispatch(self, event):
+        with self.lock:
+            self.calls += 1
+            if event.event_type == "modified" and not event.is_directory:
+                self.modified += 1
+
+    def wait_for_modified(self, count):
+        deadline = time.monotonic() + TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            with self.lock:
+                if self.modified >= count:
+                    return True
+            time.sleep(0.001)
+        return False
+
+
+def build_tree(root, width, files):
+    """Creates the tree unless a finished one is already there. Returns its directory count."""
+    marker = os.path.join(root, f".tree-{width}-{files}")
+    dir_count = 1 + width + width * width
+    if os.path.exists(marker):
+        return dir_count
+    print(f"Creating {dir_count} directories and {width * width * files} files under {root} ...")
+    for i in range(width):
+        for j in range(width):
+            leaf = os.path.join(root, f"d{i}", f"d{j}")
+            os.makedirs(leaf, exist_ok=True)
+            for k in range(files):
+                open(os.path.join(leaf, f"f{k}"), "wb").close()
+    open(marker, "wb").close()
+    return dir_count
+
+
+def attrib_targets(root, width, files):
+    targets = []
+    for i in range(width):
+        for j in range(width):
+            for k in range(files):
+                targets.append(os.path.join(root, f"d{i}", f"d{j}", f"f{k}"))
+                if len(targets) == ATTRIB_CHANGES:
+                    return targets
+    return targets
+
+
+def wait_until_ready(observer, dir_count):
+    if isinstance(observer, InotifyObserver):
+        # Watches are added in the background; wait for the last one
+        deadline = time.monotonic() + TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            with observer.lock:
+                if len(observer.wd_to_path) >= dir_count:
+                    return True
+            time.sleep(0.001)
+        return False
+    # watchdog adds every watch inside start(); fanotify needs none
+    return True
+
+
+def run_backend(name, create, root, width, files, dir_count):
+    handler = CountingHandler()
+    try:
+        observer = create()
+        observer.schedule(handler, root, recursive=True)
+    except (OSError, AttributeError) as e:
+        return name, f"unavailable: {e}"
+
+    started = time.perf_counter()
+    observer.start()
+    ready = wait_until_ready(observer, dir_count)
+    ready_seconds = time.perf_counter() - started
+    try:
+        if not ready:
+            return name, "not ready before the timeout"
+
+        targets = attrib_targets(root, width, files)
+        expected = handler.modified + len(targets)
+        started = time.perf_counter()
+        for path in targets:
+            os.setxattr(path, b"user.bench", str(started).encode())
+        if not handler.wait_for_modified(expected):
+            return name, "attribute events did not all arrive"
+        attrib_seconds = time.perf_counter() - started
+
+        time.sleep(0.5)
+        calls_before = handler.calls
+        cpu_before = time.process_time()
+        subprocess.run([sys.executable, "-c", WRITER, os.path.join(root, "d0", "d0"),
+                        str(WRITE_FILES), str(WRITE_SIZE)], check=True)
+        time.sleep(0.5)  # Let the backend drain what the writer caused
+        cpu_seconds = time.process_time() - cpu_before
+        calls = handler.calls - calls_before
+    finally:
+        observer.stop()
+        observer.join()
+
+    return name, (f"{ready_seconds * 1000:.0f} ms | {attrib_seconds * 1000:.0f} ms | "
+                  f"{cpu_seconds * 1000:.0f} ms ({calls} handler calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--root", default=os.path.join(tempfile.gettempdir(), "reduce-monitor-bench"))
+    parser.add_argument("--width", type=int, default=100, help="subdirectories per directory, two levels deep")
+    parser.add_argument("--files", type=int, default=100, help="files per leaf directory")
+    args = parser.parse_args()
+    if args.width * args.width * args.files < ATTRIB_CHANGES:
+        parser.error(f"the tree needs at least {ATTRIB_CHANGES} files")
+
+    os.makedirs(args.root, exist_ok=True)
+    dir_count = build_tree(args.root, args.width, args.files)
+
+    backends = [
+        ("watchdog", Observer),
+        ("inotify", InotifyObserver),
+        ("fanotify", FanotifyObserver),
+    ]
+    print(f"| Backend | Ready | {ATTRIB_CHANGES} attribute changes | "
+          f"CPU while {WRITE_FILES} files x {WRITE_SIZE // 1024} KB are written and deleted |")
+    print("|---|---|---|---|")
+    for name, create in backends:
+        name, result = run_backend(name, create, args.root, args.width, args.files, dir_count)
+        print(f"| {name} | {result} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Background delivery of delete notifications to the metadata server.
+
+The watchdog callbacks only enqueue the hash of a removed file and return.
+A worker thread collects queued hashes and sends them in batches to
+/delete_records. Failed batches are retried with exponential backoff. The
+queue is mirrored to a small file in the ReDUCE cache directory, so hashes
+that were not delivered survive a restart.
+
+A hash queued more than once is sent once. A hash that is tracked again
+before it is sent (the file was moved, or a copy was re-added) is dropped
+from the queue.
+"""
+
+import os
+import random
+import threading
+import time
+
+import requests
+
+from device_identity import get_cache_path, get_system_info
+
+SERVER_URL = "http://127.0.0.1:5050"
+QUEUE_FILENAME = "pending_deletes.txt"
+BATCH_SIZE = 500            # Hashes per /delete_records call
+COALESCE_SECONDS = 0.5      # Wait for more deletes before sending a batch
+REQUEST_TIMEOUT = (5, 30)
+MIN_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 300
+
+
+def get_queue_path():
+    return os.path.join(os.path.dirname(get_cache_path()), QUEUE_FILENAME)
+
+
+class DeleteQueue:
+    def __init__(self, queue_path=None):
+        self.queue_path = queue_path or get_queue_path()
+        self.pending = {}  # Insertion-ordered set of hashes
+        self.condition = threading.Condition()
+        self.dirty = False
+        self.stopping = False
+        self.thread = None
+        self.backoff = 0
+        self.session = requests.Session()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.queue_path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        self.pending[line.strip()] = None
+        except OSError:
+            return
+        if self.pending:
+            print(f"Resuming {len(self.pending)} undelivered delete notifications.")
+
+    def persist(self):
+        """Mirrors the queue to disk when it changed."""
+        with self.condition:
+            if not self.dirty:
+                return
+            hashes = list(self.pending)
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.queue_path), exist_ok=True)
+            temp_path = f"{self.queue_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as f:
+                f.writelines(f"{h}\n" for h in hashes)
+            os.replace(temp_path, self.queue_path)
+        except OSError as e:
+            print(f"Could not save pending delete notifications: {e}")
+
+    def enqueue(self, partial_hash_verify):
+        with self.condition:
+            self.pending[partial_hash_verify] = None
+            self.dirty = True
+            self.condition.notify()
+
+    def discard(self, partial_hash_verify):
+        """Drops a queued hash that is tracked again before it was sent."""
+        with self.condition:
+            if partial_hash_verify in self.pending:
+                del self.pending[partial_hash_verify]
+                self.dirty = True
+                print(f"Delete notification cancelled, file is tracked again: {partial_hash_verify}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="delete-queue", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Stops the worker after one last delivery attempt and saves what is left."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout)
+        self.dirty = True
+        self.persist()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping and (not self.pending or self.backoff):
+                    return
+            self.persist()
+
+            if not self.stopping:
+                # Let a burst of deletes (a removed folder) collect into one batch
+                time.sleep(COALESCE_SECONDS)
+            with self.condition:
+                batch = list(self.pending)[:BATCH_SIZE]
+
+            delivered = self.send_batch(batch)
+            with self.condition:
+                if delivered:
+                    for partial_hash in batch:
+                        self.pending.pop(partial_hash, None)
+                    self.dirty = True
+                    self.backoff = 0
+                else:
+                    self.backoff = min(MAX_BACKOFF_SECONDS, max(MIN_BACKOFF_SECONDS, self.backoff * 2))
+                    print(f"Retrying {len(self.pending)} delete notifications in {self.backoff} s.")
+                    # Jitter keeps many monitors from retrying in lockstep
+                    retry_at = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
+                    # Deletes queued meanwhile wake the condition; only stop() ends the wait early
+                    while not self.stopping and time.monotonic() < retry_at:
+                        self.condition.wait(retry_at - time.monotonic())
+            self.persist()
+
+    def send_batch(self, batch):
+        """Sends one batch to /delete_records. Returns True once the server has processed it."""
+        payload = {
+            "partial_hash_verify": batch,
+            "device_info": get_system_info()
+        }
+        try:
+            response = self.session.post(f"{SERVER_URL}/delete_records", json=payload, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                result = response.json()
+                for partial_hash in result.get("deleted", []):
+                    print(f"Successfully deleted record from server: {partial_hash}")
+                for partial_hash in result.get("not_found", []):
+                    print(f"No record found on server for hash: {partial_hash}")
+                return True
+            if response.status_code == 404:
+                # Server without the batch endpoint
+                return all(self.send_one(partial_hash) for partial_hash in batch)
+            print(f"Failed to delete records on server. Status Code: {response.status_code}, Response: {response.text}")
+            # A rejected batch would be rejected again; only server errors are retried
+            return 400 <= response.status_code < 500 and response.status_code != 429
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error communicating with server: {e}")
+            return False
+
+    def send_one(self, partial_hash_verify):
+        payload = {
+            "partial_hash_verify": partial_hash_verify,
+            "device_info": get_system_info()
+        }
+        response = self.session.post(f"{SERVER_URL}/delete_record", json=payload, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            print(f"Successfully deleted record from server: {partial_hash_verify}")
+        elif response.status_code == 404:
+            print(f"No record found on server for hash: {partial_hash_verify}")
+        else:
+            print(f"Failed to delete record on server. Status Code: {response.status_code}, Response: {response.text}")
+            return False
+        return True
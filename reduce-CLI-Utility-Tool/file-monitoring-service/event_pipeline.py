@@ -0,0 +1,166 @@
+"""
+Coalescing stage between the observer and FileEventHandler.
+
+The observer thread only records, per path, what the path's final state
+is. This takes a lock and a dictionary update, with no metadata reads. A
+worker thread hands a path to the handler once it has been quiet for
+COALESCE_SECONDS, or at the latest MAX_DELAY_SECONDS after its first event,
+so a file written for minutes is still checked every few seconds rather
+than on every write.
+
+Per path, a burst collapses into a single event:
+
+    created/modified ...      -> one modified event (metadata is read once)
+    ... moved A -> B          -> A is dropped, B gets one moved event from
+                                 the path the file had before the burst
+    ... deleted               -> one deleted event for that original path
+
+For example, a download created at file.part, written, tagged and renamed
+to file reaches the handler as one moved event from file.part to file.
+"""
+
+import threading
+import time
+
+from watchdog.events import (
+    FileSystemEventHandler,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+COALESCE_SECONDS = 0.5   # Quiet time before a path's events are handled
+MAX_DELAY_SECONDS = 5    # Upper bound for a path that keeps changing
+TICK_SECONDS = 0.1
+
+CHECK = "check"   # Read the file's metadata at this path
+GONE = "gone"     # Nothing is left at this path
+MOVED = "moved"   # Moved away; handled by the destination's record
+
+
+class PendingPath:
+    __slots__ = ("state", "origin", "first_seen", "last_seen")
+
+    def __init__(self, state, origin, now):
+        self.state = state
+        self.origin = origin  # Path the file had before the burst, if it was moved
+        self.first_seen = now
+        self.last_seen = now
+
+
+class EventPipeline(FileSystemEventHandler):
+    def __init__(self, handler, is_monitored=None):
+        super().__init__()
+        self.handler = handler
+        # is_monitored(path) drops events for paths that can never be tracked
+        # before they are queued; a move across the boundary becomes a
+        # create or a delete
+        self.is_monitored = is_monitored or (lambda path: True)
+        self.pending = {}  # path -> PendingPath, in order of first event
+        self.condition = threading.Condition()
+        # Held while the handler runs, so other threads can read its state
+        # between events
+        self.handler_lock = threading.Lock()
+        self.stopping = False
+        self.thread = None
+
+    def record(self, path, state, origin=None):
+        now = time.monotonic()
+        entry = self.pending.get(path)
+        if entry is None:
+            self.pending[path] = PendingPath(state, origin, now)
+            return
+        if entry.state == MOVED:
+            # A new file at a path something was moved away from is handled
+            # after the moved file, whose record may still refer to this path
+            del self.pending[path]
+            self.pending[path] = entry
+        entry.state = state
+        if origin is not None:
+            entry.origin = origin
+        entry.last_seen = now
+
+    def dispatch(self, event):
+        """Runs on the observer thread: records the event and returns."""
+        if event.is_directory:
+            return
+        event_type = event.event_type
+        src_path = event.src_path
+        if event_type == "moved":
+            src_wanted = self.is_monitored(src_path)
+            dest_wanted = self.is_monitored(event.dest_path)
+            if not dest_wanted:
+                event_type = "deleted"
+            elif not src_wanted:
+                event_type, src_path = "created", event.dest_path
+        if event_type != "moved" and not self.is_monitored(src_path):
+            return
+
+        with self.condition:
+            if event_type in ("created", "modified"):
+                self.record(src_path, CHECK)
+            elif event_type == "deleted":
+                self.record(src_path, GONE)
+            elif event_type == "moved":
+                src = self.pending.get(event.src_path)
+                origin = src.origin if src is not None and src.origin else event.src_path
+                self.pending.pop(event.src_path, None)
+                self.record(event.src_path, MOVED)
+                if origin == event.dest_path:
+                    # Moved back to where it started
+                    origin = None
+                self.pending.pop(event.dest_path, None)
+                self.record(event.dest_path, CHECK, origin)
+            else:
+                return
+            self.condition.notify()
+
+    def to_event(self, path, entry):
+        if entry.state == CHECK:
+            if entry.origin is not None:
+                return FileMovedEvent(entry.origin, path)
+            return FileModifiedEvent(path)
+        if entry.state == GONE:
+            return FileDeletedEvent(entry.origin or path)
+        return None
+
+    def take_ready(self, flush=False):
+        now = time.monotonic()
+        ready = []
+        for path, entry in self.pending.items():
+            if (flush or now - entry.last_seen >= COALESCE_SECONDS
+                    or now - entry.first_seen >= MAX_DELAY_SECONDS):
+                ready.append(path)
+        return [(path, self.pending.pop(path)) for path in ready]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="event-pipeline", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Stops the worker after handling everything still pending."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                stopping = self.stopping
+                batch = self.take_ready(flush=stopping)
+            for path, entry in batch:
+                event = self.to_event(path, entry)
+                if event is None:
+                    continue
+                try:
+                    with self.handler_lock:
+                        self.handler.dispatch(event)
+                except Exception as e:
+                    print(f"Error handling {event}: {e}")
+            if stopping:
+                return
+            time.sleep(TICK_SECONDS)
@@ -7,11 +7,17 @@ from ctypes import wintypes
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import time
-import requests
 import json
-import uuid
-import socket
-import subprocess
+import signal
+import threading
+from stat import S_ISREG
+
+from tracking_index import TrackingIndex
+from delete_queue import DeleteQueue
+from linux_monitor import create_observer
+from event_pipeline import EventPipeline
+from path_rules import PathRules
+from tracking_store import TrackingStore
 
 # Attempt to import xattr for Linux/macOS
 try:
@@ -19,6 +25,35 @@ try:
 except ImportError:
     xattr = None
 
+# Prefix hashes are stored as 'file_hash_check_parts', sparse fingerprints
+# ('v2:...') as 'file_hash_check_parts.v2'
+HASH_ATTRIBUTE_NAMES = ("file_hash_check_parts", "file_hash_check_parts.v2")
+
+# Directories skipped, with everything below them, by the startup scan and
+# the event handlers. Edit these to add caches, build trees or mounts that
+# never hold downloads; INCLUDED_PATHS re-includes a directory below them.
+if platform.system().lower() == "windows":
+    EXCLUDED_PATHS = {"C:\\Windows", "C:\\Program Files", "C:\\ProgramData"}
+else:
+    EXCLUDED_PATHS = set()
+INCLUDED_PATHS = set()
+# Directory names (or patterns) excluded at any depth. Empty by default, so
+# every directory is watched; add names such as ".git", "node_modules",
+# "__pycache__", ".venv", ".cache" or "*.egg-info" to skip trees that are
+# known never to hold downloads.
+EXCLUDED_DIR_NAMES = set()
+
+# Files never checked for metadata: downloads in progress (the CLI tags the
+# final file after renaming it), swap and lock files. Empty files are skipped too.
+SKIPPED_SUFFIXES = (".part", ".crdownload", ".partial", ".tmp", ".swp", ".swx", ".lock", ".pyc", "~")
+
+# The tracking index is saved this often while files change, so a crash or
+# kill loses at most this much and the next start stays a warm one
+INDEX_SAVE_SECONDS = 5 * 60
+
+# Set by SIGTERM (systemd stop, kill): the monitor stops like on Ctrl+C
+stop_requested = threading.Event()
+
 def is_windows():
     return platform.system().lower() == "windows"
 
@@ -36,194 +71,124 @@ def normalize_path(path):
 
 def has_required_metadata(file_path):
     """
-    Checks if the given file has the 'file_hash_check_parts' metadata.
+    Checks if the given file has 'file_hash_check_parts' metadata, under any
+    of HASH_ATTRIBUTE_NAMES.
     Returns the hash string if metadata exists, None otherwise.
     """
-    if not os.path.isfile(file_path):
+    if not path_rules.is_monitored(file_path):
+        return None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode) or stat.st_size == 0:
         return None
 
     normalized_path = normalize_path(file_path)
 
     if is_windows():
         # Windows ADS
-        ads_path = f"{normalized_path}:file_hash_check_parts"
-        try:
-            with open(ads_path, "r") as ads:
-                hash_data = ads.read().strip()
-            return hash_data if hash_data else None
-        except Exception:
-            return None
+        for name in HASH_ATTRIBUTE_NAMES:
+            ads_path = f"{normalized_path}:{name}"
+            try:
+                with open(ads_path, "r") as ads:
+                    hash_data = ads.read().strip()
+                if hash_data:
+                    return hash_data
+            except Exception:
+                continue
+        return None
     elif is_linux() or is_macos():
         if xattr is None:
             return None
-        try:
-            hash_data = xattr.getxattr(file_path, b"user.file_hash_check_parts")
-            return hash_data.decode('utf-8').strip() if hash_data else None
-        except (OSError, IOError):
-            return None
-        except Exception:
-            return None
+        for name in HASH_ATTRIBUTE_NAMES:
+            try:
+                hash_data = xattr.getxattr(file_path, f"user.{name}".encode('utf-8'))
+                if hash_data:
+                    return hash_data.decode('utf-8').strip()
+            except (OSError, IOError):
+                continue
+            except Exception:
+                return None
+        return None
     else:
         # Unsupported platform
         return None
 
-def get_system_info():
-    """Gets system information and returns it as a dictionary."""
-    system_info = {}
-
-    def get_device_id():
-        try:
-            if platform.system() == "Linux":
-                with open("/etc/machine-id", "r") as f:
-                    return f.read().strip()
-            elif platform.system() == "Windows":
-                return str(uuid.uuid1())
-            elif platform.system() == "Darwin":
-                return subprocess.check_output(
-                    "system_profiler SPHardwareDataType | grep 'UUID:'", 
-                    shell=True
-                ).decode().split(":")[1].strip()
-            else:
-                return "Platform not supported for device ID"
-        except FileNotFoundError:
-            return get_mac_address()  # Fallback
-        except Exception as e:
-            print(f"Error getting device ID: {e}")
-            return "Unknown"
-
-    def get_device_name():
-        try:
-            return socket.gethostname()
-        except Exception as e:
-            print(f"Error getting device name: {e}")
-            return "Unknown"
-
-    def get_current_user():
-        try:
-            if platform.system() == "Windows":
-                return os.environ.get("USERNAME")
-            else:
-                return os.environ.get("USER")
-        except Exception as e:
-            print(f"Error getting current user: {e}")
-            return "Unknown"
-
-    def get_mac_address():
-        try:
-            if platform.system() == "Windows":
-                result = subprocess.check_output(
-                    ["getmac", "/fo", "csv", "/nh"]
-                ).decode().strip().split(",")[0].replace('"', '')
-                if result == "":
-                    result = subprocess.check_output(
-                        ["ipconfig", "/all"]
-                    ).decode()
-                    mac_address_lines = [
-                        line for line in result.splitlines() 
-                        if "Physical Address" in line
-                    ]
-                    if mac_address_lines:
-                        mac_address = mac_address_lines[0].split(":")[1].strip().replace("-", ":")
-                        return mac_address
-                    else:
-                        return "MAC not found"
-                return result
-            elif platform.system() == "Linux":
-                result = subprocess.check_output(["ip", "link"]).decode()
-                for line in result.splitlines():
-                    if "link/ether" in line:
-                        return line.split()[2]
-                return "MAC not found"
-            elif platform.system() == "Darwin":
-                result = subprocess.check_output(
-                    "ifconfig en0 | grep ether", shell=True
-                ).decode().split()[1]
-                return result
-            else:
-                return "Platform not supported for MAC address"
-        except Exception as e:
-            print(f"Error getting MAC address: {e}")
-            return "Unknown"
-
-    system_info["device_id"] = get_device_id()
-    system_info["device_name"] = get_device_name()
-    system_info["current_user"] = get_current_user()
-    system_info["mac_address"] = get_mac_address()
-
-    return system_info
-
-# Dictionaries for tracking
-# Key: partial_hash_verify (string), Value: normalized file path
-tracked_files = {}
+# Tracked files: normalized file path <-> partial_hash_verify (string).
+# One hash can be tracked at several paths, one per local copy.
+tracking = TrackingStore()
 
-# Key: normalized file path, Value: partial_hash_verify (string)
-path_to_hash = {}
+# Delete notifications are delivered to the server in the background
+delete_queue = None
 
 def add_to_tracking(normalized_path, hash_data):
     """
-    Add file to both dictionaries if not already present.
+    Add file to tracking if not already present.
     """
     if hash_data and normalized_path:
-        if normalized_path not in path_to_hash:
-            tracked_files[hash_data] = normalized_path
-            path_to_hash[normalized_path] = hash_data
+        if normalized_path not in tracking:
+            if delete_queue is not None:
+                delete_queue.discard(hash_data)
+            tracking.add(normalized_path, hash_data)
             print(f"Added to tracking: {normalized_path} (Hash: {hash_data})")
 
 def remove_from_tracking_by_path(normalized_path):
     """
-    Removes a file from both dictionaries using its path.
+    Removes a file from tracking using its path.
     Returns the hash_data for logging purposes.
     """
-    hash_data = None
-    if normalized_path in path_to_hash:
-        hash_data = path_to_hash[normalized_path]
-        del path_to_hash[normalized_path]
-
-        if hash_data in tracked_files:
-            del tracked_files[hash_data]
-
+    hash_data = tracking.remove(normalized_path)
+    if hash_data is not None:
         print(f"Removed from tracking: {normalized_path} (Hash: {hash_data})")
     return hash_data
 
-def initialize_cache(path):
+path_rules = PathRules(EXCLUDED_PATHS, INCLUDED_PATHS, EXCLUDED_DIR_NAMES, SKIPPED_SUFFIXES)
+
+def is_excluded_dir(normalized_path):
+    """
+    True if nothing below the directory is monitored. The scan walks top-down
+    and skips such directories, so their subtrees are never reached.
+    """
+    return path_rules.is_pruned(normalized_path)
+
+def initialize_cache(path, index):
     """
-    Initializes the tracking dictionaries with existing files that have the required metadata.
+    Initializes the tracking store with existing files that have the required metadata.
+    Directories unchanged since the index was saved are not re-read; tracked
+    files that disappeared while the monitor was stopped are reported to the
+    server unless another copy is still tracked.
     """
     print("Initializing cache...")
-    for root, dirs, files in os.walk(path):
-        # Optional: Exclude certain system directories for performance on Windows
-        excluded_dirs = {"C:\\Windows", "C:\\Program Files", "C:\\ProgramData"}
-        if is_windows() and any(os.path.commonpath([root, ex_dir]) == ex_dir for ex_dir in excluded_dirs):
-            continue
-
-        for file in files:
-            file_path = os.path.join(root, file)
-            hash_data = has_required_metadata(file_path)
-            if hash_data:
-                normalized = normalize_path(file_path)
-                add_to_tracking(normalized, hash_data)
-    print(f"Cache initialized with {len(tracked_files)} files.")
+    index.load(path)
+    found, removed, scanned_dirs = index.scan(path, has_required_metadata, normalize_path, is_excluded_dir)
+    print(f"Scanned {scanned_dirs} changed of {len(index.dirs)} directories.")
+
+    for normalized, hash_data in found.items():
+        add_to_tracking(normalized, hash_data)
+    for normalized, hash_data in removed.items():
+        print(f"[DELETED] {normalized} (Hash: {hash_data}) while the monitor was stopped")
+        send_delete_request(hash_data)
+
+    index.save(path, tracking)
+    # The tracking store holds the files from here on
+    index.files = {}
+    print(f"Cache initialized with {len(tracking)} files.")
 
 def send_delete_request(partial_hash_verify):
     """
-    Sends a POST request to the Flask server to delete the record associated with the given hash.
+    Queues the deletion of the server record associated with the given hash,
+    once no tracked copy of the file is left. The delete queue's worker thread
+    sends it, so event callbacks never block on the network.
     """
-    url = "http://127.0.0.1:5050/delete_record"
-    system_info = get_system_info()
-    payload = {
-        "partial_hash_verify": partial_hash_verify,
-        "device_info": system_info
-    }
-    try:
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            print(f"Successfully deleted record from server: {partial_hash_verify}")
-        elif response.status_code == 404:
-            print(f"No record found on server for hash: {partial_hash_verify}")
-        else:
-            print(f"Failed to delete record on server. Status Code: {response.status_code}, Response: {response.text}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error communicating with server: {e}")
+    copies = tracking.hash_count(partial_hash_verify)
+    if copies:
+        print(f"Keeping server record, hash still tracked at {copies} other path(s): {partial_hash_verify}")
+        return
+    if delete_queue is None:
+        print(f"Delete queue not running; server record kept for hash: {partial_hash_verify}")
+        return
+    delete_queue.enqueue(partial_hash_verify)
 
 class FileEventHandler(FileSystemEventHandler):
     """
@@ -244,14 +209,14 @@ class FileEventHandler(FileSystemEventHandler):
             normalized_src = normalize_path(event.src_path)
 
             if hash_data:
-                if normalized_src not in path_to_hash:
+                if normalized_src not in tracking:
                     add_to_tracking(normalized_src, hash_data)
                     print(f"[MODIFIED] Added to tracking: {normalized_src} (Hash: {hash_data})")
                 else:
                     print(f"[MODIFIED] {normalized_src} (Hash: {hash_data})")
             else:
                 # File lost metadata
-                if normalized_src in path_to_hash:
+                if normalized_src in tracking:
                     hash_removed = remove_from_tracking_by_path(normalized_src)
                     if hash_removed:
                         send_delete_request(hash_removed)
@@ -263,17 +228,17 @@ class FileEventHandler(FileSystemEventHandler):
             normalized_dest = normalize_path(event.dest_path)
 
             if hash_data:
-                # Destination file has metadata
-                if normalized_src in path_to_hash:
-                    # Remove old
+                # Destination file has metadata; tracked before the old path
+                # is dropped, so the move never looks like the last copy going away
+                add_to_tracking(normalized_dest, hash_data)
+                if normalized_src in tracking:
                     hash_removed = remove_from_tracking_by_path(normalized_src)
-                    if hash_removed:
+                    if hash_removed and hash_removed != hash_data:
                         send_delete_request(hash_removed)
-                add_to_tracking(normalized_dest, hash_data)
                 print(f"[MOVED] File moved to: {normalized_dest} (Hash: {hash_data}) with metadata.")
             else:
                 # Destination lacks metadata
-                if normalized_src in path_to_hash:
+                if normalized_src in tracking:
                     hash_removed = remove_from_tracking_by_path(normalized_src)
                     if hash_removed:
                         send_delete_request(hash_removed)
@@ -282,31 +247,57 @@ class FileEventHandler(FileSystemEventHandler):
     def on_deleted(self, event):
         if not event.is_directory:
             normalized_src = normalize_path(event.src_path)
-            if normalized_src in path_to_hash:
-                hash_data = path_to_hash[normalized_src]
+            if normalized_src in tracking:
+                hash_data = tracking.get(normalized_src)
                 print(f"[DELETED] {normalized_src} (Hash: {hash_data})")
                 hash_removed = remove_from_tracking_by_path(normalized_src)
                 if hash_removed:
                     send_delete_request(hash_removed)
 
-def monitor_directory(path_to_monitor):
+def request_stop(signum, frame):
+    stop_requested.set()
+
+def monitor_directory(path_to_monitor, index=None):
+    """
+    Watches path_to_monitor until Ctrl+C or SIGTERM. If an index is given,
+    the tracked files are saved to it every INDEX_SAVE_SECONDS while they
+    change.
+    """
     if not os.path.exists(path_to_monitor):
         print(f"Error: The path {path_to_monitor} does not exist.")
         sys.exit(1)
 
-    event_handler = FileEventHandler()
-    observer = Observer()
-    observer.schedule(event_handler, path_to_monitor, recursive=True)
+    # Observers only queue events; FileEventHandler runs on the pipeline's
+    # worker thread, once per path per burst
+    event_handler = EventPipeline(FileEventHandler(), path_rules.is_monitored)
+    event_handler.start()
+    observer = None
+    if is_linux():
+        # fanotify or inotify, subscribed to delete/move/attrib only
+        observer = create_observer(path_to_monitor, event_handler, path_rules.is_pruned)
+    if observer is None:
+        observer = Observer()
+        observer.schedule(event_handler, path_to_monitor, recursive=True)
 
     observer.start()
     print(f"Monitoring started on: {path_to_monitor}")
+    saved_changes = tracking.changes
+    next_save = time.monotonic() + INDEX_SAVE_SECONDS
     try:
-        while True:
-            time.sleep(0.5)
+        while not stop_requested.wait(0.5):
+            if index is not None and time.monotonic() >= next_save:
+                next_save = time.monotonic() + INDEX_SAVE_SECONDS
+                if tracking.changes != saved_changes:
+                    # The handler must not change the store while it is written
+                    with event_handler.handler_lock:
+                        index.save(path_to_monitor, tracking)
+                        saved_changes = tracking.changes
     except KeyboardInterrupt:
-        observer.stop()
-        print("Monitoring stopped.")
+        pass
+    observer.stop()
+    print("Monitoring stopped.")
     observer.join()
+    event_handler.stop()
 
 if __name__ == "__main__":
     if is_windows():
@@ -314,6 +305,13 @@ if __name__ == "__main__":
     else:
         path_to_monitor = os.path.expanduser("~")
 
+    signal.signal(signal.SIGTERM, request_stop)
     print(f"Monitoring: {path_to_monitor}")
-    initialize_cache(path_to_monitor)
-    monitor_directory(path_to_monitor)
+    delete_queue = DeleteQueue()
+    delete_queue.start()
+    tracking_index = TrackingIndex()
+    initialize_cache(path_to_monitor, tracking_index)
+    monitor_directory(path_to_monitor, tracking_index)
+    # Saved on exit so the next start only re-reads directories changed since
+    tracking_index.save(path_to_monitor, tracking)
+    delete_queue.stop()
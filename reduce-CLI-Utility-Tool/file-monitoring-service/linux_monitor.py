@@ -0,0 +1,534 @@
+"""
+Linux event backends for the file monitor, used instead of watchdog's
+Observer on Linux.
+
+The monitor only reacts to three kinds of change:
+
+    delete   a tracked file is removed
+    move     a tracked file is renamed, moved in or moved out
+    attrib   file_hash_check_parts is attached to or removed from a file
+             (setting or removing an xattr raises an attribute event)
+
+Both backends subscribe to just those event classes. Creating or writing a
+file does not produce an event, so large downloads in progress cost nothing.
+Events are delivered to the handler as watchdog events, so FileEventHandler
+works unchanged: attrib arrives as a modified event, a file moved in from
+outside as a created event and a file moved out as a deleted event.
+
+FanotifyObserver
+    One filesystem-wide fanotify mark (FAN_MARK_FILESYSTEM with
+    FAN_REPORT_DFID_NAME) replaces all per-directory watches. It needs
+    CAP_SYS_ADMIN and Linux 5.1+ (5.17+ for paired rename events). It covers
+    the filesystem holding the monitored path, not other filesystems mounted
+    below it.
+
+InotifyObserver
+    Used when fanotify is not permitted. inotify only reports changes in
+    watched directories, so it keeps one watch per monitored directory.
+    Watches are added by a background thread, breadth-first from the
+    monitored path, so startup does not wait for the whole tree. New
+    directories are watched as they appear, and excluded directories are
+    never watched.
+
+create_observer() returns the best backend available, or None to fall back
+to watchdog.
+"""
+
+import ctypes
+import errno
+import os
+import queue
+import select
+import struct
+import threading
+import time
+from collections import deque
+
+from watchdog.events import (
+    DirDeletedEvent,
+    DirMovedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+# inotify(7)
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# IN_CREATE is only acted on for directories, to watch them as they appear
+INOTIFY_MASK = (IN_ATTRIB | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+                | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# fanotify(7)
+FAN_CLOEXEC = 0x00000001
+FAN_NONBLOCK = 0x00000002
+FAN_CLASS_NOTIF = 0x00000000
+FAN_REPORT_DFID_NAME = 0x00000c00
+FAN_MARK_ADD = 0x00000001
+FAN_MARK_FILESYSTEM = 0x00000100
+FAN_ATTRIB = 0x00000004
+FAN_MOVED_FROM = 0x00000040
+FAN_MOVED_TO = 0x00000080
+FAN_DELETE = 0x00000200
+FAN_Q_OVERFLOW = 0x00004000
+FAN_RENAME = 0x10000000
+FAN_ONDIR = 0x40000000
+FAN_EVENT_INFO_TYPE_DFID_NAME = 2
+FAN_EVENT_INFO_TYPE_OLD_DFID_NAME = 10
+FAN_EVENT_INFO_TYPE_NEW_DFID_NAME = 12
+FANOTIFY_METADATA = struct.Struct("IBBHQii")
+FANOTIFY_INFO_HEADER = struct.Struct("BBH")
+AT_FDCWD = -100
+
+READ_BUFFER_SIZE = 64 * 1024
+POLL_TIMEOUT_MS = 100
+MOVE_PAIR_SECONDS = 0.1  # A MOVED_FROM without its MOVED_TO after this was a move out
+HANDLE_CACHE_SIZE = 4096
+
+_libc = None
+
+
+def get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.fanotify_mark.argtypes = [ctypes.c_int, ctypes.c_uint, ctypes.c_uint64, ctypes.c_int, ctypes.c_char_p]
+        _libc.open_by_handle_at.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    return _libc
+
+
+def is_within(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def sub_moved_events(src_dir, dest_dir):
+    """Yields a FileMovedEvent for every file now under dest_dir, like watchdog does for directory moves."""
+    for root, _, files in os.walk(dest_dir):
+        for name in files:
+            dest_path = os.path.join(root, name)
+            yield FileMovedEvent(os.path.join(src_dir, os.path.relpath(dest_path, dest_dir)), dest_path)
+
+
+def sub_created_events(directory):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            yield FileCreatedEvent(os.path.join(root, name))
+
+
+class _Observer:
+    """Thread plumbing shared by both backends: schedule/start/stop/join like watchdog's Observer."""
+
+    def __init__(self, is_excluded=None):
+        # is_excluded(directory) is True if nothing below directory is monitored
+        self.is_excluded = is_excluded or (lambda path: False)
+        self.handler = None
+        self.root = None
+        self.stopping = threading.Event()
+        self.wake_read = self.wake_write = None
+        self.thread = None
+
+    def schedule(self, event_handler, path, recursive=True):
+        self.handler = event_handler
+        self.root = os.path.abspath(path)
+
+    def start(self):
+        self.wake_read, self.wake_write = os.pipe()
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.wake_write is not None:
+            os.write(self.wake_write, b"x")
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+            if not self.thread.is_alive():
+                self.close()
+
+    def close_fds(self, *names):
+        for name in names:
+            fd = getattr(self, name)
+            if fd is not None:
+                setattr(self, name, None)
+                os.close(fd)
+
+    def close(self):
+        """Releases the descriptors of an observer that failed to schedule or has stopped."""
+        self.close_fds("wake_read", "wake_write")
+
+    def dispatch(self, event):
+        try:
+            self.handler.dispatch(event)
+        except Exception as e:
+            print(f"Error handling {event}: {e}")
+
+    def read_events(self, fd, on_buffer, on_idle):
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        poller.register(self.wake_read, select.POLLIN)
+        while not self.stopping.is_set():
+            for ready_fd, _ in poller.poll(POLL_TIMEOUT_MS):
+                if ready_fd != fd:
+                    continue
+                try:
+                    buffer = os.read(fd, READ_BUFFER_SIZE)
+                except BlockingIOError:
+                    continue
+                on_buffer(buffer)
+            on_idle()
+
+
+class InotifyObserver(_Observer):
+    def __init__(self, is_excluded=None):
+        super().__init__(is_excluded)
+        libc = get_libc()
+        self.fd = None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        self.lock = threading.Lock()
+        self.wd_to_path = {}
+        self.path_to_wd = {}
+        self.pending_moves = {}  # cookie -> (path, is_dir, time)
+        self.to_register = queue.Queue()
+        self.limit_reported = False
+
+    def add_watch(self, directory):
+        wd = get_libc().inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self.limit_reported:
+                self.limit_reported = True
+                print("inotify watch limit reached; raise fs.inotify.max_user_watches to watch every directory.")
+            return False
+        with self.lock:
+            self.wd_to_path[wd] = directory
+            self.path_to_wd[directory] = wd
+        return True
+
+    def register_tree(self, directory, report_files):
+        """Watches directory and its subdirectories, breadth-first."""
+        pending = deque([directory])
+        while pending and not self.stopping.is_set():
+            current = pending.popleft()
+            if self.is_excluded(current) or not self.add_watch(current):
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif report_files:
+                            # Created before the watch existed
+                            self.dispatch(FileCreatedEvent(entry.path))
+            except OSError:
+                continue
+
+    def register_worker(self):
+        while not self.stopping.is_set():
+            try:
+                directory, report_files = self.to_register.get(timeout=POLL_TIMEOUT_MS / 1000)
+            except queue.Empty:
+                continue
+            self.register_tree(directory, report_files)
+
+    def forget_tree(self, directory):
+        with self.lock:
+            for path in [p for p in self.path_to_wd if is_within(p, directory)]:
+                wd = self.path_to_wd.pop(path)
+                self.wd_to_path.pop(wd, None)
+                get_libc().inotify_rm_watch(self.fd, wd)
+
+    def rename_tree(self, src_dir, dest_dir):
+        with self.lock:
+            for path in [p for p in self.path_to_wd if is_within(p, src_dir)]:
+                wd = self.path_to_wd.pop(path)
+                new_path = dest_dir + path[len(src_dir):]
+                self.path_to_wd[new_path] = wd
+                self.wd_to_path[wd] = new_path
+
+    def moved_out(self, path, is_dir):
+        if is_dir:
+            self.forget_tree(path)
+            self.dispatch(DirDeletedEvent(path))
+        else:
+            self.dispatch(FileDeletedEvent(path))
+
+    def moved_in(self, path, is_dir):
+        if is_dir:
+            self.to_register.put((path, True))
+        else:
+            self.dispatch(FileCreatedEvent(path))
+
+    def on_buffer(self, buffer):
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(buffer):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                print("inotify event queue overflowed; some changes were missed.")
+                continue
+            with self.lock:
+                directory = self.wd_to_path.get(wd)
+            if mask & IN_IGNORED:
+                with self.lock:
+                    if directory is not None and self.path_to_wd.get(directory) == wd:
+                        del self.path_to_wd[directory]
+                    self.wd_to_path.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+            is_dir = bool(mask & IN_ISDIR)
+            if self.pending_moves and not (mask & IN_MOVED_TO and cookie in self.pending_moves):
+                # The two halves of a rename are queued back to back, so an
+                # earlier MOVED_FROM still unpaired here was a move out
+                self.flush_moves(0)
+            if mask & IN_CREATE:
+                if is_dir:
+                    self.to_register.put((path, True))
+            elif mask & IN_ATTRIB:
+                if not is_dir:
+                    self.dispatch(FileModifiedEvent(path))
+            elif mask & IN_DELETE:
+                self.dispatch(DirDeletedEvent(path) if is_dir else FileDeletedEvent(path))
+            elif mask & IN_MOVED_FROM:
+                self.pending_moves[cookie] = (path, is_dir, time.monotonic())
+            elif mask & IN_MOVED_TO:
+                move = self.pending_moves.pop(cookie, None)
+                if move is None:
+                    self.moved_in(path, is_dir)
+                elif is_dir:
+                    self.rename_tree(move[0], path)
+                    self.dispatch(DirMovedEvent(move[0], path))
+                    for event in sub_moved_events(move[0], path):
+                        self.dispatch(event)
+                else:
+                    self.dispatch(FileMovedEvent(move[0], path))
+
+    def flush_moves(self, older_than):
+        now = time.monotonic()
+        for cookie in [c for c, (_, _, at) in self.pending_moves.items() if now - at >= older_than]:
+            path, is_dir, _ = self.pending_moves.pop(cookie)
+            self.moved_out(path, is_dir)
+
+    def on_idle(self):
+        self.flush_moves(MOVE_PAIR_SECONDS)
+
+    def run(self):
+        registrar = threading.Thread(target=self.register_worker, name="inotify-register", daemon=True)
+        registrar.start()
+        self.to_register.put((self.root, False))
+        try:
+            self.read_events(self.fd, self.on_buffer, self.on_idle)
+        finally:
+            registrar.join()
+            self.close_fds("fd")
+
+    def close(self):
+        self.close_fds("fd")
+        super().close()
+
+
+class FanotifyObserver(_Observer):
+    def __init__(self, is_excluded=None):
+        super().__init__(is_excluded)
+        libc = get_libc()
+        self.fd = self.mount_fd = None
+        fd = libc.fanotify_init(FAN_CLASS_NOTIF | FAN_REPORT_DFID_NAME | FAN_CLOEXEC | FAN_NONBLOCK,
+                                os.O_RDONLY | os.O_LARGEFILE)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "fanotify_init failed")
+        self.fd = fd
+        self.handle_cache = {}  # file handle bytes -> directory path
+
+    def schedule(self, event_handler, path, recursive=True):
+        super().schedule(event_handler, path, recursive)
+        libc = get_libc()
+        events = FAN_ATTRIB | FAN_DELETE | FAN_ONDIR
+        # FAN_RENAME (5.17+) reports both names of a rename in one event
+        for move_events in (FAN_RENAME, FAN_MOVED_FROM | FAN_MOVED_TO):
+            if libc.fanotify_mark(self.fd, FAN_MARK_ADD | FAN_MARK_FILESYSTEM, events | move_events,
+                                  AT_FDCWD, os.fsencode(self.root)) == 0:
+                break
+        else:
+            raise OSError(ctypes.get_errno(), "fanotify_mark failed")
+        self.mount_fd = os.open(self.root, os.O_RDONLY | os.O_DIRECTORY)
+
+    def resolve_directory(self, handle):
+        """Turns a directory file handle into its current path, or None."""
+        path = self.handle_cache.get(handle)
+        if path is not None:
+            return path
+        fd = get_libc().open_by_handle_at(self.mount_fd, handle, os.O_PATH)
+        if fd < 0:
+            return None
+        try:
+            path = os.readlink(f"/proc/self/fd/{fd}")
+        finally:
+            os.close(fd)
+        if len(self.handle_cache) >= HANDLE_CACHE_SIZE:
+            self.handle_cache.clear()
+        self.handle_cache[handle] = path
+        return path
+
+    def parse_info(self, buffer, offset, end):
+        """Returns {info_type: (directory handle, name)} for the DFID_NAME records of one event."""
+        records = {}
+        while offset + FANOTIFY_INFO_HEADER.size <= end:
+            info_type, _, length = FANOTIFY_INFO_HEADER.unpack_from(buffer, offset)
+            if length == 0:
+                break
+            if info_type in (FAN_EVENT_INFO_TYPE_DFID_NAME, FAN_EVENT_INFO_TYPE_OLD_DFID_NAME,
+                             FAN_EVENT_INFO_TYPE_NEW_DFID_NAME):
+                # header, fsid (8 bytes), struct file_handle, then the name
+                handle_start = offset + FANOTIFY_INFO_HEADER.size + 8
+                handle_bytes = struct.unpack_from("I", buffer, handle_start)[0]
+                handle_end = handle_start + 8 + handle_bytes
+                name = buffer[handle_end:offset + length].split(b"\0", 1)[0]
+                records[info_type] = (bytes(buffer[handle_start:handle_end]), os.fsdecode(name))
+            offset += length
+        return records
+
+    def resolve_paths(self, records):
+        paths = {}
+        for info_type, (handle, name) in records.items():
+            directory = self.resolve_directory(handle)
+            if directory is not None:
+                paths[info_type] = os.path.join(directory, name) if name not in ("", ".") else directory
+        return paths
+
+    def in_scope(self, path):
+        return (path is not None and is_within(path, self.root)
+                and not self.is_excluded(os.path.dirname(path)))
+
+    def on_buffer(self, buffer):
+        events = []
+        offset = 0
+        while offset + FANOTIFY_METADATA.size <= len(buffer):
+            event_len, _, _, metadata_len, mask, fd, _ = FANOTIFY_METADATA.unpack_from(buffer, offset)
+            if event_len < FANOTIFY_METADATA.size:
+                break
+            if fd >= 0:
+                os.close(fd)
+            if mask & FAN_Q_OVERFLOW:
+                print("fanotify event queue overflowed; some changes were missed.")
+            else:
+                events.append((mask, self.parse_info(buffer, offset + metadata_len, offset + event_len)))
+            offset += event_len
+
+        if any(mask & FAN_ONDIR and mask & (FAN_RENAME | FAN_MOVED_FROM | FAN_MOVED_TO | FAN_DELETE)
+               for mask, _ in events):
+            # Directory paths behind cached handles may have changed
+            self.handle_cache.clear()
+
+        # Handles resolve to where a directory is now, after every event in
+        # this buffer. Walking backwards, undo the directory renames that
+        # happened after each event to get the path it had at the time.
+        resolved = []
+        later_renames = []
+        for mask, records in reversed(events):
+            paths = self.resolve_paths(records)
+            for info_type, path in paths.items():
+                for src, dest in later_renames:
+                    if is_within(path, dest):
+                        path = src + path[len(dest):]
+                paths[info_type] = path
+            if mask & FAN_RENAME and mask & FAN_ONDIR:
+                src = paths.get(FAN_EVENT_INFO_TYPE_OLD_DFID_NAME)
+                dest = paths.get(FAN_EVENT_INFO_TYPE_NEW_DFID_NAME)
+                if src and dest:
+                    later_renames.append((src, dest))
+            resolved.append((mask, paths))
+
+        for mask, paths in reversed(resolved):
+            self.handle_event(mask, paths)
+
+    def handle_event(self, mask, paths):
+        is_dir = bool(mask & FAN_ONDIR)
+        if mask & FAN_RENAME:
+            src = paths.get(FAN_EVENT_INFO_TYPE_OLD_DFID_NAME)
+            dest = paths.get(FAN_EVENT_INFO_TYPE_NEW_DFID_NAME)
+            src_in, dest_in = self.in_scope(src), self.in_scope(dest)
+            if src_in and dest_in:
+                if is_dir:
+                    self.dispatch(DirMovedEvent(src, dest))
+                    for event in sub_moved_events(src, dest):
+                        self.dispatch(event)
+                else:
+                    self.dispatch(FileMovedEvent(src, dest))
+            elif src_in:
+                self.dispatch(DirDeletedEvent(src) if is_dir else FileDeletedEvent(src))
+            elif dest_in:
+                if is_dir:
+                    for event in sub_created_events(dest):
+                        self.dispatch(event)
+                else:
+                    self.dispatch(FileCreatedEvent(dest))
+            return
+
+        path = paths.get(FAN_EVENT_INFO_TYPE_DFID_NAME)
+        if not self.in_scope(path):
+            return
+        if mask & FAN_ATTRIB:
+            if not is_dir:
+                self.dispatch(FileModifiedEvent(path))
+        elif mask & (FAN_DELETE | FAN_MOVED_FROM):
+            # Without FAN_RENAME, a move arrives as delete + create; the
+            # delete queue drops the hash again when the new path is tracked
+            self.dispatch(DirDeletedEvent(path) if is_dir else FileDeletedEvent(path))
+        elif mask & FAN_MOVED_TO:
+            if is_dir:
+                for event in sub_created_events(path):
+                    self.dispatch(event)
+            else:
+                self.dispatch(FileCreatedEvent(path))
+
+    def run(self):
+        try:
+            self.read_events(self.fd, self.on_buffer, lambda: None)
+        finally:
+            self.close_fds("fd", "mount_fd")
+
+    def close(self):
+        self.close_fds("fd", "mount_fd")
+        super().close()
+
+
+def create_observer(path, event_handler, is_excluded=None):
+    """
+    Returns a scheduled fanotify observer if permitted, otherwise an inotify
+    one, or None if neither can be created.
+    """
+    for backend in (FanotifyObserver, InotifyObserver):
+        observer = None
+        try:
+            observer = backend(is_excluded)
+            observer.schedule(event_handler, path, recursive=True)
+            print(f"Using {backend.__name__} for {path}.")
+            return observer
+        except (OSError, AttributeError) as e:
+            if observer is not None:
+                observer.close()
+            print(f"{backend.__name__} unavailable: {e}")
+    return None
@@ -8,6 +8,8 @@ try:
 except ImportError:
     xattr = None
 
+HASH_ATTRIBUTE_NAMES = ("file_hash_check_parts", "file_hash_check_parts.v2")
+
 
 def is_windows():
     return platform.system().lower() == "windows"
@@ -28,28 +30,30 @@ def show_metadata(file_path):
 
     if is_windows():
         # Windows ADS logic remains the same
-        ads_path = f"{file_path}:file_hash_check_parts"
-        try:
-            with open(ads_path, "r") as ads:
-                hash_data = ads.read().strip()
-            print(f"file_hash_check_parts (ADS) for '{file_path}': {hash_data}")
-        except Exception as e:
-            print(f"No ADS named 'file_hash_check_parts' found for '{file_path}'. Error: {e}")
+        for name in HASH_ATTRIBUTE_NAMES:
+            ads_path = f"{file_path}:{name}"
+            try:
+                with open(ads_path, "r") as ads:
+                    hash_data = ads.read().strip()
+                print(f"{name} (ADS) for '{file_path}': {hash_data}")
+            except Exception as e:
+                print(f"No ADS named '{name}' found for '{file_path}'. Error: {e}")
     elif is_linux() or is_macos():
         if xattr is None:
             print("xattr module not installed. Cannot read extended attributes.")
             return
-        try:
-            # Using pyxattr functional interface
-            hash_data = xattr.getxattr(
-                file_path, b"user.file_hash_check_parts")
-            hash_data = hash_data.decode('utf-8', errors='replace').strip()
-            print(f"user.file_hash_check_parts for '{file_path}': {hash_data}")
-        except OSError as e:
-            # If the attribute doesn't exist, OSError is raised
-            print(f"No 'user.file_hash_check_parts' attribute found for '{file_path}'. Error: {e}")
-        except Exception as e:
-            print(f"Error reading extended attribute: {e}")
+        for name in HASH_ATTRIBUTE_NAMES:
+            try:
+                # Using pyxattr functional interface
+                hash_data = xattr.getxattr(
+                    file_path, f"user.{name}".encode('utf-8'))
+                hash_data = hash_data.decode('utf-8', errors='replace').strip()
+                print(f"user.{name} for '{file_path}': {hash_data}")
+            except OSError as e:
+                # If the attribute doesn't exist, OSError is raised
+                print(f"No 'user.{name}' attribute found for '{file_path}'. Error: {e}")
+            except Exception as e:
+                print(f"Error reading extended attribute: {e}")
     else:
         print("Unsupported platform for this metadata demonstration.")
 
@@ -0,0 +1,104 @@
+"""
+Include/exclude rules deciding which paths the monitor looks at.
+
+Rules are compiled once:
+
+    excluded_paths   absolute directories skipped with everything below them
+    included_paths   absolute directories monitored even below an excluded one
+    excluded_names   glob patterns for directory names skipped anywhere
+                     (".git", "node_modules", ...)
+    skipped_suffixes file name endings never checked for metadata
+                     (partial downloads, editor swap files, ...)
+
+Absolute paths go into a trie keyed by path component. The deepest rule
+on a directory's path wins, and a prefix rule beats a name pattern at the
+same depth. The verdict for each directory is cached, so a burst of events
+in one directory costs a dictionary lookup per event. Deciding never touches
+the filesystem: paths are only case-normalized, never resolved.
+"""
+
+import fnmatch
+import os
+import re
+
+MONITORED = "monitored"
+SKIPPED = "skipped"   # Excluded, but an included path lies below it
+PRUNED = "pruned"     # Excluded with its whole subtree
+
+INCLUDE = "include"
+EXCLUDE = "exclude"
+
+VERDICT_CACHE_SIZE = 65536
+
+
+class _TrieNode:
+    __slots__ = ("children", "rule", "includes_below")
+
+    def __init__(self):
+        self.children = {}
+        self.rule = None
+        self.includes_below = False
+
+
+def split_path(path):
+    return os.path.normcase(path).rstrip(os.sep).split(os.sep)
+
+
+class PathRules:
+    def __init__(self, excluded_paths=(), included_paths=(), excluded_names=(), skipped_suffixes=()):
+        self.trie = _TrieNode()
+        for path in excluded_paths:
+            self.add_prefix(path, EXCLUDE)
+        for path in included_paths:
+            self.add_prefix(path, INCLUDE)
+
+        patterns = [fnmatch.translate(os.path.normcase(name)) for name in excluded_names]
+        self.excluded_name = re.compile("|".join(patterns)).match if patterns else None
+        self.skipped_suffixes = tuple(os.path.normcase(suffix) for suffix in skipped_suffixes)
+        self.verdicts = {}
+
+    def add_prefix(self, path, rule):
+        node = self.trie
+        for component in split_path(os.path.abspath(path)):
+            if rule == INCLUDE:
+                node.includes_below = True
+            node = node.children.setdefault(component, _TrieNode())
+        node.rule = rule
+
+    def dir_verdict(self, directory):
+        """MONITORED, SKIPPED or PRUNED for an absolute directory path."""
+        directory = os.path.normcase(directory)
+        verdict = self.verdicts.get(directory)
+        if verdict is not None:
+            return verdict
+
+        rule = INCLUDE
+        node = self.trie
+        for depth, component in enumerate(directory.rstrip(os.sep).split(os.sep)):
+            if depth and self.excluded_name and self.excluded_name(component):
+                rule = EXCLUDE
+            node = node.children.get(component) if node is not None else None
+            if node is not None and node.rule is not None:
+                rule = node.rule
+
+        if rule == INCLUDE:
+            verdict = MONITORED
+        elif node is not None and node.includes_below:
+            verdict = SKIPPED
+        else:
+            verdict = PRUNED
+
+        if len(self.verdicts) >= VERDICT_CACHE_SIZE:
+            self.verdicts.clear()
+        self.verdicts[directory] = verdict
+        return verdict
+
+    def is_pruned(self, directory):
+        """True if nothing under `directory` is monitored, so it need not be walked or watched."""
+        return self.dir_verdict(directory) == PRUNED
+
+    def is_monitored(self, file_path):
+        """True if a file at this path could be a tracked download."""
+        if self.skipped_suffixes and os.path.normcase(file_path).endswith(self.skipped_suffixes):
+            return False
+        return self.dir_verdict(os.path.dirname(file_path)) == MONITORED
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import delete_queue
+from delete_queue import DeleteQueue
+
+
+class FakeServer:
+    """Stands in for send_batch: records batches, failing the first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.batches = []
+        self.delivered = threading.Event()
+
+    def __call__(self, batch):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.batches.append(batch)
+        self.delivered.set()
+        return True
+
+
+def make_queue(tmp_path, monkeypatch, server):
+    monkeypatch.setattr(delete_queue, 'COALESCE_SECONDS', 0)
+    monkeypatch.setattr(delete_queue, 'MIN_BACKOFF_SECONDS', 0.01)
+    queue = DeleteQueue(str(tmp_path / 'pending_deletes.txt'))
+    monkeypatch.setattr(queue, 'send_batch', server)
+    return queue
+
+
+def test_queued_hashes_are_sent_once(tmp_path, monkeypatch):
+    server = FakeServer()
+    queue = make_queue(tmp_path, monkeypatch, server)
+    for partial_hash in ('a', 'b', 'a'):
+        queue.enqueue(partial_hash)
+    queue.start()
+    assert server.delivered.wait(5)
+    queue.stop()
+    assert server.batches == [['a', 'b']]
+    assert (tmp_path / 'pending_deletes.txt').read_text() == ''
+
+
+def test_discarded_hash_is_not_sent(tmp_path, monkeypatch):
+    server = FakeServer()
+    queue = make_queue(tmp_path, monkeypatch, server)
+    queue.enqueue('a')
+    queue.enqueue('b')
+    queue.discard('a')
+    queue.start()
+    assert server.delivered.wait(5)
+    queue.stop()
+    assert server.batches == [['b']]
+
+
+def test_failed_batch_is_retried(tmp_path, monkeypatch):
+    server = FakeServer(failures=2)
+    queue = make_queue(tmp_path, monkeypatch, server)
+    queue.enqueue('a')
+    queue.start()
+    assert server.delivered.wait(5)
+    queue.stop()
+    assert server.batches == [['a']]
+
+
+def test_new_deletes_do_not_cut_the_backoff_short(tmp_path, monkeypatch):
+    server = FakeServer(failures=1)
+    queue = make_queue(tmp_path, monkeypatch, server)
+    monkeypatch.setattr(delete_queue, 'MIN_BACKOFF_SECONDS', 1)
+    queue.enqueue('a')
+    queue.start()
+    for partial_hash in ('b', 'c', 'd'):
+        time.sleep(0.1)
+        queue.enqueue(partial_hash)
+    assert server.calls == 1
+    assert server.delivered.wait(5)
+    queue.stop()
+    assert server.batches == [['a', 'b', 'c', 'd']]
+
+
+def test_undelivered_hashes_survive_a_restart(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, monkeypatch, FakeServer())
+    queue.enqueue('a')
+    queue.enqueue('b')
+    queue.stop()  # Never started: nothing was sent
+
+    server = FakeServer()
+    resumed = make_queue(tmp_path, monkeypatch, server)
+    assert list(resumed.pending) == ['a', 'b']
+    resumed.start()
+    assert server.delivered.wait(5)
+    resumed.stop()
+    assert server.batches == [['a', 'b']]
@@ -0,0 +1,55 @@
+import os
+
+from path_rules import PathRules, MONITORED, SKIPPED, PRUNED
+
+ROOT = os.path.abspath(os.sep + 'home')
+
+
+def path(*parts):
+    return os.path.join(ROOT, *parts)
+
+
+def test_everything_is_monitored_without_rules():
+    rules = PathRules()
+    assert rules.dir_verdict(path('user', '.cache')) == MONITORED
+    assert rules.is_monitored(path('user', 'file.zip'))
+
+
+def test_excluded_path_prunes_its_subtree():
+    rules = PathRules(excluded_paths=[path('user', 'build')])
+    assert rules.is_pruned(path('user', 'build'))
+    assert rules.is_pruned(path('user', 'build', 'deep', 'er'))
+    assert not rules.is_pruned(path('user', 'builds'))
+    assert not rules.is_monitored(path('user', 'build', 'file.zip'))
+
+
+def test_included_path_below_an_exclusion_wins():
+    rules = PathRules(excluded_paths=[path('user', '.cache')],
+                      included_paths=[path('user', '.cache', 'downloads')])
+    assert rules.dir_verdict(path('user', '.cache')) == SKIPPED
+    assert rules.dir_verdict(path('user', '.cache', 'other')) == PRUNED
+    assert rules.dir_verdict(path('user', '.cache', 'downloads', 'x')) == MONITORED
+    assert not rules.is_monitored(path('user', '.cache', 'file.zip'))
+    assert rules.is_monitored(path('user', '.cache', 'downloads', 'file.zip'))
+
+
+def test_excluded_names_match_at_any_depth():
+    rules = PathRules(excluded_names=['node_modules', '*.egg-info'])
+    assert rules.is_pruned(path('user', 'app', 'node_modules'))
+    assert rules.is_pruned(path('user', 'app', 'node_modules', 'pkg'))
+    assert rules.is_pruned(path('user', 'pkg.egg-info'))
+    assert not rules.is_pruned(path('user', 'app', 'node_modules_backup'))
+
+
+def test_included_path_beats_an_excluded_name():
+    rules = PathRules(included_paths=[path('user', 'app', 'node_modules', 'keep')],
+                      excluded_names=['node_modules'])
+    assert rules.dir_verdict(path('user', 'app', 'node_modules')) == SKIPPED
+    assert rules.is_monitored(path('user', 'app', 'node_modules', 'keep', 'file.zip'))
+
+
+def test_skipped_suffixes_are_not_monitored():
+    rules = PathRules(skipped_suffixes=['.part', '~'])
+    assert not rules.is_monitored(path('user', 'file.zip.part'))
+    assert not rules.is_monitored(path('user', 'notes.txt~'))
+    assert rules.is_monitored(path('user', 'file.zip'))
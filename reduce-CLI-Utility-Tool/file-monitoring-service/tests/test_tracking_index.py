@@ -0,0 +1,110 @@
+import os
+
+from tracking_index import TrackingIndex
+
+TAG = 'tagged'
+OLD_MTIME = 1_000_000_000  # Well outside RACY_STAMP_SECONDS
+
+
+def read_metadata(path):
+    return 'hash-' + os.path.basename(path) if os.path.basename(path).startswith(TAG) else None
+
+
+def age(*paths):
+    for path in paths:
+        os.utime(path, (OLD_MTIME, OLD_MTIME))
+
+
+def make_tree(tmp_path):
+    root = tmp_path / 'root'
+    skipped = root / 'skipped'
+    nested = skipped / 'nested'
+    nested.mkdir(parents=True)
+    (skipped / (TAG + '-a')).write_text('a')
+    (nested / (TAG + '-b')).write_text('b')
+    age(nested, skipped, root)
+    return str(root), str(skipped), str(nested)
+
+
+def rescan(tmp_path, root, is_excluded=lambda path: False):
+    index = TrackingIndex(str(tmp_path / 'index.db'))
+    index.load(root)
+    found, removed, _ = index.scan(root, read_metadata, os.path.normpath, is_excluded, workers=2)
+    index.save(root, found)
+    return found, removed
+
+
+def test_unchanged_tree_is_reused(tmp_path):
+    root, skipped, nested = make_tree(tmp_path)
+    found, _ = rescan(tmp_path, root)
+    assert sorted(found) == sorted([os.path.join(skipped, TAG + '-a'), os.path.join(nested, TAG + '-b')])
+
+    index = TrackingIndex(str(tmp_path / 'index.db'))
+    index.load(root)
+    found_again, removed, scanned_dirs = index.scan(root, read_metadata, os.path.normpath,
+                                                    lambda path: False, workers=2)
+    assert found_again == found
+    assert removed == {}
+    assert scanned_dirs == 0
+
+
+def test_excluded_directory_is_scanned_once_no_longer_excluded(tmp_path):
+    root, skipped, nested = make_tree(tmp_path)
+    found, removed = rescan(tmp_path, root, lambda path: path == skipped)
+    assert found == {}
+    assert removed == {}
+
+    # The root is unchanged, so only the stored skip makes it look again
+    found, removed = rescan(tmp_path, root)
+    assert sorted(found) == sorted([os.path.join(skipped, TAG + '-a'), os.path.join(nested, TAG + '-b')])
+    assert removed == {}
+
+
+def test_unreadable_directory_is_retried_and_not_reported_removed(tmp_path, monkeypatch):
+    root, skipped, nested = make_tree(tmp_path)
+    tracked, _ = rescan(tmp_path, root)
+    # Changed since the last start, so it is listed, but the listing fails
+    age(root)
+    os.utime(skipped, (OLD_MTIME + 1, OLD_MTIME + 1))
+
+    real_scandir = os.scandir
+
+    def failing_scandir(path):
+        if path == skipped:
+            raise PermissionError(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    found, removed = rescan(tmp_path, root)
+    assert found == {}
+    assert removed == {}
+
+    monkeypatch.setattr(os, 'scandir', real_scandir)
+    found, removed = rescan(tmp_path, root)
+    assert found == tracked
+    assert removed == {}
+
+
+def test_deleted_files_are_reported(tmp_path):
+    root, skipped, nested = make_tree(tmp_path)
+    tracked, _ = rescan(tmp_path, root)
+    os.remove(os.path.join(nested, TAG + '-b'))
+
+    found, removed = rescan(tmp_path, root)
+    assert sorted(found) == [os.path.join(skipped, TAG + '-a')]
+    assert removed == {os.path.join(nested, TAG + '-b'): 'hash-' + TAG + '-b'}
+
+
+def test_every_directory_is_recorded_under_its_parent(tmp_path):
+    root = tmp_path / 'root'
+    for a in range(6):
+        for b in range(6):
+            (root / f'a{a}' / f'b{b}').mkdir(parents=True)
+            (root / f'a{a}' / f'b{b}' / (TAG + f'-{a}-{b}')).write_text('x')
+    index = TrackingIndex(str(tmp_path / 'index.db'))
+    found, _, scanned_dirs = index.scan(str(root), read_metadata, os.path.normpath, lambda path: False, workers=2)
+    assert len(found) == 36
+    assert scanned_dirs == 1 + 6 + 36
+    for directory, (_, _, parent) in index.dirs.items():
+        expected = None if directory == str(root) else os.path.dirname(directory)
+        assert parent == expected
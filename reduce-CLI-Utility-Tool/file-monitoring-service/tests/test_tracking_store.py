@@ -0,0 +1,88 @@
+import os
+
+from tracking_store import TrackingStore, pack_hash
+
+PREFIX_HASH = 'ab' * 32
+SPARSE_HASH = 'v2:' + 'cd' * 32
+
+
+def test_hash_strings_round_trip():
+    store = TrackingStore()
+    hashes = {'/d/prefix': PREFIX_HASH, '/d/sparse': SPARSE_HASH,
+              '/d/raw': 'legacy-hash', '/d/upper': 'AB' * 32}
+    for path, hash_data in hashes.items():
+        assert store.add(path, hash_data)
+    for path, hash_data in hashes.items():
+        assert store.get(path) == hash_data
+    assert pack_hash(PREFIX_HASH)[0] == 1
+    assert pack_hash(SPARSE_HASH)[0] == 2
+    assert pack_hash('AB' * 32)[0] == 0  # Would not round-trip as hex
+
+
+def test_add_get_remove():
+    store = TrackingStore()
+    assert store.add('/d/a', PREFIX_HASH)
+    assert not store.add('/d/a', SPARSE_HASH)
+    assert '/d/a' in store and len(store) == 1
+    assert store.remove('/d/a') == PREFIX_HASH
+    assert store.remove('/d/a') is None
+    assert '/d/a' not in store and len(store) == 0
+    assert store.get('/d/a') is None
+
+
+def test_many_paths_survive_resizes_and_removals():
+    store = TrackingStore()
+    paths = {os.path.join(f'/dir{n % 37}', f'file-{n}.bin'): f'{n:064x}' for n in range(5000)}
+    for path, hash_data in paths.items():
+        store.add(path, hash_data)
+    for n, path in enumerate(list(paths)):
+        if n % 3 == 0:
+            assert store.remove(path) == paths.pop(path)
+    assert len(store) == len(paths)
+    assert dict(store.items()) == paths
+    for path, hash_data in paths.items():
+        assert store.get(path) == hash_data
+        assert store.path_for_hash(hash_data) == path
+
+
+def test_name_buffer_is_compacted():
+    store = TrackingStore()
+    name = 'x' * 1000
+    for n in range(3000):
+        store.add(f'/d/{n}-{name}', f'{n:064x}')
+    for n in range(2500):
+        store.remove(f'/d/{n}-{name}')
+    # About 3 MB of names were written; the removed ones are dropped once
+    # they are more than 1 MB and more than half of the buffer
+    assert len(store.names) < 2 * 1024 * 1024
+    assert len(store.names) - store.unused_name_bytes == sum(len(f'{n}-{name}') for n in range(2500, 3000))
+    assert store.get(f'/d/2999-{name}') == f'{2999:064x}'
+
+
+def test_copies_of_one_download_are_counted():
+    store = TrackingStore()
+    for path in ('/d/a', '/e/a', '/e/b'):
+        store.add(path, PREFIX_HASH)
+    store.add('/d/other', SPARSE_HASH)
+    assert store.hash_count(PREFIX_HASH) == 3
+    assert sorted(store.paths_for_hash(PREFIX_HASH)) == ['/d/a', '/e/a', '/e/b']
+
+    assert store.remove('/e/a') == PREFIX_HASH
+    assert store.hash_count(PREFIX_HASH) == 2
+    assert store.path_for_hash(PREFIX_HASH) in ('/d/a', '/e/b')
+    store.remove('/d/a')
+    store.remove('/e/b')
+    assert store.hash_count(PREFIX_HASH) == 0
+    assert store.path_for_hash(PREFIX_HASH) is None
+    assert store.hash_count(SPARSE_HASH) == 1
+
+
+def test_copies_survive_a_resize():
+    store = TrackingStore()
+    for n in range(1000):
+        store.add(f'/copies/{n}', SPARSE_HASH)
+        store.add(f'/unique/{n}', f'{n:064x}')
+    assert store.hash_count(SPARSE_HASH) == 1000
+    for n in range(999):
+        store.remove(f'/copies/{n}')
+    assert store.paths_for_hash(SPARSE_HASH) == ['/copies/999']
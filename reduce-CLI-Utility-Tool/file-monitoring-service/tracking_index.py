@@ -0,0 +1,247 @@
+"""
+Persistent index of tagged files, so the monitor does not rescan the whole
+tree on every start.
+
+The index is an SQLite file in the ReDUCE cache directory (next to the
+device fingerprint cache). It stores:
+
+    dirs    every scanned directory with its mtime and inode at scan time,
+            and its parent, so the tree can be walked without listing it
+    files   every tracked file with its hash, grouped by directory
+
+A directory's mtime changes whenever an entry is created, deleted or
+renamed in it. On a warm start each known directory is only stat()ed: if
+its stamp is unchanged, its stored subdirectories and tagged files are
+reused, and only changed or new directories are listed and have their files'
+metadata read. Directories that were skipped (excluded or unreadable) are
+stored with a zero stamp, so the next start tries them again.
+
+Metadata attached to an existing file, in a directory that did not change,
+while the monitor was not running is not picked up until that directory
+changes.
+"""
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import repeat
+
+from device_identity import get_cache_path
+
+INDEX_FILENAME = "monitor_index.db"
+
+# A directory modified this close to its scan may change again within the
+# same mtime tick, so its stamp is not trusted on the next start.
+RACY_STAMP_SECONDS = 2
+
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+MAX_PENDING_PER_WORKER = 4  # Directories queued to the pool per worker thread
+
+
+def get_index_path():
+    return os.path.join(os.path.dirname(get_cache_path()), INDEX_FILENAME)
+
+
+class TrackingIndex:
+    def __init__(self, index_path=None):
+        self.index_path = index_path or get_index_path()
+        self.dirs = {}    # dir -> (mtime_ns, inode, parent)
+        self.files = {}   # dir -> {file path: hash}
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        conn = sqlite3.connect(self.index_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                parent TEXT,
+                PRIMARY KEY (root, path)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (root, path)
+            )
+        ''')
+        return conn
+
+    def load(self, root):
+        """Loads the index saved for `root`. A missing or unreadable index leaves it empty."""
+        self.dirs = {}
+        self.files = {}
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            conn = self._connect()
+            try:
+                for path, mtime_ns, inode, parent in conn.execute(
+                        'SELECT path, mtime_ns, inode, parent FROM dirs WHERE root = ?', (root,)):
+                    self.dirs[path] = (mtime_ns, inode, parent)
+                for path, directory, hash_data in conn.execute(
+                        'SELECT path, dir, hash FROM files WHERE root = ?', (root,)):
+                    self.files.setdefault(directory, {})[path] = hash_data
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not read tracking index, doing a full scan: {e}")
+            self.dirs = {}
+            self.files = {}
+
+    def save(self, root, tracked):
+        """Stores the directory stamps from the last scan and the currently tracked files."""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM dirs WHERE root = ?', (root,))
+                    conn.execute('DELETE FROM files WHERE root = ?', (root,))
+                    conn.executemany(
+                        'INSERT INTO dirs VALUES (?, ?, ?, ?, ?)',
+                        ((root, path, mtime_ns, inode, parent)
+                         for path, (mtime_ns, inode, parent) in self.dirs.items()))
+                    conn.executemany(
+                        'INSERT INTO files VALUES (?, ?, ?, ?)',
+                        ((root, path, os.path.dirname(path), hash_data)
+                         for path, hash_data in tracked.items()))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Could not save tracking index: {e}")
+
+    def scan(self, root, read_metadata, normalize, is_excluded, workers=SCAN_WORKERS):
+        """
+        Walks `root`, reusing unchanged directories from the loaded index.
+
+        read_metadata(file_path) returns a file's hash or None, normalize(path)
+        gives the tracking key and is_excluded(dir) skips a subtree.
+
+        Directories are handed out to a pool of `workers` threads; the
+        xattr/ADS reads release the GIL, so several directories are read at
+        once. At most MAX_PENDING_PER_WORKER directories per worker are in
+        flight, and results are merged on the calling thread only.
+
+        Returns (found, removed, scanned_dirs): found and removed map file
+        paths to hashes, removed being the tracked files that disappeared
+        while the monitor was not running.
+        """
+        children_of = {}
+        for path, (_, _, parent) in self.dirs.items():
+            children_of.setdefault(parent, []).append(path)
+
+        old_dirs = self.dirs
+        old_files = self.files
+        self.dirs = {}
+        self.files = {}
+        found = {}
+        skipped = set()
+        scanned_dirs = 0
+        racy_after = time.time_ns() - RACY_STAMP_SECONDS * 1_000_000_000
+
+        def visit(directory, parent):
+            """
+            Returns (stamp, files, subdirectories, listed) for one directory,
+            or None if it no longer exists. files is None if the directory
+            was skipped without being looked at.
+            """
+            # Skipped directories are still recorded, under a zero stamp, so
+            # the next start lists them even if their parent is unchanged
+            if is_excluded(directory):
+                return (0, 0, parent), None, (), False
+            try:
+                stat = os.stat(directory)
+            except (FileNotFoundError, NotADirectoryError):
+                # Gone: its parent changed, so a new one there is still found
+                return None
+            except OSError:
+                return (0, 0, parent), None, (), False
+
+            old = old_dirs.get(directory)
+            if old is not None and old[:2] == (stat.st_mtime_ns, stat.st_ino):
+                # Unchanged: reuse its files and walk its known subdirectories
+                stamp = (stat.st_mtime_ns, stat.st_ino, parent)
+                return stamp, old_files.get(directory, {}), children_of.get(directory, ()), False
+
+            dir_files = {}
+            subdirs = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(normalize(entry.path))
+                            elif entry.is_file():
+                                hash_data = read_metadata(entry.path)
+                                if hash_data:
+                                    dir_files[normalize(entry.path)] = hash_data
+                        except OSError:
+                            continue
+            except OSError:
+                return (0, stat.st_ino, parent), None, (), False
+
+            mtime_ns = stat.st_mtime_ns if stat.st_mtime_ns < racy_after else 0
+            return (mtime_ns, stat.st_ino, parent), dir_files, subdirs, True
+
+        # A stack of iterators over each listed directory's subdirectories,
+        # handed out depth-first: only the listings along the paths being
+        # walked are held, not every directory discovered so far
+        pending = [iter([(normalize(root), None)])]
+        in_flight = {}
+        max_in_flight = workers * MAX_PENDING_PER_WORKER
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_in_flight:
+                    entry = next(pending[-1], None)
+                    if entry is None:
+                        pending.pop()
+                        continue
+                    directory, parent = entry
+                    in_flight[pool.submit(visit, directory, parent)] = directory
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory = in_flight.pop(future)
+                    result = future.result()
+                    if result is None:
+                        continue
+                    stamp, dir_files, subdirs, listed = result
+                    scanned_dirs += listed
+                    self.dirs[directory] = stamp
+                    if dir_files is None:
+                        skipped.add(directory)
+                    elif dir_files:
+                        self.files[directory] = dir_files
+                        found.update(dir_files)
+                    if subdirs:
+                        pending.append(zip(subdirs, repeat(directory)))
+
+        removed = {}
+        for directory, dir_files in old_files.items():
+            # Files under a skipped or newly excluded path were not looked at, not deleted
+            if directory in skipped or (
+                    directory not in self.dirs
+                    and self._is_under_excluded(directory, root, normalize,
+                                                lambda path: path in skipped or is_excluded(path))):
+                continue
+            for path, hash_data in dir_files.items():
+                if path not in found:
+                    removed[path] = hash_data
+        return found, removed, scanned_dirs
+
+    @staticmethod
+    def _is_under_excluded(directory, root, normalize, is_excluded):
+        root = normalize(root)
+        while True:
+            if is_excluded(directory):
+                return True
+            parent = os.path.dirname(directory)
+            if directory == root or parent == directory:
+                return False
+            directory = parent
@@ -0,0 +1,281 @@
+"""
+Compact in-memory store of the tracked files: which path holds which hash.
+
+Two dicts of full path strings and 64-character hash strings cost close to
+300 bytes per file. Here every file is one slot in a set of flat arrays:
+
+    slot_dir     id of the file's directory; directory paths are interned
+    name_start   offset of the file name in a shared UTF-8 byte buffer
+    name_len     length of the file name in that buffer
+    digests      DIGEST_SIZE bytes per slot: a version byte and the 32-byte
+                 sha256 digest the hash string encodes
+
+Two open-addressing tables of slot numbers index the slots by path and by
+hash, so no per-file Python objects are kept. A file costs about 100 bytes.
+The hash table is a multimap: copies of one download at several paths each
+keep their own slot, and hash_count() says how many are left.
+
+Hash strings are packed as:
+
+    "<64 hex digits>"      version 1, the prefix hash
+    "v2:<64 hex digits>"   version 2, the sparse fingerprint
+    anything else          version 0, sha256 of the string; the string
+                           itself is kept aside so it is returned unchanged
+"""
+
+import hashlib
+import os
+from array import array
+
+DIGEST_SIZE = 33
+VERSION_PREFIXES = {1: "", 2: "v2:"}
+
+EMPTY = 0
+REMOVED = -1
+MIN_TABLE_SIZE = 8
+
+
+def pack_hash(hash_data):
+    """Returns the DIGEST_SIZE-byte key for a hash string."""
+    for version, prefix in VERSION_PREFIXES.items():
+        hex_digest = hash_data[len(prefix):]
+        if hash_data.startswith(prefix) and len(hex_digest) == 64:
+            try:
+                digest = bytes.fromhex(hex_digest)
+            except ValueError:
+                continue
+            if digest.hex() == hex_digest:
+                return bytes((version,)) + digest
+    return b"\0" + hashlib.sha256(hash_data.encode("utf-8", "surrogatepass")).digest()
+
+
+def encode_name(name):
+    return name.encode("utf-8", "surrogatepass")
+
+
+class TrackingStore:
+    def __init__(self):
+        self.dir_ids = {}             # directory -> id
+        self.dir_paths = []           # id -> directory, None once unused
+        self.dir_files = array("I")   # id -> number of tracked files in it
+        self.free_dir_ids = []
+
+        self.slot_dir = array("I")
+        self.name_start = array("I")
+        self.name_len = array("H")
+        self.names = bytearray()
+        self.digests = bytearray()
+        self.raw_hashes = {}          # slot -> hash string stored as version 0
+        self.free_slots = []
+        self.unused_name_bytes = 0
+
+        # slot + 1 per entry; EMPTY ends a probe, REMOVED does not
+        self.by_path = array("i", [EMPTY]) * MIN_TABLE_SIZE
+        self.by_hash = array("i", [EMPTY]) * MIN_TABLE_SIZE
+        self.count = 0
+        self.removed_entries = 0
+        self.changes = 0              # Bumped by every add and remove
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, path):
+        return self._find_path(path)[1] >= 0
+
+    # Slots
+
+    def _slot_path(self, slot):
+        start = self.name_start[slot]
+        name = self.names[start:start + self.name_len[slot]].decode("utf-8", "surrogatepass")
+        return os.path.join(self.dir_paths[self.slot_dir[slot]], name)
+
+    def _slot_key(self, slot):
+        return bytes(self.digests[slot * DIGEST_SIZE:(slot + 1) * DIGEST_SIZE])
+
+    def _slot_hash(self, slot):
+        key = self._slot_key(slot)
+        if key[0] == 0:
+            return self.raw_hashes[slot]
+        return VERSION_PREFIXES[key[0]] + key[1:].hex()
+
+    def _slot_name_matches(self, slot, dir_id, name):
+        if self.slot_dir[slot] != dir_id or self.name_len[slot] != len(name):
+            return False
+        start = self.name_start[slot]
+        return self.names[start:start + len(name)] == name
+
+    # Probing
+
+    def _find_path(self, path):
+        """Returns (table index, slot); slot is -1 and the index free if the path is not stored."""
+        directory, name = os.path.split(path)
+        dir_id = self.dir_ids.get(directory)
+        if dir_id is None:
+            return -1, -1
+        return self._probe_path(dir_id, encode_name(name))
+
+    def _probe_path(self, dir_id, name):
+        table = self.by_path
+        mask = len(table) - 1
+        index = hash((dir_id, name)) & mask
+        free = -1
+        while True:
+            entry = table[index]
+            if entry == EMPTY:
+                return (index if free < 0 else free), -1
+            if entry == REMOVED:
+                if free < 0:
+                    free = index
+            elif self._slot_name_matches(entry - 1, dir_id, name):
+                return index, entry - 1
+            index = (index + 1) & mask
+
+    def _probe_hash(self, key):
+        """Yields (table index, slot) for every stored slot with this key."""
+        table = self.by_hash
+        mask = len(table) - 1
+        index = hash(key) & mask
+        while True:
+            entry = table[index]
+            if entry == EMPTY:
+                return
+            if entry != REMOVED and self._slot_key(entry - 1) == key:
+                yield index, entry - 1
+            index = (index + 1) & mask
+
+    def _free_hash_index(self, key):
+        table = self.by_hash
+        mask = len(table) - 1
+        index = hash(key) & mask
+        while table[index] not in (EMPTY, REMOVED):
+            index = (index + 1) & mask
+        return index
+
+    def _resize(self):
+        """Rebuilds both tables at a load factor of at most 1/4, dropping removed entries."""
+        size = MIN_TABLE_SIZE
+        while size < self.count * 4:
+            size *= 2
+        self.by_path = array("i", [EMPTY]) * size
+        self.by_hash = array("i", [EMPTY]) * size
+        self.removed_entries = 0
+        free_slots = set(self.free_slots)
+        for slot in range(len(self.slot_dir)):
+            if slot in free_slots:
+                continue
+            start = self.name_start[slot]
+            name = bytes(self.names[start:start + self.name_len[slot]])
+            self.by_path[self._probe_path(self.slot_dir[slot], name)[0]] = slot + 1
+            self.by_hash[self._free_hash_index(self._slot_key(slot))] = slot + 1
+
+    def _compact_names(self):
+        names = bytearray()
+        free_slots = set(self.free_slots)
+        for slot in range(len(self.slot_dir)):
+            if slot in free_slots:
+                continue
+            start = self.name_start[slot]
+            self.name_start[slot] = len(names)
+            names += self.names[start:start + self.name_len[slot]]
+        self.names = names
+        self.unused_name_bytes = 0
+
+    # Operations
+
+    def get(self, path):
+        """Returns the hash tracked for `path`, or None."""
+        slot = self._find_path(path)[1]
+        return self._slot_hash(slot) if slot >= 0 else None
+
+    def add(self, path, hash_data):
+        """Tracks `path` with `hash_data`. Returns False if the path is already tracked."""
+        directory, name = os.path.split(path)
+        name = encode_name(name)
+        dir_id = self.dir_ids.get(directory)
+        if dir_id is not None and self._probe_path(dir_id, name)[1] >= 0:
+            return False
+
+        if (self.count + self.removed_entries + 1) * 2 > len(self.by_path):
+            self._resize()
+        if dir_id is None:
+            if self.free_dir_ids:
+                dir_id = self.free_dir_ids.pop()
+                self.dir_paths[dir_id] = directory
+            else:
+                dir_id = len(self.dir_paths)
+                self.dir_paths.append(directory)
+                self.dir_files.append(0)
+            self.dir_ids[directory] = dir_id
+        self.dir_files[dir_id] += 1
+
+        key = pack_hash(hash_data)
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slot_dir[slot] = dir_id
+            self.name_start[slot] = len(self.names)
+            self.name_len[slot] = len(name)
+            self.digests[slot * DIGEST_SIZE:(slot + 1) * DIGEST_SIZE] = key
+        else:
+            slot = len(self.slot_dir)
+            self.slot_dir.append(dir_id)
+            self.name_start.append(len(self.names))
+            self.name_len.append(len(name))
+            self.digests += key
+        self.names += name
+        if key[0] == 0:
+            self.raw_hashes[slot] = hash_data
+
+        self.by_path[self._probe_path(dir_id, name)[0]] = slot + 1
+        self.by_hash[self._free_hash_index(key)] = slot + 1
+        self.count += 1
+        self.changes += 1
+        return True
+
+    def remove(self, path):
+        """Stops tracking `path`. Returns its hash, or None if it was not tracked."""
+        path_index, slot = self._find_path(path)
+        if slot < 0:
+            return None
+        hash_data = self._slot_hash(slot)
+        for hash_index, found in self._probe_hash(self._slot_key(slot)):
+            if found == slot:
+                self.by_hash[hash_index] = REMOVED
+                break
+        self.by_path[path_index] = REMOVED
+        self.removed_entries += 1
+        self.count -= 1
+        self.changes += 1
+
+        dir_id = self.slot_dir[slot]
+        self.dir_files[dir_id] -= 1
+        if self.dir_files[dir_id] == 0:
+            del self.dir_ids[self.dir_paths[dir_id]]
+            self.dir_paths[dir_id] = None
+            self.free_dir_ids.append(dir_id)
+        self.raw_hashes.pop(slot, None)
+        self.free_slots.append(slot)
+        self.unused_name_bytes += self.name_len[slot]
+        if self.unused_name_bytes > 1024 * 1024 and self.unused_name_bytes * 2 > len(self.names):
+            self._compact_names()
+        return hash_data
+
+    def path_for_hash(self, hash_data):
+        """Returns a tracked path holding `hash_data`, or None."""
+        for _, slot in self._probe_hash(pack_hash(hash_data)):
+            return self._slot_path(slot)
+        return None
+
+    def paths_for_hash(self, hash_data):
+        """Returns every tracked path holding `hash_data`: the local copies of one download."""
+        return [self._slot_path(slot) for _, slot in self._probe_hash(pack_hash(hash_data))]
+
+    def hash_count(self, hash_data):
+        """Number of tracked paths holding `hash_data`."""
+        return sum(1 for _ in self._probe_hash(pack_hash(hash_data)))
+
+    def items(self):
+        """Yields (path, hash) for every tracked file."""
+        free_slots = set(self.free_slots)
+        for slot in range(len(self.slot_dir)):
+            if slot not in free_slots:
+                yield self._slot_path(slot), self._slot_hash(slot)
@@ -0,0 +1,34 @@
+"""
+Production serving mode for the metadata server.
+
+Wraps the Flask app in an ASGI adapter and runs it under uvicorn. Requests
+are accepted on the event loop, while each Flask view (and the SQLite work
+it does) runs on a bounded thread pool, so a slow query never blocks other
+connections.
+
+The server runs as a single process: the in-memory duplicate index
+(duplicate_index.py) only sees writes made by its own process, and SQLite
+allows one writer at a time anyway.
+
+Usage:
+    python asgi.py
+    uvicorn asgi:asgi_app --host 127.0.0.1 --port 5050
+"""
+
+from a2wsgi import WSGIMiddleware
+
+from main import app
+from model import POOL_SIZE
+
+HOST = '127.0.0.1'
+PORT = 5050
+
+# One DB thread per pooled connection, so busy threads never open extra ones
+DB_WORKER_THREADS = POOL_SIZE
+
+asgi_app = WSGIMiddleware(app, workers=DB_WORKER_THREADS)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run('asgi:asgi_app', host=HOST, port=PORT)
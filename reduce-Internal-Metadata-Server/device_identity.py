@@ -0,0 +1,150 @@
+"""
+Device fingerprint (device ID, name, current user, MAC address) shared by the
+ReDUCE server, CLI wrapper and file monitor.
+
+Probing the device forks `ip link` / `getmac` / `system_profiler`, so the
+fingerprint is computed once, kept in memory and persisted to a small JSON
+cache in the user's cache directory. Every ReDUCE tool on the machine reads
+the same cache file, and it is refreshed once it is older than
+CACHE_TTL_SECONDS.
+"""
+
+import json
+import os
+import platform
+import socket
+import subprocess
+import threading
+import time
+import uuid
+
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_FILENAME = "device_info.json"
+
+_cached_info = None
+_cached_at = 0
+_lock = threading.Lock()
+
+
+def get_cache_path():
+    if platform.system() == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif platform.system() == "Darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "reduce", CACHE_FILENAME)
+
+
+def probe_system_info():
+    """Probes the device for its fingerprint. Slow: runs external commands."""
+    system_info = {}
+
+    def get_device_id():
+        try:
+            if platform.system() == "Linux":
+                with open("/etc/machine-id", "r") as f:
+                    return f.read().strip()
+            elif platform.system() == "Windows":
+                return str(uuid.uuid1())
+            elif platform.system() == "Darwin":
+                return subprocess.check_output("system_profiler SPHardwareDataType | grep 'UUID:'", shell=True).decode().split(":")[1].strip()
+            else:
+                return "Platform not supported for device ID"
+        except FileNotFoundError:
+            return get_mac_address()  # Fallback
+        except Exception as e:
+            print(f"Error getting device ID: {e}")
+            return "Unknown"
+
+    def get_device_name():
+        try:
+            return socket.gethostname()
+        except Exception as e:
+            print(f"Error getting device name: {e}")
+            return "Unknown"
+
+    def get_current_user():
+        try:
+            if platform.system() == "Windows":
+                return os.environ.get("USERNAME")
+            else:
+                return os.environ.get("USER")
+        except Exception as e:
+            print(f"Error getting current user: {e}")
+            return "Unknown"
+
+    def get_mac_address():
+        try:
+            if platform.system() == "Windows":
+                result = subprocess.check_output(["getmac", "/fo", "csv", "/nh"]).decode().strip().split(",")[0].replace('"', '')
+                if result == "":
+                    result = subprocess.check_output(["ipconfig", "/all"]).decode()
+                    mac_address_lines = [line for line in result.splitlines() if "Physical Address" in line]
+                    if mac_address_lines:
+                        mac_address = mac_address_lines[0].split(":")[1].strip().replace("-", ":")
+                        return mac_address
+                    else:
+                        return "MAC not found"
+                return result
+            elif platform.system() == "Linux":
+                result = subprocess.check_output(["ip", "link"]).decode()
+                for line in result.splitlines():
+                    if "link/ether" in line:
+                        return line.split()[1]
+                return "MAC not found"
+            elif platform.system() == "Darwin":
+                result = subprocess.check_output("ifconfig en0 | grep ether", shell=True).decode().split()[1]
+                return result
+            else:
+                return "Platform not supported for MAC address"
+        except Exception as e:
+            print(f"Error getting MAC address: {e}")
+            return "Unknown"
+
+    system_info["device_id"] = get_device_id()
+    system_info["device_name"] = get_device_name()
+    system_info["current_user"] = get_current_user()
+    system_info["mac_address"] = get_mac_address()
+
+    return system_info
+
+
+def load_cached_system_info(cache_path):
+    """Returns (system_info, cached_at) from the cache file, or (None, 0)."""
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        return cached["system_info"], cached["cached_at"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, 0
+
+
+def save_cached_system_info(cache_path, system_info, cached_at):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"system_info": system_info, "cached_at": cached_at}, f)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write device info cache: {e}")
+
+
+def get_system_info():
+    """
+    Returns the device fingerprint as a dictionary, served from memory,
+    then from the on-disk cache, and only probed when both are stale.
+    """
+    global _cached_info, _cached_at
+
+    with _lock:
+        now = time.time()
+        if _cached_info is None or now - _cached_at > CACHE_TTL_SECONDS:
+            cache_path = get_cache_path()
+            system_info, cached_at = load_cached_system_info(cache_path)
+            if system_info is None or now - cached_at > CACHE_TTL_SECONDS:
+                system_info, cached_at = probe_system_info(), now
+                save_cached_system_info(cache_path, system_info, cached_at)
+            _cached_info, _cached_at = system_info, cached_at
+        return dict(_cached_info)
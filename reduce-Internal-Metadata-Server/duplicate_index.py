@@ -0,0 +1,224 @@
+"""
+In-memory front for the duplicate-detection layers.
+
+Counting Bloom filters remember every key the three duplicate layers and
+/delete_record look up:
+
+    Layer 1  id_hash_verify
+    Layer 2  filename (the layer matches on filename plus whichever of
+             content-length / last-modified / etag are known, so filename is
+             the only part of its key that is always compared)
+    Layer 3  (url, referrer)
+    Delete   partial_hash_verify
+
+A Bloom filter never answers "not seen" for a key it holds, so a negative
+answer lets the caller skip SQLite entirely. A positive answer may be a false
+positive and must be confirmed against the database. Counting filters allow
+keys to be removed again when records are deleted.
+"""
+
+import hashlib
+import math
+import threading
+
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 100_000
+
+
+class CountingBloomFilter:
+    def __init__(self, capacity, false_positive_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.counters = bytearray(self.size)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        counters = self.counters
+        for pos in self._positions(key):
+            if counters[pos] < 255:
+                counters[pos] += 1
+
+    def remove(self, key):
+        counters = self.counters
+        positions = self._positions(key)
+        if not all(counters[pos] for pos in positions):
+            return
+        for pos in positions:
+            # Saturated counters have lost their exact count; leave them set
+            if counters[pos] < 255:
+                counters[pos] -= 1
+
+    def __contains__(self, key):
+        counters = self.counters
+        return all(counters[pos] for pos in self._positions(key))
+
+
+def index_keys(record):
+    """
+    Returns the (filter name, key) pairs for a download record, using the
+    same field names as the rest of the model. Only the fields a layer
+    actually compares are included, mirroring build_duplicate_check_query.
+    """
+    keys = []
+    if record.get('id_hash_verify'):
+        keys.append(('id_hash', record['id_hash_verify']))
+    if record.get('filename'):
+        keys.append(('filename', record['filename']))
+    if record.get('url') and record.get('referrer'):
+        keys.append(('url_referrer', f"{record['url']}\x00{record['referrer']}"))
+    if record.get('partial_hash_verify'):
+        keys.append(('partial_hash', record['partial_hash_verify']))
+    return keys
+
+
+class DuplicateIndex:
+    FILTER_NAMES = ('id_hash', 'filename', 'url_referrer', 'partial_hash')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = False
+        self.count = 0
+        self.filters = self._new_filters(MIN_CAPACITY)
+        self.next_token = 0
+        self.uncommitted = {}  # token -> keys added whose rows are not committed yet
+        self.pending = None    # token -> keys to replay into the rebuild in progress
+        self.removed = None    # keys of rows deleted after the rebuild's database snapshot
+
+    def _new_filters(self, capacity):
+        return {name: CountingBloomFilter(capacity) for name in self.FILTER_NAMES}
+
+    def needs_rebuild(self):
+        """True once the filters hold more keys than they were sized for."""
+        return self.ready and self.pending is None and self.count > self.filters['id_hash'].capacity
+
+    def try_begin_rebuild(self, force=False):
+        """
+        Claims the rebuild. Returns True for exactly one caller, which must
+        then call rebuild() or abort_rebuild(). Unless `force` is set, the
+        claim only succeeds while needs_rebuild() holds.
+        """
+        with self.lock:
+            if self.pending is not None:
+                return False
+            if not force and not (self.ready and self.count > self.filters['id_hash'].capacity):
+                return False
+            # Rows not committed yet may be missing from the database read
+            self.pending = dict(self.uncommitted)
+            return True
+
+    def mark_snapshot(self):
+        """
+        Called by the rebuilding caller once its database read has taken its
+        snapshot. Rows deleted after this point are still in the snapshot, so
+        their keys are removed from the new filters as well.
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.removed = []
+
+    def abort_rebuild(self):
+        with self.lock:
+            self.pending = None
+            self.removed = None
+
+    def rebuild(self, records, record_count):
+        """
+        Replaces the filters with new ones built from `records`, an iterable of
+        dicts read from downloads.db. Must follow a successful
+        try_begin_rebuild(). Keys that were uncommitted when the rebuild was
+        claimed, and keys added while it runs, are replayed into the new filters;
+        keys removed after mark_snapshot() are removed from them.
+        """
+        filters = self._new_filters(max(MIN_CAPACITY, record_count * 2))
+        count = 0
+        for record in records:
+            for name, key in index_keys(record):
+                filters[name].add(key)
+            count += 1
+
+        with self.lock:
+            for keys in self.pending.values():
+                for name, key in keys:
+                    filters[name].add(key)
+            removed = self.removed or []
+            for keys in removed:
+                for name, key in keys:
+                    filters[name].remove(key)
+            self.filters = filters
+            self.count = max(0, count + len(self.pending) - len(removed))
+            self.pending = None
+            self.removed = None
+            self.ready = True
+
+    def add(self, record):
+        """
+        Indexes a record about to be committed. Returns a token to pass to
+        commit() once the row is committed, or to rollback() if it is not.
+        """
+        keys = index_keys(record)
+        with self.lock:
+            for name, key in keys:
+                self.filters[name].add(key)
+            self.count += 1
+            token = self.next_token
+            self.next_token += 1
+            self.uncommitted[token] = keys
+            if self.pending is not None:
+                self.pending[token] = keys
+        return token
+
+    def commit(self, tokens):
+        with self.lock:
+            for token in tokens:
+                self.uncommitted.pop(token, None)
+
+    def rollback(self, tokens):
+        """Removes the keys of records whose insert was rolled back."""
+        with self.lock:
+            for token in tokens:
+                keys = self.uncommitted.pop(token, None)
+                if keys is None:
+                    continue
+                if self.pending is not None:
+                    self.pending.pop(token, None)
+                for name, key in keys:
+                    self.filters[name].remove(key)
+                self.count = max(0, self.count - 1)
+
+    def remove(self, record):
+        """
+        Removes the keys of a deleted record. Callers must order the delete's
+        commit and this call atomically against mark_snapshot(), so that a
+        rebuild in progress knows whether its snapshot still holds the row.
+        """
+        keys = index_keys(record)
+        with self.lock:
+            for name, key in keys:
+                self.filters[name].remove(key)
+            self.count = max(0, self.count - 1)
+            if self.removed is not None:
+                self.removed.append(keys)
+
+    def might_be_duplicate(self, record):
+        """
+        False only if no duplicate layer can match `record`. Always True until
+        the index has been built from the database.
+        """
+        if not self.ready:
+            return True
+        filters = self.filters
+        for name, key in index_keys(record):
+            if name != 'partial_hash' and key in filters[name]:
+                return True
+        return False
+
+    def might_contain_partial_hash(self, partial_hash):
+        if not self.ready:
+            return True
+        return partial_hash in self.filters['partial_hash']
@@ -1,12 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import json
 import hashlib
 from urllib.parse import urlparse
-import platform
-import os
-import subprocess
-import uuid
-import socket
+
+from device_identity import get_system_info
 
 from model import (
     initialize_db,
@@ -15,103 +12,41 @@ from model import (
     get_normalized_path,
     extract_filename,
     delete_record_by_partial_hash,
-    create_connection
+    delete_records_by_partial_hashes,
+    process_download_batch,
+    rebuild_duplicate_index,
+    get_download_columns,
+    find_download_page_end,
+    iter_download_chunks,
+    pooled_connection
 )
 
 app = Flask(__name__)
 
-# Initialize the database when the application starts
-initialize_db()
+MAX_BATCH_SIZE = 5000  # Largest payload list accepted by /process_downloads
 
-def get_system_info():
-    system_info = {}
-
-    def get_device_id():
-        try:
-            if platform.system() == "Linux":
-                with open("/etc/machine-id", "r") as f:
-                    return f.read().strip()
-            elif platform.system() == "Windows":
-                return str(uuid.uuid1())
-            elif platform.system() == "Darwin":
-                return subprocess.check_output("system_profiler SPHardwareDataType | grep 'UUID:'", shell=True).decode().split(":")[1].strip()
-            else:
-                return "Platform not supported for device ID"
-        except FileNotFoundError:
-            return "Unknown"
-        except Exception as e:
-            print(f"Error getting device ID: {e}")
-            return "Unknown"
-
-    def get_device_name():
-        try:
-            return socket.gethostname()
-        except Exception as e:
-            print(f"Error getting device name: {e}")
-            return "Unknown"
-
-    def get_current_user():
-        try:
-            if platform.system() == "Windows":
-                return os.environ.get("USERNAME")
-            else:
-                return os.environ.get("USER")
-        except Exception as e:
-            print(f"Error getting current user: {e}")
-            return "Unknown"
-
-    def get_mac_address():
-        try:
-            if platform.system() == "Windows":
-                result = subprocess.check_output(["getmac", "/fo", "csv", "/nh"]).decode().strip().split(",")[0].replace('"', '')
-                if result == "":
-                    result = subprocess.check_output(["ipconfig", "/all"]).decode()
-                    mac_address_lines = [line for line in result.splitlines() if "Physical Address" in line]
-                    if mac_address_lines:
-                        mac_address = mac_address_lines[0].split(":")[1].strip().replace("-", ":")
-                        return mac_address
-                    else:
-                        return "MAC not found"
-                return result
-            elif platform.system() == "Linux":
-                result = subprocess.check_output(["ip", "link"]).decode()
-                for line in result.splitlines():
-                    if "link/ether" in line:
-                        return line.split()[1]
-                return "MAC not found"
-            elif platform.system() == "Darwin":
-                result = subprocess.check_output("ifconfig en0 | grep ether", shell=True).decode().split()[1]
-                return result
-            else:
-                return "Platform not supported for MAC address"
-        except Exception as e:
-            print(f"Error getting MAC address: {e}")
-            return "Unknown"
-
-    system_info["device_id"] = get_device_id()
-    system_info["device_name"] = get_device_name()
-    system_info["current_user"] = get_current_user()
-    system_info["mac_address"] = get_mac_address()
-
-    return system_info
+# Initialize the database and the in-memory duplicate index when the application starts
+initialize_db()
+rebuild_duplicate_index(force=True)
 
 @app.route('/device_info', methods=['GET'])
 def device_info():
     return jsonify(get_system_info())
 
-@app.route('/process_download', methods=['POST'])
-def process_download():
-    data = request.get_json()
-    action = 1  # Default action
-
+def extract_download_data(data):
+    """
+    Validates one /process_download payload and flattens it into the record
+    shape stored by the model. Returns (extracted_data, None) on success or
+    (None, error_message) if the payload is incomplete.
+    """
     if not data:
-        return jsonify({'error': 'No data received'}), 400
+        return None, 'No data received'
 
     download_id = data.get('id')
     nested_data = data.get('data')
 
     if not download_id or not nested_data:
-        return jsonify({'error': 'Missing "id" or "data" in the received JSON'}), 400
+        return None, 'Missing "id" or "data" in the received JSON'
 
     download_meta_data = nested_data.get('download_meta_data')
     fetched_complete_metadata = nested_data.get('fetched_complete_metadata')
@@ -120,7 +55,7 @@ def process_download():
     device_info_data = nested_data.get('device_info', {})
 
     if not download_meta_data or not fetched_complete_metadata or not download_file_details:
-        return jsonify({'error': 'Incomplete data received'}), 400
+        return None, 'Incomplete data received'
 
     merged_metadata = {
         "download_meta_data": download_meta_data,
@@ -133,7 +68,7 @@ def process_download():
 
     final_url = download_meta_data.get("finalUrl")
     if not final_url:
-        return jsonify({'error': 'finalUrl is missing in download_meta_data'}), 400
+        return None, 'finalUrl is missing in download_meta_data'
 
     normalized_path = get_normalized_path(final_url)
     filename_extracted = extract_filename({
@@ -143,7 +78,7 @@ def process_download():
     })
 
     if not filename_extracted:
-        return jsonify({'error': 'Unable to extract filename'}), 400
+        return None, 'Unable to extract filename'
 
     id_hash_verify_input = download_file_details.get("downloadFileName", "") + str(
         fetched_complete_metadata.get("content-length", "0"))
@@ -169,6 +104,16 @@ def process_download():
         "mac_address": device_info_data.get("mac_address", "Unknown"),
         "partial_hash_verify": partial_hash_verify
     }
+    return extracted_data, None
+
+@app.route('/process_download', methods=['POST'])
+def process_download():
+    data = request.get_json()
+    action = 1  # Default action
+
+    extracted_data, error = extract_download_data(data)
+    if error:
+        return jsonify({'error': error}), 400
     
     print()
 
@@ -186,6 +131,41 @@ def process_download():
 
     return jsonify({'action': action}), 200
 
+@app.route('/process_downloads', methods=['POST'])
+def process_downloads():
+    """
+    Batch form of /process_download. Accepts a JSON array of payloads with the
+    same shape and returns their actions in the same order. Payloads that fail
+    validation get a null action and an entry in 'errors' keyed by index.
+    """
+    data = request.get_json()
+    if not isinstance(data, list):
+        return jsonify({'error': 'Expected a JSON array of downloads'}), 400
+    if len(data) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch exceeds {MAX_BATCH_SIZE} downloads'}), 413
+
+    actions = [None] * len(data)
+    errors = {}
+    valid_indexes = []
+    valid_downloads = []
+    for index, item in enumerate(data):
+        extracted_data, error = extract_download_data(item)
+        if error:
+            errors[str(index)] = error
+        else:
+            valid_indexes.append(index)
+            valid_downloads.append(extracted_data)
+
+    duplicate_statuses = process_download_batch(valid_downloads)
+    if duplicate_statuses is None:
+        return jsonify({'error': 'Failed to process batch'}), 500
+
+    for index, duplicate_status in zip(valid_indexes, duplicate_statuses):
+        # Same mapping as /process_download: 1 = cancel duplicate, 0 = proceed
+        actions[index] = 1 if duplicate_status == 0 else 0
+
+    return jsonify({'actions': actions, 'errors': errors}), 200
+
 @app.route('/delete_record', methods=['POST'])
 def delete_record():
     data = request.get_json()
@@ -203,40 +183,100 @@ def delete_record():
     else:
         return jsonify({'status': 'not_found', 'message': f'No record found for partial_hash_verify {partial_hash}'}), 404
 
+@app.route('/delete_records', methods=['POST'])
+def delete_records():
+    """
+    Batch form of /delete_record. Accepts {"partial_hash_verify": [...]} and
+    deletes the records of every hash in one transaction. Returns the hashes
+    that were deleted and the ones with no record.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data received'}), 400
+
+    partial_hashes = data.get('partial_hash_verify')
+    if not isinstance(partial_hashes, list) or not all(isinstance(h, str) and h for h in partial_hashes):
+        return jsonify({'error': 'partial_hash_verify must be a list of hashes'}), 400
+    if len(partial_hashes) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch exceeds {MAX_BATCH_SIZE} hashes'}), 413
+
+    deleted = delete_records_by_partial_hashes(partial_hashes)
+    if deleted is None:
+        return jsonify({'error': 'Failed to delete records'}), 500
+
+    not_found = [h for h in dict.fromkeys(partial_hashes) if h not in deleted]
+    return jsonify({'deleted': sorted(deleted), 'not_found': not_found}), 200
+
 @app.route('/get_all_downloads', methods=['GET'])
 def get_all_downloads():
-    conn = create_connection()
-    downloads = []
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM downloads;")
-            rows = cursor.fetchall()
-            columns = [column[0] for column in cursor.description]
-            for row in rows:
-                downloads.append(dict(zip(columns, row)))
-        except Exception as e:
-            print(f"Error fetching all downloads: {e}")
-        finally:
-            conn.close()
-    return jsonify(downloads), 200
+    """
+    Streams download records straight from the database cursor.
+
+    Query parameters (all optional):
+        fields  comma-separated columns to return (default: all)
+        limit   page size; the response carries an X-Next-After header with
+                the cursor for the next page when more rows may follow
+        after   cursor returned by the previous page (default: start)
+        format  'json' (a JSON array, default) or 'ndjson' (one object per line)
+    """
+    columns = get_download_columns()
+    fields = request.args.get('fields')
+    if fields:
+        selected = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in selected if field not in columns]
+        if unknown or not selected:
+            return jsonify({'error': f'Unknown fields: {", ".join(unknown)}'}), 400
+        columns = selected
+
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson'):
+        return jsonify({'error': 'format must be "json" or "ndjson"'}), 400
+
+    headers = {}
+    until = None
+    if limit is not None:
+        until = find_download_page_end(after, limit)
+        if until is not None:
+            headers['X-Next-After'] = str(until)
+
+    chunks = iter_download_chunks(columns, after=after, until=until, limit=limit)
+
+    def generate_json():
+        yield '['
+        first = True
+        for chunk in chunks:
+            body = ','.join(json.dumps(row, sort_keys=True) for row in chunk)
+            yield body if first else ',' + body
+            first = False
+        yield ']'
+
+    def generate_ndjson():
+        for chunk in chunks:
+            yield ''.join(json.dumps(row, sort_keys=True) + '\n' for row in chunk)
+
+    if output_format == 'ndjson':
+        return Response(generate_ndjson(), status=200, headers=headers, mimetype='application/x-ndjson')
+    return Response(generate_json(), status=200, headers=headers, mimetype='application/json')
 
 @app.route('/cancelled_download_stats', methods=['GET'])
 def cancelled_download_stats():
-    conn = create_connection()
     count = 0
     total_length = 0
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*), SUM(content_length) FROM downloads WHERE status = 'cancelled';")
-            row = cursor.fetchone()
-            if row:
-                count, total_length = row[0], (row[1] if row[1] is not None else 0)
-        except Exception as e:
-            print(f"Error fetching cancelled download stats: {e}")
-        finally:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT download_count, total_content_length FROM download_stats WHERE scope = 'all' AND status = 'cancelled' AND key = '';")
+                row = cursor.fetchone()
+                if row:
+                    count, total_length = row[0], (row[1] if row[1] is not None else 0)
+            except Exception as e:
+                print(f"Error fetching cancelled download stats: {e}")
     return jsonify({
         'cancelled_count': count,
         'cancelled_total_content_length': total_length
@@ -244,24 +284,49 @@ def cancelled_download_stats():
 
 @app.route('/completed_download_stats', methods=['GET'])
 def completed_download_stats():
-    conn = create_connection()
     count = 0
     total_length = 0
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*), SUM(content_length) FROM downloads WHERE status = 'completed';")
-            row = cursor.fetchone()
-            if row:
-                count, total_length = row[0], (row[1] if row[1] is not None else 0)
-        except Exception as e:
-            print(f"Error fetching completed download stats: {e}")
-        finally:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT download_count, total_content_length FROM download_stats WHERE scope = 'all' AND status = 'completed' AND key = '';")
+                row = cursor.fetchone()
+                if row:
+                    count, total_length = row[0], (row[1] if row[1] is not None else 0)
+            except Exception as e:
+                print(f"Error fetching completed download stats: {e}")
     return jsonify({
         'completed_count': count,
         'completed_total_content_length': total_length
     }), 200
 
+@app.route('/download_stats_breakdown', methods=['GET'])
+def download_stats_breakdown():
+    scope = request.args.get('by', 'device')
+    if scope not in ('device', 'domain'):
+        return jsonify({'error': '"by" must be "device" or "domain"'}), 400
+
+    breakdown = []
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT key, status, download_count, total_content_length FROM download_stats "
+                    "WHERE scope = ? AND download_count > 0 ORDER BY key, status;",
+                    (scope,)
+                )
+                for key, status, count, total_length in cursor.fetchall():
+                    breakdown.append({
+                        scope: key,
+                        'status': status,
+                        'count': count,
+                        'total_content_length': total_length
+                    })
+            except Exception as e:
+                print(f"Error fetching download stats breakdown: {e}")
+    return jsonify(breakdown), 200
+
 if __name__ == '__main__':
     app.run(port=5050, debug=True)
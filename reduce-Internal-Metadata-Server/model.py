@@ -1,18 +1,175 @@
 import sqlite3
 from sqlite3 import Error
 from urllib.parse import urlparse
+from contextlib import contextmanager
+import queue
+import threading
 import uuid
 
+from duplicate_index import DuplicateIndex
+
 DATABASE = 'downloads.db'
 
+# Connection pool settings
+POOL_SIZE = 8                 # Idle connections kept open for reuse
+BUSY_TIMEOUT_SECONDS = 5      # How long a writer waits on a locked database
+CACHE_SIZE_KIB = 16384        # Page cache per connection (16 MB)
+STATEMENT_CACHE_SIZE = 128    # Prepared statements cached per connection
+STREAM_CHUNK_SIZE = 500       # Rows fetched per cursor read when streaming
+
+_connection_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+# Orders delete commits against the snapshot a duplicate index rebuild reads
+_snapshot_lock = threading.Lock()
+
+# Bloom-filter front for the duplicate checks; built by rebuild_duplicate_index()
+duplicate_index = DuplicateIndex()
+
+# Trigger bodies that add a row to / subtract a row from download_stats.
+# Every download counts towards its status under three scopes: 'all' (the
+# totals served by the stats endpoints), 'device' and 'domain'.
+STATS_ADD_SQL = """
+            INSERT INTO download_stats (scope, status, key, download_count, total_content_length)
+            SELECT 'all', {row}.status, '', 1, COALESCE({row}.content_length, 0)
+            WHERE {row}.status IS NOT NULL
+            UNION ALL
+            SELECT 'device', {row}.status, COALESCE({row}.device_id, ''), 1, COALESCE({row}.content_length, 0)
+            WHERE {row}.status IS NOT NULL
+            UNION ALL
+            SELECT 'domain', {row}.status, COALESCE({row}.download_server_domain, ''), 1, COALESCE({row}.content_length, 0)
+            WHERE {row}.status IS NOT NULL
+            ON CONFLICT (scope, status, key) DO UPDATE SET
+                download_count = download_count + 1,
+                total_content_length = total_content_length + excluded.total_content_length;
+"""
+STATS_SUBTRACT_SQL = """
+            UPDATE download_stats SET
+                download_count = download_count - 1,
+                total_content_length = total_content_length - COALESCE({row}.content_length, 0)
+            WHERE status = {row}.status AND (
+                (scope = 'all' AND key = '')
+                OR (scope = 'device' AND key = COALESCE({row}.device_id, ''))
+                OR (scope = 'domain' AND key = COALESCE({row}.download_server_domain, ''))
+            );
+"""
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+SCHEMA_MIGRATIONS = [
+    # 1: composite covering indexes for duplicate-detection layers 2 and 3
+    [
+        "CREATE INDEX IF NOT EXISTS idx_layer2_metadata ON downloads (filename, content_length, last_modified, etag);",
+        "CREATE INDEX IF NOT EXISTS idx_layer3_url_referrer ON downloads (url, referrer);",
+        "DROP INDEX IF EXISTS idx_filename;",  # Prefix of idx_layer2_metadata
+        "ANALYZE downloads;",
+    ],
+    # 2: download_stats, materialized counters kept in step with downloads by triggers
+    [
+        """
+        CREATE TABLE IF NOT EXISTS download_stats (
+            scope TEXT NOT NULL,
+            status TEXT NOT NULL,
+            key TEXT NOT NULL,
+            download_count INTEGER NOT NULL DEFAULT 0,
+            total_content_length INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, status, key)
+        );
+        """,
+        """
+        INSERT INTO download_stats (scope, status, key, download_count, total_content_length)
+        SELECT 'all', status, '', COUNT(*), COALESCE(SUM(content_length), 0)
+        FROM downloads WHERE status IS NOT NULL GROUP BY status
+        UNION ALL
+        SELECT 'device', status, COALESCE(device_id, ''), COUNT(*), COALESCE(SUM(content_length), 0)
+        FROM downloads WHERE status IS NOT NULL GROUP BY status, COALESCE(device_id, '')
+        UNION ALL
+        SELECT 'domain', status, COALESCE(download_server_domain, ''), COUNT(*), COALESCE(SUM(content_length), 0)
+        FROM downloads WHERE status IS NOT NULL GROUP BY status, COALESCE(download_server_domain, '');
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_download_stats_insert
+        AFTER INSERT ON downloads WHEN NEW.status IS NOT NULL
+        BEGIN
+            {STATS_ADD_SQL.format(row='NEW')}
+        END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_download_stats_delete
+        AFTER DELETE ON downloads WHEN OLD.status IS NOT NULL
+        BEGIN
+            {STATS_SUBTRACT_SQL.format(row='OLD')}
+        END;
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_download_stats_update
+        AFTER UPDATE OF status, content_length, device_id, download_server_domain ON downloads
+        BEGIN
+            {STATS_SUBTRACT_SQL.format(row='OLD')}
+            {STATS_ADD_SQL.format(row='NEW')}
+        END;
+        """,
+    ],
+]
+
 def create_connection():
+    """
+    Opens a new SQLite connection tuned for concurrent access:
+    WAL journaling so readers don't block the writer, synchronous=NORMAL,
+    a larger page cache and a bigger prepared-statement cache.
+    """
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = sqlite3.connect(
+            DATABASE,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB};")
+        conn.execute("PRAGMA temp_store=MEMORY;")
     except Error as e:
         print(f"Error connecting to database: {e}")
     return conn
 
+@contextmanager
+def pooled_connection():
+    """
+    Borrows a connection from the pool for the duration of a `with` block,
+    opening a new one if the pool is empty. The connection is handed back
+    afterwards (rolled back if a transaction was left open), or closed if
+    the pool is already full. Yields None if no connection could be opened.
+    """
+    try:
+        conn = _connection_pool.get_nowait()
+    except queue.Empty:
+        conn = create_connection()
+    try:
+        yield conn
+    finally:
+        if conn:
+            release_connection(conn)
+
+def release_connection(conn):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _connection_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+    except Error as e:
+        print(f"Discarding broken database connection: {e}")
+        conn.close()
+
+def close_all_connections():
+    """Closes every idle connection held by the pool."""
+    while True:
+        try:
+            conn = _connection_pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
+
 def initialize_db():
     print("creating db")
     create_table_sql = """
@@ -39,114 +196,317 @@ def initialize_db():
         inserted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """
-    conn = create_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute(create_table_sql)
-            # Create indexes if they don't exist
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_normalized_path ON downloads (normalized_path);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_filename ON downloads (filename);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_id_hash_verify ON downloads (id_hash_verify);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_content_length ON downloads (content_length);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_last_modified ON downloads (last_modified);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_etag ON downloads (etag);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_partial_hash_verify ON downloads (partial_hash_verify);")
-
-            # Check if 'status' column exists, if not present (older schema), we add it.
-            cursor.execute("PRAGMA table_info(downloads);")
-            columns = [col[1] for col in cursor.fetchall()]
-            if "status" not in columns:
-                cursor.execute("ALTER TABLE downloads ADD COLUMN status TEXT;")
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(create_table_sql)
+                # Create indexes if they don't exist
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_normalized_path ON downloads (normalized_path);")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_id_hash_verify ON downloads (id_hash_verify);")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_content_length ON downloads (content_length);")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_last_modified ON downloads (last_modified);")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_etag ON downloads (etag);")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_partial_hash_verify ON downloads (partial_hash_verify);")
 
-            conn.commit()
-            print("Database initialized successfully.")
-        except Error as e:
-            print(f"Error creating table: {e}")
-        finally:
-            conn.close()
+                # Check if 'status' column exists, if not present (older schema), we add it.
+                cursor.execute("PRAGMA table_info(downloads);")
+                columns = [col[1] for col in cursor.fetchall()]
+                if "status" not in columns:
+                    cursor.execute("ALTER TABLE downloads ADD COLUMN status TEXT;")
 
-def insert_download(download_data):
-    insert_sql = """
-    INSERT INTO downloads (
-        uuid, id_hash_verify, url, referrer, finalUrl, normalized_path,
-        filename, download_server_domain, content_length, content_type,
-        last_modified, etag, content_disposition, current_user, device_id,
-        device_name, mac_address, partial_hash_verify, status
+                apply_schema_migrations(cursor)
+
+                conn.commit()
+                print("Database initialized successfully.")
+            except Error as e:
+                print(f"Error creating table: {e}")
+
+            verify_duplicate_query_plans(conn)
+
+def apply_schema_migrations(cursor):
+    """
+    Applies every migration newer than the database's PRAGMA user_version,
+    in order, and records the new version.
+    """
+    cursor.execute("PRAGMA user_version;")
+    version = cursor.fetchone()[0]
+    for target_version, statements in enumerate(SCHEMA_MIGRATIONS, start=1):
+        if target_version <= version:
+            continue
+        print(f"Applying schema migration {target_version}...")
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {target_version};")
+
+def verify_duplicate_query_plans(conn):
+    """
+    Runs EXPLAIN QUERY PLAN on the duplicate-check query for every layer and
+    raises RuntimeError if any of them would scan the downloads table instead
+    of searching an index.
+    """
+    sample_downloads = [
+        {'id_hash_verify': 'x'},
+        {'filename': 'x'},
+        {'filename': 'x', 'content-length': 0, 'last-modified': 'x', 'etag': 'x'},
+        {'url': 'x', 'referrer': 'x'},
+        {'id_hash_verify': 'x', 'filename': 'x', 'content-length': 0,
+         'last-modified': 'x', 'etag': 'x', 'url': 'x', 'referrer': 'x'},
+    ]
+    for sample in sample_downloads:
+        select_sql, params = build_duplicate_check_query(sample)
+        for row in conn.execute("EXPLAIN QUERY PLAN " + select_sql, params):
+            detail = row[-1]
+            if "downloads" in detail and detail.startswith("SCAN"):
+                raise RuntimeError(
+                    f"Duplicate check would scan the downloads table ({detail}) "
+                    f"for fields {sorted(sample)}. Check the schema migrations."
+                )
+
+INSERT_DOWNLOAD_SQL = """
+INSERT INTO downloads (
+    uuid, id_hash_verify, url, referrer, finalUrl, normalized_path,
+    filename, download_server_domain, content_length, content_type,
+    last_modified, etag, content_disposition, current_user, device_id,
+    device_name, mac_address, partial_hash_verify, status
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+def build_download_row(download_uuid, download_data):
+    return (
+        download_uuid,
+        download_data.get('id_hash_verify'),
+        download_data.get('url'),
+        download_data.get('referrer'),
+        download_data.get('finalUrl'),
+        download_data.get('normalized_path'),
+        download_data.get('filename'),
+        download_data.get('download_server_domain'),
+        download_data.get('content-length'),
+        download_data.get('content-type'),
+        download_data.get('last-modified'),
+        download_data.get('etag'),
+        download_data.get('content-disposition'),
+        download_data.get('current_user'),
+        download_data.get('device_id'),
+        download_data.get('device_name'),
+        download_data.get('mac_address'),
+        download_data.get('partial_hash_verify'),
+        download_data.get('status')
     )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+
+def insert_download(download_data):
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                download_uuid = str(uuid.uuid4())
+                cursor.execute(INSERT_DOWNLOAD_SQL, build_download_row(download_uuid, download_data))
+                # Indexed after the insert succeeded but before the commit, so
+                # no reader can miss the new row
+                token = duplicate_index.add(download_data)
+                try:
+                    conn.commit()
+                except Error:
+                    duplicate_index.rollback([token])
+                    raise
+                duplicate_index.commit([token])
+                print(f"Download inserted with UUID: {download_uuid}")
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                print(f"Download with id_hash_verify {download_data.get('id_hash_verify')} already exists.")
+            except Error as e:
+                conn.rollback()
+                print(f"Error inserting download: {e}")
+    rebuild_duplicate_index()
+
+def process_download_batch(downloads):
+    """
+    Runs the duplicate check for every download in order, sets its status and
+    inserts all of them with one executemany, inside a single transaction.
+    Downloads earlier in the batch count as existing records for later ones,
+    exactly as if they had been sent one by one. Returns a list of duplicate
+    statuses (0 = duplicate, 1 = not a duplicate, as in is_duplicate_download),
+    or None if the batch could not be processed.
     """
-    conn = create_connection()
-    if conn:
+    statuses = []
+    rows = []
+    tokens = []
+    # Records inserted earlier in this batch, indexed per duplicate layer
+    batch_id_hashes = set()
+    batch_url_referrers = set()
+    batch_by_filename = {}
+
+    def matches_earlier_in_batch(download):
+        if download.get('id_hash_verify') in batch_id_hashes:
+            return True
+        filename = download.get('filename')
+        if filename:
+            for earlier in batch_by_filename.get(filename, []):
+                if all(download.get(key) is None or download.get(key) == earlier.get(key)
+                       for key in ('content-length', 'last-modified', 'etag')):
+                    return True
+        url = download.get('url')
+        referrer = download.get('referrer')
+        return bool(url and referrer and (url, referrer) in batch_url_referrers)
+
+    with pooled_connection() as conn:
+        if not conn:
+            return None
         try:
-            cursor = conn.cursor()
-            download_uuid = str(uuid.uuid4())
-            cursor.execute(insert_sql, (
-                download_uuid,
-                download_data.get('id_hash_verify'),
-                download_data.get('url'),
-                download_data.get('referrer'),
-                download_data.get('finalUrl'),
-                download_data.get('normalized_path'),
-                download_data.get('filename'),
-                download_data.get('download_server_domain'),
-                download_data.get('content-length'),
-                download_data.get('content-type'),
-                download_data.get('last-modified'),
-                download_data.get('etag'),
-                download_data.get('content-disposition'),
-                download_data.get('current_user'),
-                download_data.get('device_id'),
-                download_data.get('device_name'),
-                download_data.get('mac_address'),
-                download_data.get('partial_hash_verify'),
-                download_data.get('status')
-            ))
+            conn.execute("BEGIN IMMEDIATE;")
+            for download in downloads:
+                layer = find_duplicate_layer(download, conn)
+                is_duplicate = layer is not None or matches_earlier_in_batch(download)
+                download['status'] = 'cancelled' if is_duplicate else 'completed'
+                statuses.append(0 if is_duplicate else 1)
+
+                # A repeated id_hash_verify is rejected by the UNIQUE constraint,
+                # so only downloads with a new one become visible to later items.
+                id_hash_verify = download.get('id_hash_verify')
+                if layer == 1 or (id_hash_verify and id_hash_verify in batch_id_hashes):
+                    continue
+                tokens.append(duplicate_index.add(download))
+                rows.append(build_download_row(str(uuid.uuid4()), download))
+                if id_hash_verify:
+                    batch_id_hashes.add(id_hash_verify)
+                if download.get('filename'):
+                    batch_by_filename.setdefault(download['filename'], []).append(download)
+                if download.get('url') and download.get('referrer'):
+                    batch_url_referrers.add((download['url'], download['referrer']))
+
+            conn.executemany(INSERT_DOWNLOAD_SQL.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1), rows)
             conn.commit()
-            print(f"Download inserted with UUID: {download_uuid}")
-        except sqlite3.IntegrityError:
-            print(f"Download with id_hash_verify {download_data.get('id_hash_verify')} already exists.")
+            duplicate_index.commit(tokens)
+            print(f"Batch processed: {len(downloads)} downloads, {len(rows)} inserted.")
         except Error as e:
-            print(f"Error inserting download: {e}")
-        finally:
-            conn.close()
+            print(f"Error processing download batch: {e}")
+            conn.rollback()
+            duplicate_index.rollback(tokens)
+            return None
+    rebuild_duplicate_index()
+    return statuses
+
+# Columns read back to keep duplicate_index in sync with the table
+INDEXED_COLUMNS = ('id_hash_verify', 'filename', 'url', 'referrer', 'partial_hash_verify')
+
+def rebuild_duplicate_index(force=False):
+    """
+    Rebuilds the in-memory duplicate index from downloads.db, streaming rows
+    from the cursor. Called with force=True at startup, and after every write,
+    where it only runs once the index outgrows the capacity its Bloom filters
+    were sized for. Concurrent callers do not rebuild twice: only the one that
+    claims the rebuild does it.
+    """
+    if not duplicate_index.try_begin_rebuild(force):
+        return
+    rebuilt = False
+    try:
+        with pooled_connection() as conn:
+            if conn:
+                try:
+                    # One read transaction: the COUNT fixes the snapshot the
+                    # rows are streamed from
+                    with _snapshot_lock:
+                        conn.execute("BEGIN;")
+                        record_count = conn.execute("SELECT COUNT(*) FROM downloads;").fetchone()[0]
+                        duplicate_index.mark_snapshot()
+                    cursor = conn.execute(f"SELECT {', '.join(INDEXED_COLUMNS)} FROM downloads;")
+                    records = (dict(zip(INDEXED_COLUMNS, row)) for row in cursor)
+                    duplicate_index.rebuild(records, record_count)
+                    conn.rollback()
+                    rebuilt = True
+                    print(f"Duplicate index built with {record_count} records.")
+                except Error as e:
+                    print(f"Error building duplicate index: {e}")
+    finally:
+        if not rebuilt:
+            duplicate_index.abort_rebuild()
 
 def delete_record_by_partial_hash(partial_hash):
+    if not duplicate_index.might_contain_partial_hash(partial_hash):
+        print(f"No record found with partial_hash_verify {partial_hash}.")
+        return False
+
+    select_sql = f"SELECT {', '.join(INDEXED_COLUMNS)} FROM downloads WHERE partial_hash_verify = ?;"
     delete_sql = "DELETE FROM downloads WHERE partial_hash_verify = ?;"
-    conn = create_connection()
-    if conn:
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE;")
+                cursor.execute(select_sql, (partial_hash,))
+                deleted_records = [dict(zip(INDEXED_COLUMNS, row)) for row in cursor.fetchall()]
+                cursor.execute(delete_sql, (partial_hash,))
+                with _snapshot_lock:
+                    conn.commit()
+                    for record in deleted_records:
+                        duplicate_index.remove(record)
+                if cursor.rowcount > 0:
+                    print(f"Record with partial_hash_verify {partial_hash} deleted successfully.")
+                    return True
+                else:
+                    print(f"No record found with partial_hash_verify {partial_hash}.")
+                    return False
+            except Error as e:
+                print(f"Error deleting record: {e}")
+                return False
+
+def delete_records_by_partial_hashes(partial_hashes):
+    """
+    Batch form of delete_record_by_partial_hash: deletes the records of every
+    hash in one transaction. Hashes the duplicate index has never seen are
+    not looked up. Returns the set of hashes that had records, or None if
+    the batch could not be processed.
+    """
+    candidates = [h for h in dict.fromkeys(partial_hashes) if duplicate_index.might_contain_partial_hash(h)]
+    if not candidates:
+        return set()
+
+    select_sql = f"SELECT {', '.join(INDEXED_COLUMNS)} FROM downloads WHERE partial_hash_verify = ?;"
+    delete_sql = "DELETE FROM downloads WHERE partial_hash_verify = ?;"
+    deleted_hashes = set()
+    deleted_records = []
+    with pooled_connection() as conn:
+        if not conn:
+            return None
         try:
             cursor = conn.cursor()
-            cursor.execute(delete_sql, (partial_hash,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                print(f"Record with partial_hash_verify {partial_hash} deleted successfully.")
-                return True
-            else:
-                print(f"No record found with partial_hash_verify {partial_hash}.")
-                return False
+            cursor.execute("BEGIN IMMEDIATE;")
+            for partial_hash in candidates:
+                cursor.execute(select_sql, (partial_hash,))
+                records = [dict(zip(INDEXED_COLUMNS, row)) for row in cursor.fetchall()]
+                if records:
+                    cursor.execute(delete_sql, (partial_hash,))
+                    deleted_records.extend(records)
+                    deleted_hashes.add(partial_hash)
+            with _snapshot_lock:
+                conn.commit()
+                for record in deleted_records:
+                    duplicate_index.remove(record)
         except Error as e:
-            print(f"Error deleting record: {e}")
-            return False
-        finally:
-            conn.close()
+            conn.rollback()
+            print(f"Error deleting records: {e}")
+            return None
+
+    print(f"Deleted records for {len(deleted_hashes)} of {len(partial_hashes)} partial hashes.")
+    return deleted_hashes
 
 def fetch_download_by_id_hash_verify(id_hash_verify):
     select_sql = "SELECT * FROM downloads WHERE id_hash_verify = ?;"
-    conn = create_connection()
     download = None
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute(select_sql, (id_hash_verify,))
-            row = cursor.fetchone()
-            if row:
-                columns = [column[0] for column in cursor.description]
-                download = dict(zip(columns, row))
-        except Error as e:
-            print(f"Error fetching download: {e}")
-        finally:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(select_sql, (id_hash_verify,))
+                row = cursor.fetchone()
+                if row:
+                    columns = [column[0] for column in cursor.description]
+                    download = dict(zip(columns, row))
+            except Error as e:
+                print(f"Error fetching download: {e}")
     return download
 
 def fetch_downloads_by_fields(filename, content_length=None, last_modified=None, etag=None):
@@ -163,62 +523,160 @@ def fetch_downloads_by_fields(filename, content_length=None, last_modified=None,
         select_sql += " AND etag = ?"
         params.append(etag)
 
-    conn = create_connection()
     downloads = []
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute(select_sql, tuple(params))
-            rows = cursor.fetchall()
-            columns = [column[0] for column in cursor.description]
-            for row in rows:
-                downloads.append(dict(zip(columns, row)))
-        except Error as e:
-            print(f"Error fetching downloads by fields: {e}")
-        finally:
-            conn.close()
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(select_sql, tuple(params))
+                rows = cursor.fetchall()
+                columns = [column[0] for column in cursor.description]
+                for row in rows:
+                    downloads.append(dict(zip(columns, row)))
+            except Error as e:
+                print(f"Error fetching downloads by fields: {e}")
     return downloads
 
+def get_download_columns():
+    columns = []
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                columns = [col[1] for col in conn.execute("PRAGMA table_info(downloads);")]
+            except Error as e:
+                print(f"Error reading downloads columns: {e}")
+    return columns
+
+def find_download_page_end(after, limit):
+    """
+    Keyset pagination over rowid: returns the rowid of the last row on the
+    page of `limit` rows that starts after rowid `after`, or None if fewer
+    than `limit` rows remain.
+    """
+    select_sql = "SELECT rowid FROM downloads WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?;"
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                row = conn.execute(select_sql, (after, limit - 1)).fetchone()
+                return row[0] if row else None
+            except Error as e:
+                print(f"Error finding download page end: {e}")
+    return None
+
+def iter_download_chunks(columns, after=0, until=None, limit=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields lists of download dicts holding only `columns`, in rowid order,
+    reading `chunk_size` rows from the cursor at a time so memory stays flat
+    regardless of table size. `after`, `until` and `limit` bound the rowid range.
+    """
+    quoted_columns = ', '.join(f'"{column}"' for column in columns)
+    select_sql = f"SELECT {quoted_columns} FROM downloads WHERE rowid > ?"
+    params = [after]
+    if until is not None:
+        select_sql += " AND rowid <= ?"
+        params.append(until)
+    select_sql += " ORDER BY rowid"
+    if limit is not None:
+        select_sql += " LIMIT ?"
+        params.append(limit)
+
+    with pooled_connection() as conn:
+        if conn:
+            try:
+                cursor = conn.execute(select_sql, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [dict(zip(columns, row)) for row in rows]
+            except Error as e:
+                print(f"Error streaming downloads: {e}")
+
 def get_normalized_path(url):
     parsed_url = urlparse(url)
     return parsed_url.path.rstrip('/')
 
-def is_duplicate_download(current_download):
+def build_duplicate_check_query(current_download):
+    """
+    Builds a single query answering all three duplicate-detection layers.
+    Each applicable layer contributes an indexed EXISTS probe tagged with its
+    layer number; the probes are joined with UNION ALL and SQLite stops at the
+    first layer that produces a row. Returns (sql, params), or (None, None)
+    when the download carries none of the fields a layer needs.
+    """
+    probes = []
+    params = []
+
+    # Layer 1: id_hash_verify
     id_hash_verify = current_download.get('id_hash_verify')
     if id_hash_verify:
-        existing_download = fetch_download_by_id_hash_verify(id_hash_verify)
-        if existing_download:
-            print(f"[Layer 1] Duplicate found based on id_hash_verify: {id_hash_verify}")
-            return 0
+        probes.append("SELECT 1 WHERE EXISTS (SELECT 1 FROM downloads WHERE id_hash_verify = ?)")
+        params.append(id_hash_verify)
 
+    # Layer 2: filename plus whichever of length / last-modified / etag are known
     filename = current_download.get('filename')
-    content_length = current_download.get('content-length')
-    last_modified = current_download.get('last-modified')
-    etag = current_download.get('etag')
-
     if filename:
-        matching_downloads = fetch_downloads_by_fields(filename, content_length, last_modified, etag)
-        if matching_downloads:
-            print(f"[Layer 2] Duplicate found for filename: {filename}")
-            return 0
+        where = "filename = ?"
+        params.append(filename)
+        for column, key in (('content_length', 'content-length'),
+                            ('last_modified', 'last-modified'),
+                            ('etag', 'etag')):
+            value = current_download.get(key)
+            if value is not None:
+                where += f" AND {column} = ?"
+                params.append(value)
+        probes.append(f"SELECT 2 WHERE EXISTS (SELECT 1 FROM downloads WHERE {where})")
 
+    # Layer 3: url + referrer
     url = current_download.get('url')
     referrer = current_download.get('referrer')
     if url and referrer:
-        select_sql = "SELECT * FROM downloads WHERE url = ? AND referrer = ?;"
-        conn = create_connection()
+        probes.append("SELECT 3 WHERE EXISTS (SELECT 1 FROM downloads WHERE url = ? AND referrer = ?)")
+        params.extend([url, referrer])
+
+    if not probes:
+        return None, None
+    return " UNION ALL ".join(probes) + " LIMIT 1;", params
+
+def find_duplicate_layer(current_download, conn=None):
+    """
+    Returns the number of the first layer (1, 2 or 3) that matches an existing
+    record, or None if the download is not a duplicate. Downloads the Bloom
+    filters have never seen are answered without touching the database; the
+    rest take one round trip on `conn` if given, otherwise on a pooled
+    connection.
+    """
+    if not duplicate_index.might_be_duplicate(current_download):
+        return None
+
+    select_sql, params = build_duplicate_check_query(current_download)
+    if select_sql is None:
+        return None
+
+    if conn is not None:
+        row = conn.execute(select_sql, params).fetchone()
+        return row[0] if row else None
+
+    with pooled_connection() as conn:
         if conn:
             try:
-                cursor = conn.cursor()
-                cursor.execute(select_sql, (url, referrer))
-                row = cursor.fetchone()
-                if row:
-                    print("[Layer 3] Duplicate found based on URL and referrer.")
-                    return 0
+                row = conn.execute(select_sql, params).fetchone()
+                return row[0] if row else None
             except Error as e:
-                print(f"Error during Layer 3 duplicate check: {e}")
-            finally:
-                conn.close()
+                print(f"Error during duplicate check: {e}")
+    return None
+
+def is_duplicate_download(current_download):
+    layer = find_duplicate_layer(current_download)
+    if layer == 1:
+        print(f"[Layer 1] Duplicate found based on id_hash_verify: {current_download.get('id_hash_verify')}")
+        return 0
+    if layer == 2:
+        print(f"[Layer 2] Duplicate found for filename: {current_download.get('filename')}")
+        return 0
+    if layer == 3:
+        print("[Layer 3] Duplicate found based on URL and referrer.")
+        return 0
 
     print("No duplicate detected.")
     return 1
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+
+@pytest.fixture
+def use_fresh_database(monkeypatch):
+    """Returns a function that points the model at a new, empty database file."""
+    import model
+    from duplicate_index import DuplicateIndex
+
+    def use(path):
+        model.close_all_connections()
+        monkeypatch.setattr(model, 'DATABASE', str(path))
+        monkeypatch.setattr(model, 'duplicate_index', DuplicateIndex())
+        model.initialize_db()
+        model.rebuild_duplicate_index(force=True)
+
+    yield use
+    model.close_all_connections()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch, use_fresh_database):
+    """Imports the app against an empty downloads.db in a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    use_fresh_database(tmp_path / 'downloads.db')
+    import main
+    yield main
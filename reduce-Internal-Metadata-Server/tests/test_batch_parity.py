@@ -0,0 +1,61 @@
+import model
+
+
+def payload(n, filename=None, length=100, url=None, referrer='https://example.com/'):
+    url = url or f'https://example.com/files/{n}.bin'
+    return {
+        'id': str(n),
+        'data': {
+            'download_meta_data': {'finalUrl': url, 'url': url, 'referrer': referrer},
+            'fetched_complete_metadata': {'content-length': str(length), 'etag': f'"{n}"'},
+            'downloadFileNameDomainUrlDetails': {'downloadFileName': filename or f'{n}.bin',
+                                                 'domain': 'example.com'},
+            'partial_hash': f'hash-{n}',
+            'device_info': {},
+        },
+    }
+
+
+PAYLOADS = [
+    payload(1),
+    payload(2),
+    payload(3, filename='1.bin'),                            # layer 1: same name and length as 1
+    payload(4, filename='2.bin', length=200),                # same name as 2, but length and etag differ
+    payload(5, url='https://example.com/files/2.bin'),       # layer 3: same url and referrer as 2
+    payload(6, url='https://example.com/files/2.bin', referrer='https://other.example/'),
+    {'id': '7'},                                             # invalid
+    payload(8),
+    payload(8),                                              # exact repeat
+]
+
+
+def stored_rows():
+    with model.pooled_connection() as conn:
+        return conn.execute(
+            'SELECT id_hash_verify, status, url, referrer FROM downloads ORDER BY rowid').fetchall()
+
+
+def test_batch_matches_one_by_one(server, tmp_path, use_fresh_database):
+    client = server.app.test_client()
+    single_actions = []
+    for item in PAYLOADS:
+        response = client.post('/process_download', json=item)
+        single_actions.append(response.get_json()['action'] if response.status_code == 200 else None)
+    single_rows = stored_rows()
+
+    use_fresh_database(tmp_path / 'batch.db')
+    response = client.post('/process_downloads', json=PAYLOADS)
+    assert response.status_code == 200
+    body = response.get_json()
+
+    assert body['actions'] == single_actions
+    assert list(body['errors']) == ['6']
+    assert stored_rows() == single_rows
+    assert single_actions == [0, 0, 1, 0, 1, 0, None, 0, 1]
+
+
+def test_batch_sees_records_from_earlier_requests(server):
+    client = server.app.test_client()
+    assert client.post('/process_download', json=payload(1)).get_json() == {'action': 0}
+    body = client.post('/process_downloads', json=[payload(1), payload(2)]).get_json()
+    assert body['actions'] == [1, 0]
@@ -0,0 +1,167 @@
+import threading
+
+from duplicate_index import DuplicateIndex
+
+
+def record(n):
+    return {'id_hash_verify': f'id-{n}', 'filename': f'file-{n}.bin',
+            'url': f'https://example.com/{n}', 'referrer': 'https://example.com/',
+            'partial_hash_verify': f'hash-{n}'}
+
+
+def built_index():
+    index = DuplicateIndex()
+    assert index.try_begin_rebuild(force=True)
+    index.rebuild([], 0)
+    return index
+
+
+def test_only_one_caller_claims_a_rebuild():
+    index = built_index()
+    index.count = index.filters['id_hash'].capacity + 1
+    assert index.needs_rebuild()
+    assert index.try_begin_rebuild()
+    assert not index.try_begin_rebuild()
+    assert not index.try_begin_rebuild(force=True)
+    index.abort_rebuild()
+    assert index.try_begin_rebuild()
+
+
+def test_claim_requires_an_overfull_index_unless_forced():
+    index = built_index()
+    assert not index.try_begin_rebuild()
+    assert index.try_begin_rebuild(force=True)
+
+
+def test_rebuild_replays_every_uncommitted_key():
+    index = built_index()
+    # More uncommitted rows than the largest accepted batch
+    tokens = [index.add(record(n)) for n in range(6000)]
+    assert index.try_begin_rebuild(force=True)
+    index.rebuild([], 0)  # Uncommitted rows are not in the database yet
+    assert all(index.might_be_duplicate(record(n)) for n in range(6000))
+    index.commit(tokens)
+    assert not index.uncommitted
+
+
+def test_rebuild_replays_keys_added_while_it_runs():
+    index = built_index()
+    assert index.try_begin_rebuild(force=True)
+
+    def records():
+        index.add(record(1))
+        yield record(0)
+
+    index.rebuild(records(), 1)
+    assert index.might_be_duplicate(record(0))
+    assert index.might_be_duplicate(record(1))
+    assert index.count == 2
+
+
+def test_rollback_removes_keys_and_skips_replay():
+    index = built_index()
+    token = index.add(record(1))
+    assert index.try_begin_rebuild(force=True)
+    index.rollback([token])
+    index.rebuild([], 0)
+    assert not index.might_be_duplicate(record(1))
+    assert index.count == 0
+
+
+def test_rollback_after_commit_is_ignored():
+    index = built_index()
+    token = index.add(record(1))
+    index.commit([token])
+    index.rollback([token])
+    assert index.might_be_duplicate(record(1))
+    assert index.count == 1
+
+
+def test_rebuild_drops_rows_deleted_after_its_snapshot():
+    index = built_index()
+    index.commit([index.add(record(0))])
+    assert index.try_begin_rebuild(force=True)
+    index.mark_snapshot()
+
+    def records():
+        yield record(1)
+        index.remove(record(0))  # Deleted while the snapshot is streamed
+        yield record(0)
+
+    index.rebuild(records(), 2)
+    assert not index.might_be_duplicate(record(0))
+    assert index.might_be_duplicate(record(1))
+    assert index.count == 1
+
+
+def test_delete_before_the_snapshot_leaves_other_records_alone():
+    index = built_index()
+    # Two records sharing a filename: both keep the filename key counted
+    shared = dict(record(1), filename=record(0)['filename'])
+    index.commit([index.add(record(0)), index.add(shared)])
+    assert index.try_begin_rebuild(force=True)
+    index.remove(record(0))  # Committed before the snapshot was taken
+    index.mark_snapshot()
+    index.rebuild([shared], 1)
+    assert index.might_be_duplicate({'filename': shared['filename']})
+    assert index.count == 1
+
+
+def test_delete_interleaved_with_a_rebuild(server, monkeypatch):
+    import model
+
+    for n in range(3):
+        model.insert_download(dict(record(n), status='completed'))
+    index = model.duplicate_index
+    rebuild = index.rebuild
+
+    def rebuild_with_a_delete(records, record_count):
+        def interleaved():
+            for n, row in enumerate(records):
+                if n == 1:
+                    assert model.delete_record_by_partial_hash(record(0)['partial_hash_verify'])
+                yield row
+        rebuild(interleaved(), record_count)
+
+    monkeypatch.setattr(index, 'rebuild', rebuild_with_a_delete)
+    model.rebuild_duplicate_index(force=True)
+    assert not index.might_be_duplicate(record(0))
+    assert not index.might_contain_partial_hash(record(0)['partial_hash_verify'])
+    assert index.might_be_duplicate(record(1))
+    assert index.count == 2
+
+
+def test_concurrent_rebuilds_do_not_fail(server):
+    import model
+
+    for n in range(50):
+        model.insert_download(dict(record(n), status='completed'))
+    model.duplicate_index.count = model.duplicate_index.filters['id_hash'].capacity + 1
+
+    errors = []
+
+    def rebuild():
+        try:
+            model.rebuild_duplicate_index()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=rebuild) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert model.duplicate_index.pending is None
+    assert model.duplicate_index.count == 50
+
+
+def test_rejected_insert_does_not_grow_the_index(server):
+    import model
+
+    model.insert_download(dict(record(1), status='completed'))
+    count = model.duplicate_index.count
+    # Same id_hash_verify: rejected by the UNIQUE constraint
+    model.insert_download(dict(record(1), filename='other.bin', status='cancelled'))
+    assert model.duplicate_index.count == count
+    assert not model.duplicate_index.uncommitted